@@ -0,0 +1,12 @@
+from . import clock
+
+DIRECTION_CCW = 0  # Clockwise
+DIRECTION_CW = 1  # Counter-Clockwise
+
+
+def sleep_microseconds(us_to_sleep):
+  clock.sleep_us(us_to_sleep)
+
+
+# Mimics the Arduino micros() function, on the shared monotonic clock.
+micros = clock.monotonic_us
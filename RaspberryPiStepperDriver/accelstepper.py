@@ -1,35 +1,34 @@
-from datetime import datetime
-import asyncio, logging, time
+import asyncio, logging
 import RPi.GPIO as GPIO
-from activators import stepdir as stepdir_act
-
-DIRECTION_CCW = 0  # Clockwise
-DIRECTION_CW = 1  # Counter-Clockwise
-
-
-def sleep_microseconds(us_to_sleep):
-  time.sleep(us_to_sleep / float(1000000))
+from .activators import stepdir as stepdir_act
+from . import DIRECTION_CW, DIRECTION_CCW, sleep_microseconds, micros
+from .step_timing import StepTimingStats
+from .spin_window import SpinWindow
 
 
 def constrain(value, minn, maxn):
   return max(min(maxn, value), minn)
 
 
-def micros():
-    """
-    Mimics the Arduino micros() function.
-    """
-    return int(time.time() * 1000000)
-
-
 class AccelStepper:
 
-    def __init__(self, profile, dir_pin, step_pin, enable_pin=None, pin_mode=GPIO.BCM):
+    def __init__(self, profile, dir_pin, step_pin, enable_pin=None, pin_mode=GPIO.BCM, step_timing=True):
+        """
+        Arguments:
+          step_timing (StepTimingStats): Where to record step lateness. True for a new one, None to not record it.
+        """
         self._profile = profile
-        # Time that this object was instantiated. Used for computing micros()
-        self._start_time = datetime.now()
         # Time in microseconds that last step occurred
         self._last_step_time_us = 0
+        # Scheduled versus actual step times
+        self.step_timing = StepTimingStats() if step_timing is True else step_timing
+        # Whether the previous call to run_at_speed() was part of an ongoing run of steps.
+        # Lateness means nothing for the first step of a move.
+        self._stepping = False
+        # How long before a step is due run_forever() stops sleeping and spins.
+        self.spin_window = SpinWindow()
+        # Set when the motion plan changes, to wake run_forever() early. Created by run_forever().
+        self._plan_changed = None
         self._activator = stepdir_act.StepDirActivator(dir_pin, step_pin, enable_pin, pin_mode)
 
     @property
@@ -67,6 +66,7 @@ class AccelStepper:
           speed (float): Steps per second
         """
         self._profile.set_target_speed(speed)
+        self._replan()
 
     def set_acceleration(self, acceleration):
         """
@@ -75,6 +75,7 @@ class AccelStepper:
           acceleration (float). Acceleration in steps per second per second.
         """
         self._profile.set_acceleration(acceleration)
+        self._replan()
 
     def move_to(self, absolute_steps):
         """
@@ -84,6 +85,7 @@ class AccelStepper:
             self._profile._previous_target_steps = self._profile._target_steps
             self._profile._target_steps = absolute_steps
             self._profile.compute_new_speed()
+            self._replan()
 
     def move(self, relative_steps):
         """
@@ -91,14 +93,44 @@ class AccelStepper:
         """
         self.move_to(self._profile._current_steps + relative_steps)
 
-    async def run_forever(self):
+    async def run_forever(self, busy=False):
         """
-        Continuously call run() as fast as possible.
+        Continuously call run(), sleeping until each step is due.
+
+        Arguments:
+          busy (bool): Call run() as fast as possible instead, yielding to the
+            event loop in between. Burns a whole core.
         """
+        self._plan_changed = asyncio.Event()
         while True:
             await self.run()
-            # Without this await, we never yield back to the event loop
-            await asyncio.sleep(0)
+            if busy:
+                # Without this await, we never yield back to the event loop
+                await asyncio.sleep(0)
+            else:
+                await self.wait_for_next_step()
+
+    async def wait_for_next_step(self):
+        """
+        Sleep until the next step is due, or the motion plan changes.
+
+        Sleeps with asyncio.sleep() until spin_window before the deadline, then
+        yields to the event loop until it arrives. Without a move to make, sleeps
+        until move_to() or one of the setters is called.
+        """
+        plan_changed = self._plan_changed
+        plan_changed.clear()
+        if not self._profile._step_interval_us or not self._profile.distance_to_go:
+            await plan_changed.wait()
+            return
+
+        interval_us = self._profile._step_interval_us
+        await self.spin_window.sleep_until(self._last_step_time_us + interval_us, plan_changed, interval_us)
+
+    def _replan(self):
+        """The step interval or target may have changed, wake run_forever() to recompute its deadline."""
+        if self._plan_changed is not None:
+            self._plan_changed.set()
 
     async def run(self):
         """
@@ -121,11 +153,10 @@ class AccelStepper:
         # Dont do anything unless we actually have a step interval
         # Dont do anything unless we have somewhere to go
         if not self._profile._step_interval_us or not self._profile.distance_to_go:
+            self._stepping = False
             return False
 
-        # Time since this class was created in micrseconds.
-        # Basically the Arduino micros() function.
-        # time_us = (datetime.now() - self._start_time).total_seconds() * 1000000
+        # The Arduino micros() function, on the shared clock.
         current_time_us = micros()
 
         next_step_time_us = self._last_step_time_us + self._profile._step_interval_us
@@ -140,6 +171,9 @@ class AccelStepper:
                 # Anticlockwise
                 self._profile._current_steps -= 1
             self.step(self._profile._direction)
+            if self._stepping and self.step_timing is not None:
+                self.step_timing.record(current_time_us, current_time_us - next_step_time_us, self._profile._step_interval_us)
+            self._stepping = True
 
             self._last_step_time_us = current_time_us
             # self._next_step_time_us = current_time_us + self._step_interval_us
@@ -157,6 +191,12 @@ class AccelStepper:
         while self.is_moving:
             await asyncio.sleep(0)
 
+    def step_timing_statistics(self) -> dict:
+        """
+        How late steps have been taken, see StepTimingStats.snapshot().
+        """
+        return self.step_timing.snapshot() if self.step_timing is not None else {}
+
     def step(self, direction):
         self._activator.step(self._profile._direction)
 
@@ -166,6 +206,7 @@ class AccelStepper:
         Sets speed to 0
         """
         self._profile.set_current_position(position)
+        self._replan()
 
     def abort(self):
         self.set_current_position(self._profile._current_steps)
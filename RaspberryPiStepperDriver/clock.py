@@ -0,0 +1,100 @@
+"""
+Monotonic clock shared by the app and the stepper drivers.
+
+Times are integers derived from time.monotonic_ns(), so they don't jump when
+NTP adjusts the wall clock and don't lose precision however long the Pi has
+been up.  Everything reads the time and sleeps through this module, so tests
+can swap in a VirtualClock with use_clock() and step time by hand.
+"""
+import contextlib
+import time
+
+
+class SystemClock:
+    """The real monotonic clock."""
+
+    def now_ns(self):
+        return time.monotonic_ns()
+
+    def sleep_ns(self, duration_ns):
+        time.sleep(max(duration_ns, 0) / 1000000000.0)
+
+
+class VirtualClock:
+    """A clock that only moves when told to.  Sleeping advances it instead of blocking."""
+
+    def __init__(self, start_ns=0):
+        self._now_ns = int(start_ns)
+
+    def now_ns(self):
+        return self._now_ns
+
+    def sleep_ns(self, duration_ns):
+        self.advance_ns(max(duration_ns, 0))
+
+    def advance_ns(self, duration_ns):
+        self._now_ns += int(duration_ns)
+
+    def advance_us(self, duration_us):
+        self.advance_ns(duration_us * 1000)
+
+    def advance_ms(self, duration_ms):
+        self.advance_ns(duration_ms * 1000000)
+
+    def set_ns(self, now_ns):
+        self._now_ns = int(now_ns)
+
+
+system_clock = SystemClock()
+_source = system_clock
+# Bound methods of the current source, looked up once per use_clock() rather than per call.
+_now_ns = time.monotonic_ns
+_sleep_ns = system_clock.sleep_ns
+
+
+def current_clock():
+    return _source
+
+
+def use_clock(source=None):
+    """
+    Make source (a SystemClock, VirtualClock or anything with now_ns() and
+    sleep_ns()) the clock for everything.  None restores the system clock.
+    Returns the previous clock.
+    """
+    global _source, _now_ns, _sleep_ns
+    previous = _source
+    _source = system_clock if source is None else source
+    _now_ns = time.monotonic_ns if _source is system_clock else _source.now_ns
+    _sleep_ns = _source.sleep_ns
+    return previous
+
+
+@contextlib.contextmanager
+def using_clock(source):
+    """use_clock() for the duration of a with block."""
+    previous = use_clock(source)
+    try:
+        yield source
+    finally:
+        use_clock(previous)
+
+
+def monotonic_ns():
+    return _now_ns()
+
+
+def monotonic_us():
+    return _now_ns() // 1000
+
+
+def monotonic_ms():
+    return _now_ns() // 1000000
+
+
+def sleep_ns(duration_ns):
+    _sleep_ns(duration_ns)
+
+
+def sleep_us(duration_us):
+    _sleep_ns(int(duration_us * 1000))
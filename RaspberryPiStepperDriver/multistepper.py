@@ -0,0 +1,187 @@
+"""
+Coordinated moves of several AccelSteppers.
+
+Based on MultiStepper from AccelStepper (http://www.airspayce.com/mikem/arduino/AccelStepper),
+which moves every axis at a constant speed chosen so they all arrive at the
+same time.  Here the axes keep their acceleration profiles: each move is
+planned as one trapezoid over the fraction of the move completed, limited by
+whichever axis can least afford it, and every axis runs that trapezoid scaled
+by its own distance.  The ramps are then time-scaled copies of each other, so
+the axes start, cruise and stop together.
+
+All the axes are stepped from one coroutine, which sleeps until the earliest
+of their step deadlines rather than running one busy loop per motor.
+"""
+import asyncio
+
+from . import micros
+from .spin_window import SpinWindow
+
+# Enough for any machine the Pi can drive; the same as the Arduino library.
+MULTISTEPPER_MAX_STEPPERS = 10
+
+
+class MultiStepper:
+
+    def __init__(self, steppers=()):
+        self._steppers = []
+        # (max speed, acceleration) of each axis, as configured when it was added.
+        self._limits = []
+        # How long before a step is due run_forever() stops sleeping and spins.
+        self.spin_window = SpinWindow()
+        # Set when a move is planned, to wake run_forever() early. Created by run_forever().
+        self._plan_changed = None
+        self._run_forever_future = None
+        for stepper in steppers:
+            self.add_stepper(stepper)
+
+    @property
+    def steppers(self):
+        return tuple(self._steppers)
+
+    @property
+    def is_moving(self):
+        for stepper in self._steppers:
+            if stepper.is_moving:
+                return True
+        return False
+
+    @property
+    def positions(self):
+        return [stepper.position for stepper in self._steppers]
+
+    def add_stepper(self, stepper, max_speed=None, acceleration=None):
+        """
+        Add an axis.  Its moves will never be planned faster than max_speed or
+        acceleration, which default to what the stepper is set to now.
+        Don't call the stepper's own start(), only this class's.
+
+        Returns the index of the axis.
+        """
+        if len(self._steppers) >= MULTISTEPPER_MAX_STEPPERS:
+            raise ValueError("A MultiStepper takes at most %d steppers" % MULTISTEPPER_MAX_STEPPERS)
+        self._steppers.append(stepper)
+        self._limits.append((
+            stepper._profile._target_speed if max_speed is None else max_speed,
+            stepper.acceleration if acceleration is None else acceleration,
+        ))
+        return len(self._steppers) - 1
+
+    def set_limits(self, index, max_speed, acceleration=None):
+        """Change the speed and acceleration an axis is limited to, for the next move_to()."""
+        self._limits[index] = (max_speed, self._limits[index][1] if acceleration is None else acceleration)
+
+    def move_to(self, absolute_steps):
+        """
+        Schedule a coordinated move, one absolute position per axis.  The axes
+        should be stopped; a move planned while they are moving still
+        arrives, but not necessarily together.
+        """
+        if len(absolute_steps) != len(self._steppers):
+            raise ValueError("Expected %d positions, got %d" % (len(self._steppers), len(absolute_steps)))
+
+        # Largest speed and acceleration, as fractions of the move per second, that every axis can manage.
+        move_speed = move_acceleration = None
+        for stepper, (max_speed, acceleration), target in zip(self._steppers, self._limits, absolute_steps):
+            distance = abs(target - stepper.position)
+            if distance == 0:
+                continue
+            if move_speed is None or max_speed / distance < move_speed:
+                move_speed = max_speed / distance
+            if acceleration and (move_acceleration is None or acceleration / distance < move_acceleration):
+                move_acceleration = acceleration / distance
+
+        now_us = micros()
+        for stepper, target in zip(self._steppers, absolute_steps):
+            distance = abs(target - stepper.position)
+            if distance:
+                stepper.set_target_speed(move_speed * distance)
+                if move_acceleration is not None:
+                    stepper.set_acceleration(move_acceleration * distance)
+                if not stepper.is_moving:
+                    # Take the first step one interval from now rather than straight away. Otherwise
+                    # the short axes, with their long intervals, finish about an interval early.
+                    stepper._last_step_time_us = now_us
+            stepper.move_to(target)
+        self._replan()
+
+    def move(self, relative_steps):
+        """Schedule a coordinated move relative to the current positions."""
+        self.move_to([stepper.position + steps for stepper, steps in zip(self._steppers, relative_steps)])
+
+    def next_step_time_us(self):
+        """When the earliest step of any axis is due, or None if none of them are moving."""
+        return self._next_step()[0]
+
+    def _next_step(self):
+        """(When the earliest step of any axis is due, that axis' step interval), or (None, None)."""
+        deadline_us = interval_us = None
+        for stepper in self._steppers:
+            profile = stepper._profile
+            if profile._step_interval_us and profile.distance_to_go:
+                due_us = stepper._last_step_time_us + profile._step_interval_us
+                if deadline_us is None or due_us < deadline_us:
+                    deadline_us, interval_us = due_us, profile._step_interval_us
+        return deadline_us, interval_us
+
+    async def run(self):
+        """
+        Step every axis that is due.  Call this at least once per step of the
+        fastest axis.  Returns true if any axis is still moving.
+        """
+        moving = False
+        for stepper in self._steppers:
+            if await stepper.run():
+                moving = True
+        return moving
+
+    async def run_forever(self, busy=False):
+        """
+        Continuously call run(), sleeping until the next step of any axis is due.
+
+        Arguments:
+          busy (bool): Call run() as fast as possible instead, yielding to the
+            event loop in between. Burns a whole core.
+        """
+        self._plan_changed = asyncio.Event()
+        while True:
+            await self.run()
+            if busy:
+                await asyncio.sleep(0)
+            else:
+                await self.wait_for_next_step()
+
+    async def wait_for_next_step(self):
+        """Sleep until the next step of any axis is due, or a new move is planned."""
+        plan_changed = self._plan_changed
+        plan_changed.clear()
+        deadline_us, interval_us = self._next_step()
+        if deadline_us is None:
+            await plan_changed.wait()
+            return
+        await self.spin_window.sleep_until(deadline_us, plan_changed, interval_us)
+
+    def _replan(self):
+        if self._plan_changed is not None:
+            self._plan_changed.set()
+
+    async def run_to_position(self):
+        """
+        'blocks' until every axis has arrived.  Needs start() or run_forever()
+        to be running.
+        """
+        while self.is_moving:
+            await asyncio.sleep(0)
+
+    def step_timing_statistics(self) -> list:
+        """StepTimingStats.snapshot() of each axis."""
+        return [stepper.step_timing_statistics() for stepper in self._steppers]
+
+    def start(self):
+        for stepper in self._steppers:
+            stepper._activator.start()
+        self._run_forever_future = asyncio.ensure_future(self.run_forever())
+
+    def stop(self):
+        if self._run_forever_future is not None:
+            self._run_forever_future.cancel()
@@ -1,15 +1,21 @@
 from . import RampProfile, DIRECTION_CW, DIRECTION_CCW
+from .ramp_cache import default_ramp_cache, initial_delay_us
 """
 Calculates AccelStepper profile.
 Based on AccelStepper (http://www.airspayce.com/mikem/arduino/AccelStepper).
 """
-import logging, math
+import logging
 
 log = logging.getLogger(__name__)
 
 class AccelProfile(RampProfile):
 
-  def __init__(self):
+  def __init__(self, ramp_cache=default_ramp_cache):
+    """
+    Arguments:
+      ramp_cache (RampTableCache): Where to get precomputed ramps from, or None to
+        evaluate Equation 13 on every step.
+    """
     super().__init__()
 
     # Acceleration in steps per second per second
@@ -26,6 +32,12 @@ class AccelProfile(RampProfile):
     self._ramp_delay_n_us = 0.0
     # Minimum microseconds for ramp delay
     self._ramp_delay_min_us = 1.0
+    # Precomputed 1 / (2*_acceleration) for Equation 16
+    self._inverse_two_acceleration = 0.0
+    # Cache of ramp tables, and the table for the current (acceleration, target speed).
+    # None until looked up, empty if there is no table to use.
+    self._ramp_cache = ramp_cache
+    self._ramp_table = None
 
   def set_target_speed(self, speed):
     """
@@ -38,6 +50,7 @@ class AccelProfile(RampProfile):
       return
     self._target_speed = speed
     self._ramp_delay_min_us = 1000000.0 / speed
+    self._ramp_table = None
     # Recompute _ramp_step_number from current speed and adjust speed if accelerating or cruising
     if (self._ramp_step_number > 0):
       self._ramp_step_number = ((self._current_speed * self._current_speed) / (2.0 * self._acceleration)) # Equation 16
@@ -54,13 +67,15 @@ class AccelProfile(RampProfile):
     # Recompute _ramp_step_number per Equation 17
     self._ramp_step_number = self._ramp_step_number * (self._acceleration / acceleration)
     # New c0 per Equation 7, with correction per Equation 15
-    self._ramp_delay_0_us = 0.676 * math.sqrt(2.0 / acceleration) * 1000000.0 # Equation 15
+    self._ramp_delay_0_us = initial_delay_us(acceleration) # Equation 15
     self._acceleration = acceleration
+    self._inverse_two_acceleration = 1.0 / (2.0 * acceleration)
+    self._ramp_table = None
     self.compute_new_speed()
 
   def compute_new_speed(self):
     distanceTo = self.distance_to_go     # +ve is clockwise from curent location
-    stepsToStop = int(((self._current_speed * self._current_speed) / (2.0 * self._acceleration))) # Equation 16
+    stepsToStop = int(self._current_speed * self._current_speed * self._inverse_two_acceleration) # Equation 16
 
     if distanceTo == 0 and stepsToStop <= 1:
       # We are at the target and its time to stop
@@ -103,8 +118,21 @@ class AccelProfile(RampProfile):
       self._direction = self._current_direction()
     else:
       # Subsequent step. Works for accel (n is +_ve) and decel (n is -ve).
-      self._ramp_delay_n_us = self._ramp_delay_n_us - ((2.0 * self._ramp_delay_n_us) / ((4.0 * self._ramp_step_number) + 1)) # Equation 13
-      self._ramp_delay_n_us = max(self._ramp_delay_n_us, self._ramp_delay_min_us)
+      table = self._ramp_table
+      if table is None:
+        table = self._load_ramp_table()
+      if not table:
+        # No table (disabled or ramp too long), evaluate Equation 13 directly.
+        self._ramp_delay_n_us = self._ramp_delay_n_us - ((2.0 * self._ramp_delay_n_us) / ((4.0 * self._ramp_step_number) + 1)) # Equation 13
+        self._ramp_delay_n_us = max(self._ramp_delay_n_us, self._ramp_delay_min_us)
+      else:
+        if self._ramp_step_number > 0:
+          # Accelerating: step n of the ramp, or cruising once past its end.
+          index = int(self._ramp_step_number)
+        else:
+          # Decelerating with n = -k walks the ramp backwards, k steps from standstill.
+          index = max(int(-self._ramp_step_number) - 1, 0)
+        self._ramp_delay_n_us = table[index] if index < len(table) else self._ramp_delay_min_us
 
     self._ramp_step_number += 1
     self._step_interval_us = self._ramp_delay_n_us
@@ -112,10 +140,22 @@ class AccelProfile(RampProfile):
     if self._direction == DIRECTION_CCW:
       self._current_speed = -self._current_speed
 
-    log.debug('Computed new speed. _direction=%s, _current_steps=%s, _target_steps=%s, distance_to_go=%s, _ramp_step_number=%s, _current_speed=%s, _step_interval_us=%s',
-      self._direction, self._current_steps,
-      self._target_steps, self.distance_to_go,
-      self._ramp_step_number, self._current_speed, self._step_interval_us)
+    if log.isEnabledFor(logging.DEBUG):
+      log.debug('Computed new speed. _direction=%s, _current_steps=%s, _target_steps=%s, distance_to_go=%s, _ramp_step_number=%s, _current_speed=%s, _step_interval_us=%s',
+        self._direction, self._current_steps,
+        self._target_steps, self.distance_to_go,
+        self._ramp_step_number, self._current_speed, self._step_interval_us)
+
+  def _load_ramp_table(self):
+    """
+    Fetch the ramp table for the current acceleration and target speed.
+    Returns an empty tuple if there is no cache or the ramp is too long to cache.
+    """
+    table = None
+    if self._ramp_cache is not None:
+      table = self._ramp_cache.get(self._acceleration, self._target_speed)
+    self._ramp_table = table if table is not None else ()
+    return self._ramp_table
 
   def set_current_position(self, position):
     """
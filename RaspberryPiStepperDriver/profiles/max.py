@@ -49,7 +49,7 @@ class MaxProfile(RampProfile):
       self._direction = self.calc_direction(self.distance_to_go)
 
     # Make sure accelerate and decelerate ramps don't overlap
-    _steps_being_moved = abs(abs(self._target_steps) - abs(self.parent._previous_target_steps))
+    _steps_being_moved = abs(abs(self._target_steps) - abs(self._previous_target_steps))
     _adjusted_deceleration_steps = min(self._deceleration_steps, _steps_being_moved - self._acceleration_steps)
     # HACK fix the math so this conditional is not needed
     if _adjusted_deceleration_steps <= 0:
@@ -0,0 +1,106 @@
+"""
+Precomputed acceleration ramps for AccelProfile.
+
+The ramp for a given (acceleration, target_speed) pair is deterministic: step
+n of the ramp always has the same delay.  Rather than re-evaluating Equation 13
+on every step, the whole sequence is computed once and kept in an LRU cache.
+"""
+from array import array
+from collections import OrderedDict
+import logging, math
+
+log = logging.getLogger(__name__)
+
+def initial_delay_us(acceleration):
+  """
+  c0 per Equation 7, with correction per Equation 15.
+  """
+  return 0.676 * math.sqrt(2.0 / acceleration) * 1000000.0
+
+def build_ramp_table(acceleration, target_speed, max_length):
+  """
+  Compute the step delays of a ramp from standstill up to target_speed.
+
+  table[n] is the delay used when the ramp step number is n, so table[0] is c0
+  and the last entry is the cruising delay.  Returns None if the ramp is longer
+  than max_length steps.
+  """
+  min_delay_us = 1000000.0 / target_speed
+  delay_us = initial_delay_us(acceleration)
+  table = array('d', [delay_us])
+  n = 1
+  while delay_us > min_delay_us:
+    if n >= max_length:
+      return None
+    delay_us = delay_us - ((2.0 * delay_us) / ((4.0 * n) + 1)) # Equation 13
+    delay_us = max(delay_us, min_delay_us)
+    table.append(delay_us)
+    n += 1
+  return table
+
+class RampTableCache:
+  """
+  LRU cache of ramp tables keyed by (acceleration, target_speed).
+  Memory is bounded by the total number of delays held across all tables.
+  """
+
+  def __init__(self, max_entries=262144, max_table_length=65536):
+    """
+    Arguments:
+      max_entries (int): Most delays held across all tables before the least recently used is evicted.
+      max_table_length (int): Ramps longer than this aren't cached.
+    """
+    self._tables = OrderedDict()
+    self._entries = 0
+    self.max_entries = max_entries
+    self.max_table_length = max_table_length
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self._tables)
+
+  @property
+  def entries(self):
+    return self._entries
+
+  def clear(self):
+    self._tables.clear()
+    self._entries = 0
+
+  def get(self, acceleration, target_speed):
+    """
+    Return the ramp table for the pair, building it if needed.
+    Returns None if the ramp is too long to cache.
+    """
+    key = (acceleration, target_speed)
+    table = self._tables.get(key)
+    if table is not None:
+      self._tables.move_to_end(key)
+      self.hits += 1
+      return table
+
+    self.misses += 1
+    table = build_ramp_table(acceleration, target_speed, min(self.max_table_length, self.max_entries))
+    if table is None:
+      return None
+    self._tables[key] = table
+    self._entries += len(table)
+    while self._entries > self.max_entries:
+      evicted_key, evicted = self._tables.popitem(last=False)
+      self._entries -= len(evicted)
+      self.evictions += 1
+      log.debug('Evicted ramp table %s (%s entries)', evicted_key, len(evicted))
+    return table
+
+  def snapshot(self):
+    return {
+      "tables": len(self._tables),
+      "entries": self._entries,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
+
+default_ramp_cache = RampTableCache()
@@ -0,0 +1,319 @@
+"""
+Offline motion simulator for the ramp profiles.
+
+Reproduces what AccelStepper.run() does when it is called continuously with
+perfect timing, without any GPIO or waiting in real time: each step happens
+exactly _step_interval_us after the previous one.  The traces match the
+step-by-step profile code exactly.
+
+Stretches where the profile's next states can be worked out in advance are
+computed as a batch:
+  RectangleProfile  the whole move runs at a constant interval.
+  AccelProfile      the ramp follows its cached ramp table (numpy only), or
+                    cruises at the minimum delay.
+Everything else (MaxProfile, direction changes, the last step of a move) goes
+through compute_new_speed() one step at a time.
+"""
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, repeat
+
+from .profiles import DIRECTION_CW
+from .profiles.accel import AccelProfile
+from .profiles.rectangle import RectangleProfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Most steps looked ahead at once when walking a ramp table.
+BATCH_LOOKAHEAD = 4096
+# Fewer steps than this are quicker to walk through one at a time than with numpy.
+BATCH_MINIMUM = 128
+
+
+class MotionTrace:
+    """Per-step traces of a simulated move."""
+
+    def __init__(self):
+        self.times_us = array('d')
+        """Time of each step."""
+        self.positions = array('q')
+        """Position after each step."""
+        self.intervals_us = array('d')
+        """Step interval the step was taken at."""
+        self.speeds = array('d')
+        """Profile speed (steps per second, signed) the step was taken at."""
+
+    def __len__(self):
+        return len(self.times_us)
+
+    def duration_us(self):
+        return self.times_us[-1] - self.times_us[0] if self.times_us else 0.0
+
+
+class MotionSimulator:
+    """
+    Drives a profile the way AccelStepper does, in simulated time.
+
+    Use move_to() to set targets and run_until()/run_to_completion() to step.
+    """
+
+    def __init__(self, profile, batch=True):
+        """
+        Arguments:
+          profile (RampProfile): The profile to simulate.  It is mutated as it
+            would be by AccelStepper.
+          batch (bool): Compute steady stretches as a batch instead of stepping
+            through them.  The result is the same either way.
+        """
+        self.profile = profile
+        self.batch = batch
+        self.now_us = 0.0
+        """Current simulated time."""
+        self.last_step_us = float('-inf')
+        """Time of the last step.  The first step happens as soon as there is somewhere to go."""
+        self.trace = MotionTrace()
+
+    def move_to(self, absolute_steps):
+        """Same as AccelStepper.move_to()."""
+        profile = self.profile
+        if profile._target_steps != absolute_steps:
+            profile._previous_target_steps = profile._target_steps
+            profile._target_steps = absolute_steps
+            profile.compute_new_speed()
+
+    def run_to_completion(self, max_steps=10000000):
+        """Step until the profile stops.  Returns the trace."""
+        self._run(None, max_steps)
+        return self.trace
+
+    def run_until(self, end_us):
+        """Take every step due before end_us, then advance the clock to end_us."""
+        self._run(end_us, None)
+        self.now_us = max(self.now_us, end_us)
+        return self.trace
+
+    def _run(self, end_us, max_steps):
+        profile = self.profile
+        trace = self.trace
+        batch = self.batch and type(profile) in (RectangleProfile, AccelProfile)
+        # Only walk the ramp table with numpy if there is time for a worthwhile batch.
+        walk_ramp = (batch and numpy is not None and type(profile) is AccelProfile
+                     and (end_us is None or end_us - self.now_us >= BATCH_MINIMUM * profile._ramp_delay_min_us))
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            interval_us = profile._step_interval_us
+            if not interval_us or not profile.distance_to_go:
+                return
+            step_us = self.last_step_us + interval_us
+            if step_us < self.now_us:
+                step_us = self.now_us
+            elif batch:
+                limit = None if max_steps is None else max_steps - steps
+                count = self._run_batch(end_us, limit, walk_ramp)
+                if count:
+                    steps += count
+                    continue
+            if end_us is not None and step_us >= end_us:
+                return
+
+            # It is time to do a step, exactly as AccelStepper.run() does.
+            speed = profile._current_speed
+            if profile._direction == DIRECTION_CW:
+                profile._current_steps += 1
+            else:
+                profile._current_steps -= 1
+            self.last_step_us = self.now_us = step_us
+            trace.times_us.append(step_us)
+            trace.positions.append(profile._current_steps)
+            trace.intervals_us.append(interval_us)
+            trace.speeds.append(speed)
+            profile.compute_new_speed()
+            steps += 1
+
+    def _run_batch(self, end_us, limit, walk_ramp):
+        """
+        Take as many steps as can be computed in advance, at most limit and all
+        before end_us.  Returns the number of steps taken, 0 if none could be.
+        """
+        profile = self.profile
+        if (not walk_ramp and type(profile) is AccelProfile
+                and profile._step_interval_us != profile._ramp_delay_min_us):
+            # Not walking the ramp table, so only cruising is batched.
+            return 0
+        distance = abs(profile.distance_to_go)
+        direction = 1 if profile._direction == DIRECTION_CW else -1
+        if (profile.distance_to_go > 0) != (direction > 0):
+            return 0
+        # Leave the last step of a move to compute_new_speed().
+        count = distance - 1
+        if limit is not None:
+            count = min(count, limit)
+        if count < 2:
+            return 0
+
+        interval_us = profile._step_interval_us
+        intervals = None
+        if type(profile) is RectangleProfile:
+            if interval_us != 1000000 / profile._target_speed:
+                return 0
+        elif type(profile) is AccelProfile:
+            lookahead = min(count, BATCH_LOOKAHEAD)
+            if end_us is not None:
+                # No step can be shorter than the ramp's minimum delay.
+                shortest_us = min(interval_us, profile._ramp_delay_min_us)
+                lookahead = min(lookahead, int((end_us - self.last_step_us) / shortest_us) + 1)
+            batch = self._accel_batch(distance, lookahead, walk_ramp)
+            if isinstance(batch, int):
+                count = min(count, batch)
+            else:
+                intervals = batch
+                count = len(intervals)
+        else:
+            return 0
+        if count < 2:
+            return 0
+
+        if intervals is None:
+            times_us = _step_times_constant(self.last_step_us, interval_us, count, end_us)
+        else:
+            times_us = _step_times(self.last_step_us, intervals, end_us)
+        count = len(times_us)
+        if count == 0:
+            return 0
+
+        trace = self.trace
+        trace.times_us.extend(times_us)
+        start = profile._current_steps
+        if numpy is not None:
+            positions = start + direction * numpy.arange(1, count + 1, dtype=numpy.int64)
+            trace.positions.frombytes(positions.tobytes())
+        else:
+            trace.positions.extend(range(start + direction, start + direction * (count + 1), direction))
+        profile._current_steps = start + direction * count
+
+        if intervals is None:
+            trace.intervals_us.extend(repeat(interval_us, count))
+            trace.speeds.extend(repeat(profile._current_speed, count))
+            if type(profile) is AccelProfile:
+                profile._ramp_step_number += count
+        else:
+            trace.intervals_us.frombytes(intervals[:count].tobytes())
+            speeds = 1000000.0 / intervals[:count]
+            speeds[0] = abs(profile._current_speed)
+            trace.speeds.frombytes((speeds * direction).tobytes())
+            # State as left by the compute_new_speed() after the last step.
+            delay_us = self._ramp_delay(profile._ramp_step_number + count - 1)
+            profile._ramp_step_number += count
+            profile._ramp_delay_n_us = profile._step_interval_us = delay_us
+            profile._current_speed = 1000000.0 / delay_us * direction
+
+        self.last_step_us = self.now_us = times_us[-1]
+        return count
+
+    def _ramp_delay(self, ramp_step_number):
+        """The delay AccelProfile.compute_new_speed() picks from its table for a step number."""
+        profile = self.profile
+        table = profile._ramp_table
+        if ramp_step_number > 0:
+            index = int(ramp_step_number)
+        else:
+            index = max(int(-ramp_step_number) - 1, 0)
+        return table[index] if index < len(table) else profile._ramp_delay_min_us
+
+    def _accel_batch(self, distance, count, walk_ramp):
+        """
+        Work out the next steps of an AccelProfile move, for as long as every
+        compute_new_speed() in between just moves one step along the ramp.
+
+        Returns an array with the interval of each step, or the number of steps
+        that can be taken at the current interval (0 if none).
+        """
+        profile = self.profile
+        ramp_step_number = profile._ramp_step_number
+        if not float(ramp_step_number).is_integer():
+            return 0
+        ramp_step_number = int(ramp_step_number)
+        table = profile._ramp_table
+        if table is None:
+            table = profile._load_ramp_table()
+
+        if (ramp_step_number > 0 and profile._step_interval_us == profile._ramp_delay_min_us
+                and (not table or (ramp_step_number >= len(table) - 1 and table[-1] == profile._ramp_delay_min_us))):
+            # Cruising: the delay stays at the minimum until deceleration starts
+            # at stepsToStop >= distance.
+            steps_to_stop = int(profile._current_speed * profile._current_speed * profile._inverse_two_acceleration)
+            return distance - steps_to_stop - 1
+        if not table or not walk_ramp or count < BATCH_MINIMUM:
+            return 0
+
+        # Step j is taken at intervals[j], then compute_new_speed() runs with
+        # n = ramp_step_number + j and distance - j - 1 left to go.
+        table = numpy.frombuffer(table, dtype=numpy.float64)
+        step_numbers = ramp_step_number + numpy.arange(count, dtype=numpy.int64)
+        indexes = numpy.where(step_numbers > 0, step_numbers, numpy.maximum(-step_numbers - 1, 0))
+        delays = numpy.where(indexes < len(table), table[numpy.minimum(indexes, len(table) - 1)],
+                             profile._ramp_delay_min_us)
+        intervals = numpy.empty(count)
+        intervals[0] = profile._step_interval_us
+        intervals[1:] = delays[:-1]
+
+        speeds = 1000000.0 / intervals
+        speeds[0] = profile._current_speed
+        steps_to_stop = (speeds * speeds * profile._inverse_two_acceleration).astype(numpy.int64)
+        remaining = distance - 1 - numpy.arange(count, dtype=numpy.int64)
+        # Anything that would start decelerating, accelerate again, or stop.
+        plain = numpy.where(step_numbers > 0, steps_to_stop < remaining, steps_to_stop >= remaining)
+        plain &= (step_numbers != 0) & (remaining > 0)
+        if not plain.all():
+            intervals = intervals[:int(numpy.argmin(plain))]
+        return intervals
+
+
+def _step_times_constant(last_step_us, interval_us, count, end_us):
+    """
+    Times of count steps at a constant interval, accumulated one step at a
+    time exactly like the step loop does, cut off before end_us.
+    """
+    if numpy is not None:
+        return _step_times(last_step_us, numpy.full(count, interval_us), end_us)
+    times = array('d', accumulate(repeat(interval_us, count), initial=last_step_us))
+    del times[0]
+    if end_us is not None:
+        del times[bisect_left(times, end_us):]
+    return times
+
+
+def _step_times(last_step_us, intervals, end_us):
+    """As _step_times_constant(), for a numpy array of intervals."""
+    increments = numpy.empty(len(intervals) + 1)
+    increments[0] = last_step_us
+    increments[1:] = intervals
+    # cumsum adds sequentially, so every time is rounded the same as the step loop's.
+    times = numpy.cumsum(increments)[1:]
+    if end_us is not None:
+        times = times[:numpy.searchsorted(times, end_us, 'left')]
+    return array('d', times.tobytes())
+
+
+def simulate_move(profile, target_steps, batch=True):
+    """Simulate a single move to target_steps from the profile's current state."""
+    simulator = MotionSimulator(profile, batch)
+    simulator.move_to(target_steps)
+    return simulator.run_to_completion()
+
+
+def simulate_trajectory(profile, target_steps, time_step_ms, batch=True):
+    """
+    Simulate playback of a trajectory: move_to() the next target every time
+    step and step in between.  Carries on after the last target until the
+    profile stops.
+    """
+    simulator = MotionSimulator(profile, batch)
+    time_step_us = time_step_ms * 1000.0
+    for tick, target in enumerate(target_steps):
+        simulator.move_to(target)
+        simulator.run_until((tick + 1) * time_step_us)
+    return simulator.run_to_completion()
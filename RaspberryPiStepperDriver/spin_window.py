@@ -0,0 +1,118 @@
+"""
+Self-calibrating spin window for sleeping until step deadlines.
+
+asyncio.sleep() wakes up late by a varying amount (timer slack, the scheduler,
+other coroutines).  To hit a step deadline without spinning the whole time,
+AccelStepper sleeps until window_us before the deadline and only spins for
+the rest.  The window is a percentile of the oversleep of the last few dozen
+sleeps, times a margin, so a single late wake-up doesn't widen it: it takes
+a run of them, and the window narrows again once they have left the history.
+
+However late sleeps have been running, the window is never more than
+max_fraction of the step interval, so at short intervals the loop still
+sleeps for most of each one instead of spinning through it.
+
+Sleeps are a whole number of sleep_quantum_us.  The selector under asyncio
+rounds its timeout up to its own resolution (a millisecond for epoll), so a
+1.5 ms sleep really lasts 2 ms and more; rounding down instead leaves the
+oversleep at the scheduler's few hundred microseconds, which the window can
+then cover.
+"""
+import asyncio
+from collections import deque
+
+from . import micros
+
+
+class SpinWindow:
+    """How long before a deadline to stop sleeping and start spinning."""
+
+    def __init__(self, initial_us=1000, min_us=50, max_us=20000, max_fraction=0.25, margin=1.5,
+                 percentile=0.9, history=32, sleep_quantum_us=1000):
+        """
+        Arguments:
+          initial_us (int): Window until the first sleep has been measured.
+          min_us, max_us (int): Limits of the window.
+          max_fraction (float): Most of a step interval the window may take up.
+          margin (float): Window as a multiple of the oversleep percentile.
+          percentile (float): Which oversleep the window covers, 0.9 for all but the latest 10%.
+          history (int): How many of the latest sleeps the percentile is taken over.
+          sleep_quantum_us (int): Resolution of the event loop's timeouts, see the module docstring.
+        """
+        self.min_us = min_us
+        self.max_us = max_us
+        self.max_fraction = max_fraction
+        self.margin = margin
+        self.percentile = percentile
+        self.sleep_quantum_us = sleep_quantum_us
+        self._initial_us = initial_us
+        self._history = history
+        self.reset()
+
+    def reset(self):
+        self.window_us = self._initial_us
+        """Current window, before the cap for the step interval."""
+        self._oversleeps_us = deque(maxlen=self._history)
+        self.sleeps = 0
+        self.spins_only = 0
+        """Deadlines that were spun for all the way because the window covered them."""
+        self.oversleep_total_us = 0
+        self.oversleep_max_us = 0
+
+    def record(self, oversleep_us):
+        """Record how late a sleep woke up and recalibrate."""
+        oversleep_us = max(oversleep_us, 0)
+        self.sleeps += 1
+        self.oversleep_total_us += oversleep_us
+        if oversleep_us > self.oversleep_max_us:
+            self.oversleep_max_us = int(oversleep_us)
+        self._oversleeps_us.append(oversleep_us)
+        self._calibrate()
+
+    def _calibrate(self):
+        oversleeps_us = sorted(self._oversleeps_us)
+        typical_us = oversleeps_us[min(int(len(oversleeps_us) * self.percentile), len(oversleeps_us) - 1)]
+        self.window_us = int(min(self.max_us, max(self.min_us, typical_us * self.margin)))
+
+    def window_for(self, interval_us):
+        """The window for a step interval_us after the previous one."""
+        if interval_us is None:
+            return self.window_us
+        return int(min(self.window_us, interval_us * self.max_fraction))
+
+    def sleep_time_us(self, deadline_us, interval_us=None):
+        """How long to sleep before spinning up to deadline_us, 0 for not at all."""
+        sleep_us = deadline_us - self.window_for(interval_us) - micros()
+        if sleep_us <= 0:
+            return 0
+        return sleep_us - sleep_us % self.sleep_quantum_us
+
+    async def sleep_until(self, deadline_us, wake, interval_us=None):
+        """
+        Sleep until the window before deadline_us, then yield to the event loop
+        until it arrives.  Returns early if the asyncio.Event wake is set.
+
+        Arguments:
+          interval_us (float): Time from the previous step to this deadline, which caps the window.
+        """
+        sleep_us = self.sleep_time_us(deadline_us, interval_us)
+        if sleep_us > 0:
+            wake_at_us = micros() + sleep_us
+            try:
+                await asyncio.wait_for(wake.wait(), sleep_us / 1000000.0)
+                return
+            except asyncio.TimeoutError:
+                self.record(micros() - wake_at_us)
+        else:
+            self.spins_only += 1
+        while micros() < deadline_us and not wake.is_set():
+            await asyncio.sleep(0)
+
+    def snapshot(self) -> dict:
+        return {
+            "window_us": self.window_us,
+            "sleeps": self.sleeps,
+            "spins_only": self.spins_only,
+            "oversleep_mean_us": round(self.oversleep_total_us / self.sleeps, 1) if self.sleeps else 0.0,
+            "oversleep_max_us": self.oversleep_max_us,
+        }
@@ -0,0 +1,99 @@
+"""
+Step timing statistics for AccelStepper.
+
+Records how late each step was taken relative to when it was scheduled
+(_last_step_time_us + _step_interval_us).  Everything lives in preallocated
+arrays, so recording a step is a handful of integer operations and can be
+left on in production.
+"""
+from array import array
+
+# Lateness is bucketed by powers of two: bucket 0 is < 1us, bucket b is
+# [2**(b-1), 2**b) us and the last bucket takes everything from ~1s up.
+HISTOGRAM_BUCKETS = 22
+RECENT_CAPACITY = 1024
+
+
+class StepTimingStats:
+    """Histogram, counters and a ring buffer of recent step lateness."""
+
+    def __init__(self, recent_capacity=RECENT_CAPACITY):
+        """
+        Arguments:
+          recent_capacity (int): Steps kept in the ring buffer, rounded up to a power of two.
+        """
+        recent_capacity = 1 << max(recent_capacity - 1, 0).bit_length()
+        self._recent_mask = recent_capacity - 1
+        self.histogram = array('Q', bytes(8 * HISTOGRAM_BUCKETS))
+        """Count of steps per lateness bucket."""
+        self.recent_lateness_us = array('q', bytes(8 * recent_capacity))
+        """Ring buffer of the lateness of the most recent steps."""
+        self.recent_times_us = array('q', bytes(8 * recent_capacity))
+        """Ring buffer of when the most recent steps were taken."""
+        self.reset()
+
+    def reset(self):
+        for index in range(HISTOGRAM_BUCKETS):
+            self.histogram[index] = 0
+        self.count = 0
+        """Steps recorded."""
+        self.total_us = 0
+        self.max_us = 0
+        self.late_steps = 0
+        """Steps more than a whole interval late, i.e. where a step slot was missed."""
+
+    def record(self, time_us, lateness_us, interval_us):
+        """
+        Record a step.
+
+        Arguments:
+          time_us (int): When the step was taken.
+          lateness_us (int): How long after its scheduled time.
+          interval_us (float): The step interval it was scheduled with.
+        """
+        lateness_us = int(lateness_us)
+        bucket = lateness_us.bit_length()
+        self.histogram[bucket if bucket < HISTOGRAM_BUCKETS else HISTOGRAM_BUCKETS - 1] += 1
+        index = self.count & self._recent_mask
+        self.recent_lateness_us[index] = lateness_us
+        self.recent_times_us[index] = time_us
+        self.count += 1
+        self.total_us += lateness_us
+        if lateness_us > self.max_us:
+            self.max_us = lateness_us
+        if lateness_us >= interval_us:
+            self.late_steps += 1
+
+    def recent(self, count=None):
+        """(time_us, lateness_us) of up to count of the latest steps, oldest first."""
+        capacity = self._recent_mask + 1
+        available = min(self.count, capacity)
+        count = available if count is None else min(count, available)
+        first = self.count - count
+        return [(self.recent_times_us[i & self._recent_mask], self.recent_lateness_us[i & self._recent_mask])
+                for i in range(first, self.count)]
+
+    def percentile_us(self, fraction):
+        """
+        Upper bound of the bucket holding the given fraction of steps, e.g. 0.99.
+        Returns 0 if nothing has been recorded.
+        """
+        if self.count == 0:
+            return 0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if seen >= wanted:
+                return min(1 << bucket, self.max_us) if bucket < HISTOGRAM_BUCKETS - 1 else self.max_us
+        return self.max_us
+
+    def snapshot(self) -> dict:
+        return {
+            "steps": self.count,
+            "mean_us": round(self.total_us / self.count, 1) if self.count else 0.0,
+            "p50_us": self.percentile_us(0.5),
+            "p99_us": self.percentile_us(0.99),
+            "max_us": self.max_us,
+            "late_steps": self.late_steps,
+        }
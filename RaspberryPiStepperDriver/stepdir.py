@@ -1,5 +1,6 @@
-import asyncio, logging, time
+import asyncio, logging
 import RPi.GPIO as GPIO
+from . import clock
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -13,7 +14,7 @@ ENABLED = 1
 DISABLED = -1
 
 def sleep_microseconds(us_to_sleep):
-  time.sleep(us_to_sleep / float(1000000))
+  clock.sleep_us(us_to_sleep)
 
 class StepperDriver:
   """
@@ -43,6 +44,8 @@ class StepperDriver:
     self._calc_step_pulse_us()
 
     self._step_counter = 0
+    # When the last step pulse started, on the shared clock.
+    self.last_step_ns = None
     # Counter for the number of steps still to move
     # TODO make this an atomic int
     self._steps_to_move = 0
@@ -110,7 +113,7 @@ class StepperDriver:
       # This assumes a 50% duty cycle, which may not always be true.
 
       # Move the motor one step
-      ts = time.time()
+      self.last_step_ns = clock.monotonic_ns()
       GPIO.output(self.step_pin, GPIO.HIGH)
       sleep_microseconds(self.pulse_duration_us)
       GPIO.output(self.step_pin, GPIO.LOW)
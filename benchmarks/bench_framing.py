@@ -0,0 +1,78 @@
+"""
+Compare LineFramer with the original str based line splitting in
+Communications.process_incoming().
+
+A text trajectory upload is fed through both in recv() sized chunks.
+
+Usage: python3 benchmarks/bench_framing.py [sample_count]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from framing import LineFramer
+
+
+class LegacyFramer:
+    """The original implementation: decode each chunk, rescan and re-slice the str per line."""
+
+    def __init__(self):
+        self.read_buffer = ""
+        self.frames = []
+
+    def feed(self, data):
+        try:
+            self.read_buffer += data.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+        while self.read_buffer.find("\n") != -1:
+            new_item = self.read_buffer[:self.read_buffer.find("\n")]
+            self.frames.append(new_item)
+            self.read_buffer = self.read_buffer[self.read_buffer.find("\n") + 1:]
+
+    def drain(self):
+        while len(self.frames) > 0:
+            self.frames.pop(0)
+
+
+class DequeDrain:
+    """Wraps LineFramer so draining looks the same as the legacy list."""
+
+    def __init__(self):
+        self.framer = LineFramer()
+
+    def feed(self, data):
+        self.framer.feed(data)
+
+    def drain(self):
+        frames = self.framer.frames
+        while len(frames) > 0:
+            frames.popleft()
+
+
+def run(framer_class, payload, chunk_size):
+    framer = framer_class()
+    started_at = time.perf_counter()
+    for offset in range(0, len(payload), chunk_size):
+        framer.feed(payload[offset:offset + chunk_size])
+    framer.drain()
+    return time.perf_counter() - started_at
+
+
+def main():
+    sample_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    payload = "".join("%f\n" % (1000.0 * math.sin(i / 200.0)) for i in range(sample_count)).encode()
+
+    print("%d lines, %d bytes" % (sample_count, len(payload)))
+    print("%-10s %12s %12s %8s" % ("chunk", "legacy ms", "framer ms", "speedup"))
+    for chunk_size in (2048, 65536, len(payload)):
+        legacy_s = min(run(LegacyFramer, payload, chunk_size) for _ in range(3))
+        framer_s = min(run(DequeDrain, payload, chunk_size) for _ in range(3))
+        print("%-10d %12.2f %12.2f %7.1fx" % (chunk_size, legacy_s * 1000.0, framer_s * 1000.0, legacy_s / framer_s))
+
+
+if __name__ == "__main__":
+    main()
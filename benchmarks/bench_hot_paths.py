@@ -0,0 +1,414 @@
+"""
+Microbenchmarks for the main loop's hot paths, runnable without any hardware.
+
+RPi.GPIO, board, adafruit_mprls and advpistepper are replaced by the
+simulated hardware (see sim_hardware.py) and the client connection by a socket
+pair, so what is timed is the app's own Python plus the simulation's
+recording of each GPIO edge.
+
+Absolute timings only mean something on the machine they were taken on, so
+the baseline is recorded locally (benchmarks/baseline.json is not checked
+in).  Results are compared against it when there is one, and with --check
+anything slower than the threshold is a regression (exit status 1).
+
+Usage:
+  python3 benchmarks/bench_hot_paths.py --save          record a baseline on this machine
+  python3 benchmarks/bench_hot_paths.py                 compare against it
+  python3 benchmarks/bench_hot_paths.py --check         ... and fail on regressions
+  python3 benchmarks/bench_hot_paths.py --only framing  run benchmarks whose name contains "framing"
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sim_hardware
+
+hardware = sim_hardware.install()
+
+with contextlib.redirect_stdout(open(os.devnull, "w")):
+    import main
+import protocol
+import telemetry
+import tick_schedule
+from event_loop import EventLoop
+from pressure_sampler import SampleRing
+from rolling_stats import RollingStats
+from trajectory import Trajectory
+from RaspberryPiStepperDriver import micros
+from RaspberryPiStepperDriver.accelstepper import AccelStepper
+from RaspberryPiStepperDriver.profiles import DIRECTION_CW
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.step_timing import StepTimingStats
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Register a benchmark.  The decorated function sets up and returns a
+    callable that does some number of operations and returns that number.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def drive(coroutine):
+    """Run a coroutine that never really awaits anything, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+
+class PairedCommunications(main.Communications):
+    """Communications with one client on a local socket pair instead of a listening socket."""
+
+    def listen(self):
+        self.socket, connection = socket.socketpair()
+        self.add_subscriber(connection, "socketpair")
+
+    @property
+    def peer(self):
+        """The client's end of the connection."""
+        return self.socket
+
+    @property
+    def write_queue(self):
+        return self.subscribers[0].write_queue
+
+
+def setup_app(samples=6000):
+    """Give the app a loop, a connection and a compiled trajectory."""
+    app = main.app
+    if app.loop is None:
+        app.loop = EventLoop(main.current_time_in_ms)
+    if app.comm is None:
+        app.comm = PairedCommunications()
+    if app.upload_worker is None:
+        app.upload_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+    app.comm.write_queue.clear()
+    app.comm.read_queue.clear()
+    app.debugging = False
+    app.trajectory = Trajectory([100.0 * math.sin(i / 80.0) + 20.0 * math.sin(i / 9.0) for i in range(samples)])
+    app.positional_data = app.trajectory.samples
+    app.home_offset = app.positional_data[0]
+    app.scale_multiplier = 4.0
+    main.compile_trajectory()
+    finish_recompiling(app)
+    return app
+
+
+def finish_recompiling(app):
+    """Wait for the upload worker to recompile the trajectory and swap it in, as the main loop would."""
+    while app.recompiling is not None:
+        app.recompiling[0].result()
+        main.finish_recompiling()
+
+
+@benchmark("profile.accel.compute_new_speed")
+def bench_compute_new_speed():
+    profile = AccelProfile()
+    profile.set_acceleration(5000.0)
+    profile.set_target_speed(8000.0)
+
+    def run():
+        steps = 0
+        for target in (20000, 0):
+            profile._target_steps = target
+            profile.compute_new_speed()
+            while profile.distance_to_go != 0:
+                profile._current_steps += 1 if profile._direction == DIRECTION_CW else -1
+                profile.compute_new_speed()
+                steps += 1
+        return steps
+    return run
+
+
+def make_stepper():
+    profile = AccelProfile()
+    profile.set_acceleration(5000.0)
+    profile.set_target_speed(8000.0)
+    stepper = AccelStepper(profile, dir_pin=24, step_pin=23)
+    stepper.set_pulse_width(0)
+    # AccelStepper.start() would also start run_forever(); only the pins are wanted here.
+    stepper._activator.start()
+    return stepper
+
+
+@benchmark("accelstepper.run_at_speed.idle")
+def bench_run_at_speed_idle():
+    """The common case: polled with no step due yet."""
+    stepper = make_stepper()
+    stepper.move_to(1000000)
+    stepper._last_step_time_us = float("inf")
+
+    def run():
+        for _ in range(20000):
+            drive(stepper.run_at_speed())
+        return 20000
+    return run
+
+
+@benchmark("accelstepper.run_at_speed.step")
+def bench_run_at_speed_step():
+    """A step every call, including the simulated GPIO writes and the pulse width sleep."""
+    stepper = make_stepper()
+
+    def run():
+        stepper.move_to(stepper.position + 1000000)
+        for _ in range(2000):
+            # Make the next step due now, but keep it part of a continuous run.
+            stepper._last_step_time_us = micros() - stepper._profile._step_interval_us
+            drive(stepper.run_at_speed())
+        # Don't let the captured edges grow across rounds.
+        hardware.recorder.clear()
+        return 2000
+    return run
+
+
+@benchmark("accelstepper.step_timing.record")
+def bench_step_timing_record():
+    """The instrumentation's cost per step."""
+    timing = StepTimingStats()
+
+    def run():
+        for step in range(20000):
+            timing.record(step * 125, step & 63, 125.0)
+        return 20000
+    return run
+
+
+@benchmark("comm.framing")
+def bench_framing():
+    """Text upload lines through the socket, LineFramer and the read queue."""
+    app = setup_app()
+    comm = app.comm
+    chunk = "".join("%.6f\n" % (100.0 * math.sin(i / 80.0)) for i in range(500)).encode()
+
+    def run():
+        lines = 0
+        for _ in range(20):
+            comm.peer.sendall(chunk)
+            while len(comm.read_queue) < 500:
+                comm.subscribers[0].process_incoming()
+            while len(comm.read_queue) > 0:
+                comm.read_queue.popleft()
+                lines += 1
+        return lines
+    return run
+
+
+def bench_command(line, count=2000):
+    def setup():
+        app = setup_app(samples=1000)
+
+        def run():
+            for _ in range(count):
+                main.process_input(line)
+            app.comm.write_queue.clear()
+            return count
+        return run
+    return setup
+
+
+benchmark("main.process_input.debug")(bench_command("D:F"))
+
+
+@benchmark("main.process_input.scale")
+def bench_scale(count=200):
+    """
+    Scale changes, as a client turning a knob sends them.  The loop only starts a recompile on
+    the upload worker; the cost of waiting for the last one and swapping it in is included.
+    """
+    app = setup_app(samples=1000)
+
+    def run():
+        for index in range(count):
+            main.process_input("X:4.5" if index % 2 == 0 else "X:4.0")
+        finish_recompiling(app)
+        app.comm.write_queue.clear()
+        return count
+    return run
+benchmark("main.process_input.query")(bench_command("Q:LOOP"))
+benchmark("main.process_input.unknown")(bench_command("?:nothing"))
+
+
+@benchmark("main.process_input.v2_query")
+def bench_request(count=2000):
+    """The same query as a protocol v2 request, replied to the client that sent it."""
+    app = setup_app(samples=1000)
+    request = protocol.Request(app.comm.subscribers[0], "@1 Q LOOP")
+
+    def run():
+        for _ in range(count):
+            main.process_input(request)
+        app.comm.write_queue.clear()
+        return count
+    return run
+
+
+@benchmark("main.update_target_position")
+def bench_update_target_position():
+    app = setup_app()
+    app.runMotors = True
+
+    def run():
+        # A schedule that started long ago, so that every call catches up on a tick.
+        app.tick_schedule.set_policy(tick_schedule.OVERRUN_CATCH_UP)
+        app.tick_schedule.start(main.current_time_in_ms() - 1e9, app.trajectory.tick_ms)
+        for _ in range(20000):
+            main.update_target_position()
+        app.comm.write_queue.clear()
+        return 20000
+    return run
+
+
+@benchmark("sampler.rolling_stats.add")
+def bench_rolling_stats_add():
+    """Keeping the default 1/10/60 s windows up to date, per sample at 1 kHz."""
+    stats = RollingStats()
+    clock = [0.0]
+
+    def run():
+        started_ms = clock[0]
+        for index in range(20000):
+            stats.add(started_ms + index, 750.0 + (index & 255) * 0.1)
+        clock[0] = started_ms + 20000
+        return 20000
+    return run
+
+
+def bench_pressure_telemetry(framer, samples=1000):
+    """Sending a flush worth of pressure samples, per sample."""
+    def setup():
+        app = setup_app(samples=1000)
+        ring = SampleRing(4096)
+        app.pressure_reader = ring.reader()
+        app.send_pressure_sensor_update = True
+
+        def run():
+            app.pressure_framer = framer
+            for index in range(samples):
+                ring.append(index * 1.0, 750.0 + index * 0.001)
+            app.last_pressure_sensor_flush = float("-inf")
+            main.show_pressure_sensor_update()
+            app.comm.write_queue.clear()
+            return samples
+        return run
+    return setup
+
+
+benchmark("main.pressure_telemetry.lines")(bench_pressure_telemetry(None))
+benchmark("main.pressure_telemetry.text")(bench_pressure_telemetry(telemetry.SampleFramer(batch_size=64)))
+benchmark("main.pressure_telemetry.binary")(bench_pressure_telemetry(telemetry.SampleFramer(binary=True, batch_size=64)))
+
+
+def measure(setup, rounds):
+    """Best and median ns per operation over a number of rounds."""
+    run = setup()
+    run()  # Warm up caches and lazy imports.
+    per_op_ns = []
+    for _ in range(rounds):
+        started_at = time.perf_counter_ns()
+        ops = run()
+        per_op_ns.append((time.perf_counter_ns() - started_at) / ops)
+    return {"ns_per_op": round(min(per_op_ns), 1), "median_ns_per_op": round(statistics.median(per_op_ns), 1)}
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def load_baseline(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if anything regressed")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="flag anything this fraction slower than the baseline (default 0.25)")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--only", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--json", help="also write the results to this file")
+    arguments = parser.parse_args()
+
+    baseline = load_baseline(arguments.baseline)
+    baseline_results = baseline["results"] if baseline else {}
+    if baseline is None:
+        print("note: no baseline at %s, record one with --save" % arguments.baseline)
+    elif baseline.get("environment") != environment():
+        print("note: baseline was recorded on %s" % baseline.get("environment"))
+
+    results = {}
+    regressions = []
+    print("%-34s %12s %12s %12s %8s" % ("benchmark", "ns/op", "median", "baseline", "change"))
+    for name, setup in BENCHMARKS:
+        if arguments.only not in name:
+            continue
+        # The app prints whatever it logs, keep that out of the report.
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            result = measure(setup, arguments.rounds)
+        results[name] = result
+
+        previous = baseline_results.get(name)
+        if previous:
+            change = result["ns_per_op"] / previous["ns_per_op"] - 1.0
+            flag = ""
+            if change > arguments.threshold:
+                regressions.append(name)
+                flag = "  REGRESSION"
+            print("%-34s %12.1f %12.1f %12.1f %+7.0f%%%s" % (
+                name, result["ns_per_op"], result["median_ns_per_op"], previous["ns_per_op"], change * 100.0, flag))
+        else:
+            print("%-34s %12.1f %12.1f %12s %8s" % (name, result["ns_per_op"], result["median_ns_per_op"], "-", "new"))
+
+    report = {"environment": environment(), "results": results}
+    if arguments.json:
+        with open(arguments.json, "w") as stream:
+            json.dump(report, stream, indent=2, sort_keys=True)
+    if arguments.save:
+        if baseline and arguments.only:
+            # Keep the baseline of anything that wasn't run.
+            baseline_results.update(results)
+            report["results"] = baseline_results
+        with open(arguments.baseline, "w") as stream:
+            json.dump(report, stream, indent=2, sort_keys=True)
+            stream.write("\n")
+        print("baseline written to %s" % arguments.baseline)
+    elif regressions:
+        print("%d regression(s) over %.0f%%: %s" % (len(regressions), arguments.threshold * 100.0, ", ".join(regressions)))
+        if arguments.check:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
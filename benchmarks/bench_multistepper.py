@@ -0,0 +1,115 @@
+"""
+Step-rate ceiling and arrival spread of MultiStepper against the simulated GPIO.
+
+ceiling:  every axis is asked for far more steps per second than Python can
+          issue, and run() is called back to back, so the steps per second
+          achieved is the most one scheduling loop can drive, split across
+          1 to 4 axes.
+arrival:  a coordinated move with acceleration over axes with different
+          distances, run the way an app would (run_forever() in the
+          background).  Reports how far apart the axes took their last step,
+          the CPU used and how late steps were.
+
+Usage: python3 benchmarks/bench_multistepper.py [axes] [pulse_width_us]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim_hardware
+
+hardware = sim_hardware.install()
+
+from RaspberryPiStepperDriver.accelstepper import AccelStepper
+from RaspberryPiStepperDriver.multistepper import MultiStepper
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+# (step pin, dir pin) of each axis.
+PINS = ((23, 24), (17, 27), (5, 6), (13, 19))
+
+
+def make_multistepper(axes, make_profile, max_speed, acceleration, pulse_width_us):
+    multistepper = MultiStepper()
+    for step_pin, dir_pin in PINS[:axes]:
+        profile = make_profile()
+        profile.set_acceleration(acceleration)
+        profile.set_target_speed(max_speed)
+        stepper = AccelStepper(profile, dir_pin, step_pin)
+        stepper.set_pulse_width(pulse_width_us)
+        stepper._activator.start()
+        multistepper.add_stepper(stepper)
+    return multistepper
+
+
+def drive(coroutine):
+    """Run a coroutine that never really awaits anything, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+
+def ceiling(axes, pulse_width_us, steps=4000):
+    multistepper = make_multistepper(axes, RectangleProfile, 1000000.0, 0.0, pulse_width_us)
+    multistepper.move([steps] * axes)
+    hardware.recorder.clear()
+    started_at = time.perf_counter()
+    while drive(multistepper.run()):
+        pass
+    elapsed_s = time.perf_counter() - started_at
+    hardware.recorder.clear()
+    return steps * axes / elapsed_s
+
+
+async def coordinated_move(multistepper, distances):
+    task = asyncio.ensure_future(multistepper.run_forever())
+    multistepper.move(distances)
+    while multistepper.is_moving:
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+
+def arrival(axes, pulse_width_us, max_speed=800.0, acceleration=1600.0):
+    distances = [800, -400, 250, 100][:axes]
+    multistepper = make_multistepper(axes, AccelProfile, max_speed, acceleration, pulse_width_us)
+    hardware.recorder.clear()
+    started_at = time.perf_counter()
+    cpu_started_at = time.process_time()
+    asyncio.run(coordinated_move(multistepper, distances))
+    elapsed_s = time.perf_counter() - started_at
+    cpu_pct = 100.0 * (time.process_time() - cpu_started_at) / elapsed_s
+
+    first_ns = [hardware.recorder.edges(step_pin, 1)[0] for step_pin, _ in PINS[:axes]]
+    last_ns = [hardware.recorder.edges(step_pin, 1)[-1] for step_pin, _ in PINS[:axes]]
+    return {
+        "distances": distances,
+        "positions": multistepper.positions,
+        "duration_s": round((max(last_ns) - min(first_ns)) / 1e9, 3),
+        "arrival_spread_ms": round((max(last_ns) - min(last_ns)) / 1e6, 3),
+        "cpu_pct": round(cpu_pct, 1),
+        "late_steps": [stats.get("late_steps", 0) for stats in multistepper.step_timing_statistics()],
+        "p99_us": [stats.get("p99_us", 0) for stats in multistepper.step_timing_statistics()],
+    }
+
+
+def main():
+    max_axes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    pulse_width_us = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    print("ceiling (pulse width %gus)" % pulse_width_us)
+    for axes in range(1, max_axes + 1):
+        rate = ceiling(axes, pulse_width_us)
+        print("  %d axes: %8.0f steps/s total, %8.0f per axis" % (axes, rate, rate / axes))
+
+    print("arrival")
+    for axes in range(1, max_axes + 1):
+        print("  %d axes: %s" % (axes, arrival(axes, pulse_width_us)))
+
+
+if __name__ == "__main__":
+    main()
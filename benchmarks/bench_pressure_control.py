@@ -0,0 +1,76 @@
+"""
+Closed-loop pressure control against a simulated pump, offline.
+
+The plant's pressure follows the stroke through a first-order lag, and the
+pump is weaker than the target assumes, so open loop undershoots the target
+curve.  Reports the tracking error of the last few cycles with and without
+control, where the gain settled, and what a control step costs.
+
+Usage: python3 benchmarks/bench_pressure_control.py [seconds] [kp] [ki]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pressure_control import PIDController, PressureControl, TargetCurve
+
+TICK_MS = 10
+SAMPLE_MS = 1
+CYCLE_TICKS = 100
+STROKE_STEPS = 2000
+BASE_MMHG = 760.0
+TARGET_AMPLITUDE_MMHG = 20.0
+PLANT_MMHG_PER_STEP = 0.7 * TARGET_AMPLITUDE_MMHG / STROKE_STEPS
+PLANT_LAG_MS = 40.0
+
+
+def simulate(seconds, control):
+    stroke = [round(STROKE_STEPS * math.sin(2.0 * math.pi * tick / CYCLE_TICKS)) for tick in range(CYCLE_TICKS)]
+    position = 0.0
+    pressure = BASE_MMHG
+    sample = None
+    errors = []
+    compute_s = 0.0
+    for now_ms in range(0, int(seconds * 1000)):
+        if now_ms % TICK_MS == 0:
+            index = (now_ms // TICK_MS) % CYCLE_TICKS
+            target_steps = stroke[index]
+            if control.enabled:
+                started_at = time.perf_counter()
+                gain = control.step(now_ms, index / CYCLE_TICKS, target_steps / STROKE_STEPS, sample)
+                compute_s += time.perf_counter() - started_at
+                target_steps = round(target_steps * gain)
+            # The stepper gets there within the tick; the pressure lags behind it.
+            position = target_steps
+            if now_ms >= (seconds - 2) * 1000:
+                errors.append(control.target.value_at(index / CYCLE_TICKS) - pressure)
+        pressure += (BASE_MMHG + PLANT_MMHG_PER_STEP * position - pressure) * SAMPLE_MS / PLANT_LAG_MS
+        if now_ms % SAMPLE_MS == 0:
+            sample = (now_ms, pressure)
+    return math.sqrt(sum(error * error for error in errors) / len(errors)), compute_s
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    kp = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    ki = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    target = TargetCurve([BASE_MMHG + TARGET_AMPLITUDE_MMHG * math.sin(2.0 * math.pi * point / 20) for point in range(20)])
+
+    open_loop = PressureControl(target=target)
+    rms, _ = simulate(seconds, open_loop)
+    print("open loop:   rms error %.3f mmHg" % rms)
+
+    closed_loop = PressureControl(PIDController(kp=kp, ki=ki), target, TICK_MS, SAMPLE_MS)
+    closed_loop.start()
+    rms, compute_s = simulate(seconds, closed_loop)
+    stats = closed_loop.snapshot()
+    print("closed loop: rms error %.3f mmHg, gain %.3f, %.1f us per step" % (
+        rms, stats["gain"], compute_s / max(stats["ticks"], 1) * 1e6))
+    print("closed loop: %s" % stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compile a trajectory into a pulse schedule and waveform segments, emit them
+to the memory and file emitters, and check the emitted step edges match the
+schedule.  Runs on any Linux box; no pigpio needed.
+
+Usage: python3 benchmarks/bench_pulse_schedule.py [seconds_of_trajectory]
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pulse_schedule
+from trajectory import Trajectory
+
+STEP_PIN = 23
+DIR_PIN = 24
+TIME_STEP_MS = 10
+MAX_SPEED = 8000.0
+ACCELERATION = 5000.0
+
+
+def timed(function, *arguments):
+    started_at = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - started_at
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    ticks = int(seconds * 1000 / TIME_STEP_MS)
+    samples = [100.0 * math.sin(i / 80.0) + 20.0 * math.sin(i / 9.0) for i in range(ticks)]
+    trajectory = Trajectory(samples)
+    trajectory.compile(samples[0], 4.0, TIME_STEP_MS)
+
+    schedule, compile_s = timed(pulse_schedule.compile_schedule,
+                                trajectory.target_steps, TIME_STEP_MS, MAX_SPEED, ACCELERATION)
+    segments, segment_s = timed(pulse_schedule.schedule_to_segments, schedule, STEP_PIN, DIR_PIN)
+
+    memory = pulse_schedule.MemoryWaveEmitter()
+    memory.emit(segments)
+    memory_ok = list(pulse_schedule.step_times_from_segments(memory.segments, STEP_PIN)) == list(schedule.step_times_us)
+
+    with tempfile.TemporaryDirectory() as directory:
+        emitter = pulse_schedule.FileWaveEmitter(os.path.join(directory, "waves.bin"))
+        _, write_s = timed(emitter.emit, segments)
+        file_size = os.path.getsize(emitter.path)
+        file_ok = list(pulse_schedule.step_times_from_segments(emitter.read(), STEP_PIN)) == list(schedule.step_times_us)
+
+    pulses = sum(len(segment.pulses) for segment in segments)
+    print("trajectory:      %.0f s, %d ticks" % (seconds, ticks))
+    print("schedule:        %d steps, compiled in %.1f ms (%.0f steps/s)" % (
+        len(schedule), compile_s * 1000.0, len(schedule) / compile_s))
+    print("segments:        %d segments, %d pulses, built in %.1f ms" % (len(segments), pulses, segment_s * 1000.0))
+    print("file emitter:    %d bytes written in %.1f ms" % (file_size, write_s * 1000.0))
+    print("realtime factor: %.0fx" % (seconds / (compile_s + segment_s)))
+    print("verified:        memory=%s file=%s" % (memory_ok, file_ok))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Per-step cost of AccelProfile.compute_new_speed() with and without the ramp
+table cache.
+
+Usage: python3 benchmarks/bench_ramp_table.py [move_steps]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RaspberryPiStepperDriver.profiles import DIRECTION_CW
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.ramp_cache import RampTableCache
+
+ACCELERATION = 5000.0
+TARGET_SPEED = 8000.0
+
+
+def run_moves(profile, move_steps, moves=4):
+    """Step the profile back and forth, like AccelStepper.run() would. Returns (steps, seconds)."""
+    profile.set_acceleration(ACCELERATION)
+    profile.set_target_speed(TARGET_SPEED)
+    steps = 0
+    started_at = time.perf_counter()
+    for move in range(moves):
+        profile._target_steps = move_steps if move % 2 == 0 else 0
+        profile.compute_new_speed()
+        while profile.distance_to_go != 0:
+            profile._current_steps += 1 if profile._direction == DIRECTION_CW else -1
+            profile.compute_new_speed()
+            steps += 1
+    return steps, time.perf_counter() - started_at
+
+
+def main():
+    move_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cache = RampTableCache()
+    print("%-12s %10s %12s %14s" % ("ramp", "steps", "ns/step", "max steps/s"))
+    for name, ramp_cache in (("equation 13", None), ("table", cache)):
+        best_s = float('inf')
+        for _ in range(5):
+            steps, elapsed_s = run_moves(AccelProfile(ramp_cache=ramp_cache), move_steps)
+            best_s = min(best_s, elapsed_s)
+        print("%-12s %10d %12.0f %14.0f" % (name, steps, best_s / steps * 1e9, steps / best_s))
+    print("cache:", cache.snapshot())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Simulate moves and a trajectory through each profile, batched and step by
+step, check both give identical traces and report how much faster than real
+time the simulation runs.
+
+Usage: python3 benchmarks/bench_simulator.py [move_steps]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RaspberryPiStepperDriver import simulator
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.max import MaxProfile
+from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+ACCELERATION = 5000.0
+TARGET_SPEED = 8000.0
+TIME_STEP_MS = 10
+
+
+def accel_profile():
+    profile = AccelProfile()
+    profile.set_acceleration(ACCELERATION)
+    profile.set_target_speed(TARGET_SPEED)
+    return profile
+
+
+def rectangle_profile():
+    profile = RectangleProfile()
+    profile.set_target_speed(TARGET_SPEED)
+    return profile
+
+
+def max_profile():
+    profile = MaxProfile(acceleration_steps=200, max_start_speed=500.0)
+    profile.set_target_speed(TARGET_SPEED)
+    return profile
+
+
+PROFILES = (("accel", accel_profile), ("rectangle", rectangle_profile), ("max", max_profile))
+
+
+def identical(first, second):
+    return all(getattr(first, name) == getattr(second, name)
+               for name in ("times_us", "positions", "intervals_us", "speeds"))
+
+
+def timed(function, *arguments):
+    started_at = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - started_at
+
+
+def main():
+    move_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    targets = [round(3000 * math.sin(i / 60.0) + 400 * math.sin(i / 7.0)) for i in range(6000)]
+    print("numpy:", simulator.numpy is not None)
+    print("%-10s %-10s %9s %10s %12s %12s %10s" % (
+        "profile", "run", "steps", "motion s", "batched ms", "stepped ms", "realtime"))
+    for name, make_profile in PROFILES:
+        runs = (
+            ("move", lambda batch: simulator.simulate_move(make_profile(), move_steps, batch)),
+            ("trajectory", lambda batch: simulator.simulate_trajectory(make_profile(), targets, TIME_STEP_MS, batch)),
+        )
+        for run, simulate in runs:
+            batched, batched_s = timed(simulate, True)
+            stepped, stepped_s = timed(simulate, False)
+            motion_s = batched.duration_us() / 1000000.0
+            print("%-10s %-10s %9d %10.1f %12.1f %12.1f %9.0fx%s" % (
+                name, run, len(batched), motion_s, batched_s * 1000.0, stepped_s * 1000.0,
+                motion_s / batched_s, "" if identical(batched, stepped) else "  MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()
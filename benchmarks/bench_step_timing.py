@@ -0,0 +1,66 @@
+"""
+Run AccelStepper moves in real time against the simulated GPIO.  For each
+profile and run_forever() mode, reports the step rate, pulse width and
+interval jitter seen on the STEP pin, the lateness AccelStepper recorded
+itself and how much CPU the move took.
+
+Usage: python3 benchmarks/bench_step_timing.py [steps] [max_speed] [pulse_width_us]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sim_hardware
+
+hardware = sim_hardware.install()
+
+from RaspberryPiStepperDriver.accelstepper import AccelStepper
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+STEP_PIN = 23
+DIR_PIN = 24
+
+
+async def move(stepper, steps, busy):
+    """Run the stepper the way an app would: run_forever() in the background."""
+    task = asyncio.ensure_future(stepper.run_forever(busy))
+    stepper.move(steps)
+    while stepper.is_moving:
+        await asyncio.sleep(0.01)
+    task.cancel()
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    max_speed = float(sys.argv[2]) if len(sys.argv) > 2 else 500.0
+    pulse_width_us = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+
+    for name, make_profile in (("rectangle", RectangleProfile), ("accel", AccelProfile)):
+        for mode, busy in (("busy", True), ("deadline", False)):
+            profile = make_profile()
+            profile.set_acceleration(max_speed * 2)
+            profile.set_target_speed(max_speed)
+            stepper = AccelStepper(profile, DIR_PIN, STEP_PIN)
+            stepper.set_pulse_width(pulse_width_us)
+            stepper._activator.start()
+            hardware.recorder.clear()
+
+            started_at = time.perf_counter()
+            cpu_started_at = time.process_time()
+            asyncio.run(move(stepper, steps, busy))
+            cpu_pct = 100.0 * (time.process_time() - cpu_started_at) / (time.perf_counter() - started_at)
+
+            label = "%s/%s" % (name, mode)
+            print("%-18s cpu:    %.1f%%" % (label, cpu_pct))
+            print("%-18s pin:    %s" % (label, hardware.recorder.summary(STEP_PIN)))
+            print("%-18s timing: %s" % (label, stepper.step_timing_statistics()))
+            if not busy:
+                print("%-18s spin:   %s" % (label, stepper.spin_window.snapshot()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Trajectory tick timing, relative versus absolute, offline.
+
+The main loop is simulated waking up for each tick a little late (an
+exponential wake-up latency) with the odd long stall, as on a busy Pi.
+Reports how far behind the old relative timing ("a tick every tick_ms after
+the last one was played") falls over the run, against a TickSchedule with
+each overrun policy.
+
+Usage: python3 benchmarks/bench_tick_schedule.py [seconds] [tick_ms] [mean_latency_ms]
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tick_schedule import OVERRUN_POLICIES, TickSchedule
+
+STALL_PROBABILITY = 0.001
+STALL_MS = (20.0, 150.0)
+WORK_MS = 0.05
+"""Time it takes to play a tick."""
+
+
+def wake_latency(rng, mean_latency_ms):
+    latency = rng.expovariate(1.0 / mean_latency_ms)
+    if rng.random() < STALL_PROBABILITY:
+        latency += rng.uniform(*STALL_MS)
+    return latency
+
+
+def relative(seconds, tick_ms, mean_latency_ms, seed):
+    rng = random.Random(seed)
+    now = 0.0
+    last = -tick_ms
+    ticks = 0
+    while True:
+        now = max(now, last + tick_ms) + wake_latency(rng, mean_latency_ms)
+        if now >= seconds * 1000.0:
+            return ticks
+        ticks += 1
+        last = now
+        now += WORK_MS
+
+
+def absolute(seconds, tick_ms, mean_latency_ms, seed, policy):
+    rng = random.Random(seed)
+    schedule = TickSchedule(policy)
+    schedule.start(0.0, tick_ms)
+    now = 0.0
+    position = 0
+    while True:
+        due = schedule.next_due_ms()
+        # Already late: the loop goes straight round without sleeping.
+        now = now + WORK_MS if due <= now else due + wake_latency(rng, mean_latency_ms)
+        if now >= seconds * 1000.0:
+            return position, schedule
+        position += schedule.advance(now)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 600.0
+    tick_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    mean_latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    expected = int(seconds * 1000.0 / tick_ms)
+    print("%.0f s of %.1f ms ticks, %.2f ms mean wake-up latency: %d ticks expected" % (
+        seconds, tick_ms, mean_latency_ms, expected))
+
+    ticks = relative(seconds, tick_ms, mean_latency_ms, seed=1)
+    print("relative:  %8d ticks, %+9.1f ms behind (%.3f%% slow)" % (
+        ticks, (expected - ticks) * tick_ms, 100.0 * (expected - ticks) / expected))
+    for policy in OVERRUN_POLICIES:
+        position, schedule = absolute(seconds, tick_ms, mean_latency_ms, seed=1, policy=policy)
+        stats = schedule.snapshot()
+        print("%-9s  %8d ticks, %+9.1f ms behind, phase error %.3f ms (max %.3f), %d overruns, %d skipped" % (
+            policy.lower() + ":", position, (expected - position) * tick_ms, stats["phase_error_ms"],
+            stats["phase_error_max_ms"], stats["overruns"], stats["skipped"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare the text and binary trajectory upload paths.
+
+Measures the device side cost of turning received bytes into samples (line
+splitting + float() per line for text, decode_frame() for binary) and the size
+of each encoding on the wire.
+
+Usage: python3 benchmarks/bench_upload.py [sample_count]
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import trajectory_codec
+
+
+def make_trajectory(sample_count):
+    return [1000.0 * math.sin(i / 200.0) + 250.0 * math.sin(i / 37.0) for i in range(sample_count)]
+
+
+def parse_text(payload: bytes):
+    samples = []
+    for line in payload.split(b"\n"):
+        line = line.strip()
+        if len(line) == 0:
+            break
+        samples.append(float(line))
+    return samples
+
+
+def best_of(function, argument, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main():
+    sample_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    samples = make_trajectory(sample_count)
+
+    encodings = [
+        ("text", ("".join("%f\n" % sample for sample in samples) + "\n").encode(), parse_text),
+    ]
+    for name, sample_type, delta, compress in [
+        ("float32", trajectory_codec.SAMPLE_FLOAT32, False, False),
+        ("float32+delta+zlib", trajectory_codec.SAMPLE_FLOAT32, True, True),
+        ("int32", trajectory_codec.SAMPLE_INT32, False, False),
+        ("int32+delta+zlib", trajectory_codec.SAMPLE_INT32, True, True),
+    ]:
+        frame = trajectory_codec.encode_frame(samples, sample_type, delta=delta, compress=compress)
+        encodings.append((name, frame, trajectory_codec.decode_frame))
+
+    print("%d samples" % sample_count)
+    print("%-20s %12s %12s %16s" % ("encoding", "bytes", "decode ms", "samples/s"))
+    for name, payload, decode in encodings:
+        elapsed_s = best_of(decode, payload)
+        print("%-20s %12d %12.2f %16.0f" % (name, len(payload), elapsed_s * 1000.0, sample_count / elapsed_s))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Selector based event loop for the pump app.
+
+Instead of spinning on zero-timeout select() calls, the main loop sleeps until
+a registered socket becomes ready or the next deadline is due.  The loop keeps
+a little bookkeeping so we can show how much CPU it burns while idle and how
+late it wakes up for deadlines.
+"""
+import selectors
+import socket
+import time
+
+
+class LoopStats:
+    """Counters describing how the event loop spends its time."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.perf_counter()
+        """Wall clock time (s) at which counting started."""
+        self.cpu_started_at = time.thread_time()
+        """Loop thread CPU time (s) at which counting started."""
+        self.wakeups = 0
+        """Number of times the loop returned from select()."""
+        self.io_wakeups = 0
+        """Number of wake-ups caused by socket activity."""
+        self.timer_wakeups = 0
+        """Number of wake-ups caused by a deadline expiring."""
+        self.sleep_time_s = 0.0
+        """Total time spent blocked in select()."""
+        self.latency_total_ms = 0.0
+        """Sum of deadline wake-up latencies."""
+        self.latency_max_ms = 0.0
+        """Worst deadline wake-up latency."""
+
+    def record_wakeup(self, slept_s, io_ready, latency_ms=None):
+        self.wakeups += 1
+        self.sleep_time_s += slept_s
+        if io_ready:
+            self.io_wakeups += 1
+        elif latency_ms is not None:
+            self.timer_wakeups += 1
+            self.latency_total_ms += latency_ms
+            if latency_ms > self.latency_max_ms:
+                self.latency_max_ms = latency_ms
+
+    def snapshot(self):
+        """Return the current counters as a dict of plain numbers."""
+        wall_s = max(time.perf_counter() - self.started_at, 1e-9)
+        cpu_s = time.thread_time() - self.cpu_started_at
+        return {
+            "wakeups": self.wakeups,
+            "io_wakeups": self.io_wakeups,
+            "timer_wakeups": self.timer_wakeups,
+            "wakeups_per_s": round(self.wakeups / wall_s, 2),
+            "cpu_pct": round(100.0 * cpu_s / wall_s, 2),
+            "sleep_pct": round(100.0 * self.sleep_time_s / wall_s, 2),
+            "latency_mean_ms": round(self.latency_total_ms / self.timer_wakeups, 3) if self.timer_wakeups else 0.0,
+            "latency_max_ms": round(self.latency_max_ms, 3),
+        }
+
+
+class EventLoop:
+    """
+    Thin wrapper around selectors.DefaultSelector.
+
+    Sockets are registered with a callback that is invoked as
+    callback(fileobj, mask) when they are ready.  wait_until() blocks until
+    either a socket is ready or the given deadline has passed.
+    """
+
+    def __init__(self, clock):
+        """
+        Arguments:
+          clock (callable): Returns the current time in milliseconds.  Deadlines
+            passed to wait_until() use the same time base.
+        """
+        self._clock = clock
+        self._selector = selectors.DefaultSelector()
+        self.stats = LoopStats()
+
+        # Self-pipe so other threads can interrupt a sleeping select().
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._wake_writer.setblocking(False)
+        self._selector.register(self._wake_reader, selectors.EVENT_READ, self._drain_wakeups)
+
+    def close(self):
+        self._selector.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+    def register(self, fileobj, events, callback):
+        self._selector.register(fileobj, events, callback)
+
+    def modify(self, fileobj, events, callback):
+        self._selector.modify(fileobj, events, callback)
+
+    def unregister(self, fileobj):
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def is_registered(self, fileobj):
+        try:
+            self._selector.get_key(fileobj)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def wake(self):
+        """Interrupt wait_until() from another thread."""
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            # The pipe is already full, so the loop is already going to wake.
+            pass
+
+    def _drain_wakeups(self, fileobj, mask):
+        try:
+            while self._wake_reader.recv(512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def wait_until(self, deadline_ms=None):
+        """
+        Sleep until a registered socket is ready or deadline_ms is reached,
+        then dispatch the ready callbacks.
+
+        Arguments:
+          deadline_ms (float): Absolute deadline on the clock's time base, or
+            None to wait for socket activity only.
+        Returns the number of callbacks dispatched.  A callback may unregister
+        or modify any socket, including ones that are ready in the same wake-up:
+        those are dispatched as registered at the time, or not at all.
+        """
+        if deadline_ms is None:
+            timeout = None
+        else:
+            timeout = max(deadline_ms - self._clock(), 0.0) / 1000.0
+
+        slept_from = time.perf_counter()
+        events = self._selector.select(timeout)
+        slept_s = time.perf_counter() - slept_from
+
+        if events or deadline_ms is None:
+            self.stats.record_wakeup(slept_s, True)
+        else:
+            self.stats.record_wakeup(slept_s, False, max(self._clock() - deadline_ms, 0.0))
+
+        dispatched = 0
+        for key, mask in events:
+            try:
+                key = self._selector.get_key(key.fileobj)
+            except (KeyError, ValueError):
+                # Unregistered by an earlier callback.
+                continue
+            mask &= key.events
+            if mask:
+                key.data(key.fileobj, mask)
+                dispatched += 1
+        return dispatched
@@ -0,0 +1,159 @@
+"""
+Incoming stream framing.
+
+Received bytes land in a preallocated bytearray via recv_into() and are split
+into frames in place through a memoryview, so a large burst (e.g. a trajectory
+upload) is scanned once instead of being re-decoded and re-sliced per line.
+Complete frames are appended to a deque:
+
+  * text lines (without the newline) as str,
+  * binary trajectory frames (see trajectory_codec) as bytes.
+
+Lines are only decoded once complete, so a multi-byte UTF-8 character split
+across two recv() calls is decoded correctly.  Lines that aren't valid UTF-8
+are decoded with replacement characters and counted rather than dropped.
+
+A frame header announcing more than trajectory_codec.MAX_FRAME_BYTES is
+reported and everything up to the next newline is dropped, so one bad header
+can't grow the buffer towards 4 GiB or hold up the stream waiting for it.
+"""
+from collections import deque
+
+import trajectory_codec
+
+
+class LineFramer:
+    """Splits a byte stream into lines and binary trajectory frames."""
+
+    def __init__(self, capacity=65536, min_free=4096, frames=None, on_error=None):
+        """
+        Arguments:
+          capacity (int): Initial receive buffer size in bytes.  The buffer grows
+            if a single frame doesn't fit.
+          min_free (int): Minimum free space to offer each recv_into() call.
+          frames (deque): Where to append complete frames, so several framers can
+            share one queue.  A new deque if not given.
+          on_error (callable): Called with a message when received data is dropped.
+        """
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._min_free = min_free
+        # Unconsumed data lives in _buffer[_start:_end].
+        self._start = 0
+        self._end = 0
+        # Offset up to which _buffer has already been searched for a newline.
+        self._scanned = 0
+        # Dropping everything up to the next newline after a bad frame header.
+        self._resyncing = False
+        self._on_error = on_error
+
+        self.frames = deque() if frames is None else frames
+        """Complete frames waiting to be processed."""
+        self.decode_errors = 0
+        """Lines that weren't valid UTF-8."""
+        self.frame_errors = 0
+        """Frame headers that were rejected, and dropped up to the next newline."""
+
+    @property
+    def buffered(self) -> int:
+        """Bytes received but not yet part of a complete frame."""
+        return self._end - self._start
+
+    def _reserve(self, size: int):
+        """Make sure at least size bytes are free at the end of the buffer."""
+        if len(self._buffer) - self._end >= size:
+            return
+        pending = self._end - self._start
+        if self._start > 0:
+            # Move the partial frame to the front of the buffer.
+            self._buffer[:pending] = self._view[self._start:self._end]
+            self._scanned -= self._start
+            self._start = 0
+            self._end = pending
+        if len(self._buffer) - self._end < size:
+            # Still too small, so grow. The view has to be released before resizing.
+            self._view.release()
+            self._buffer.extend(bytes(max(size, len(self._buffer))))
+            self._view = memoryview(self._buffer)
+
+    def recv_from(self, connection) -> int:
+        """
+        Receive directly into the buffer and split out any complete frames.
+        Returns the number of bytes received (0 means the peer closed the connection).
+        """
+        self._reserve(self._min_free)
+        received = connection.recv_into(self._view[self._end:])
+        self._end += received
+        self._split()
+        return received
+
+    def feed(self, data) -> int:
+        """Append already received bytes. Returns the number of frames completed."""
+        queued = len(self.frames)
+        self._reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+        self._split()
+        return len(self.frames) - queued
+
+    def _split(self):
+        buffer = self._buffer
+        view = self._view
+        frames = self.frames
+        start = self._start
+        end = self._end
+
+        while start < end:
+            if self._resyncing:
+                newline = buffer.find(b"\n", start, end)
+                if newline == -1:
+                    start = end
+                    break
+                start = newline + 1
+                self._scanned = start
+                self._resyncing = False
+                continue
+
+            # Binary trajectory frames are queued whole, as bytes.
+            if buffer.startswith(trajectory_codec.FRAME_MAGIC, start, end):
+                try:
+                    frame_length = trajectory_codec.frame_length(view[start:end])
+                except trajectory_codec.FrameError as e:
+                    self.frame_errors += 1
+                    self._resyncing = True
+                    if self._on_error is not None:
+                        self._on_error(str(e) + ", dropped up to the next newline.")
+                    continue
+                if frame_length is None:
+                    break
+                if end - start < frame_length:
+                    # Make sure the whole frame will fit, then wait for the rest of it.
+                    self._start = start
+                    self._scanned = start
+                    self._reserve(frame_length - (end - start))
+                    return
+                frames.append(bytes(view[start:start + frame_length]))
+                start += frame_length
+                self._scanned = start
+                continue
+
+            # Otherwise wait for a full line, only searching bytes we haven't looked at yet.
+            newline = buffer.find(b"\n", max(start, self._scanned), end)
+            if newline == -1:
+                self._scanned = end
+                break
+            line = view[start:newline]
+            try:
+                frames.append(str(line, 'utf-8'))
+            except UnicodeDecodeError:
+                self.decode_errors += 1
+                frames.append(str(line, 'utf-8', 'replace'))
+            line.release()
+            start = newline + 1
+
+        if start == end:
+            # Everything consumed; start over at the front without copying.
+            self._start = self._end = self._scanned = 0
+        else:
+            self._start = start
+            self._scanned = max(self._scanned, start)
@@ -1,16 +1,45 @@
+import os
 import socket
-import select
+import selectors
+import tempfile
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import sim_hardware
+# Swap in the simulated hardware before the hardware libraries are imported (PUMPAPP_HARDWARE=sim).
+hardware_backend = sim_hardware.select_backend()
+
 import board
 # import pigpio
 
 # import stepper
 import time
 import adafruit_mprls
-import threading
-import queue
 
 import advpistepper
 
+from event_loop import EventLoop
+from pressure_sampler import PressureSampler
+from rolling_stats import RollingStats
+from pressure_control import PressureControl, TargetCurve
+import trajectory_codec
+from framing import LineFramer
+import outbound
+import protocol
+import telemetry
+from telemetry import UdpTelemetry
+import trajectory
+from trajectory import Trajectory
+from trajectory_library import TrajectoryLibrary
+import mapped_trajectory
+from mapped_trajectory import MappedTrajectory
+import trajectory_upload
+from trajectory_upload import TrajectoryUpload
+import tick_schedule
+from tick_schedule import TickSchedule
+from RaspberryPiStepperDriver import clock
+
 # @TODO: Remove debugging test code.
 # import RaspberryPiStepperDriver.accelstepper as accelstepper
 # import RaspberryPiStepperDriver.profiles as acceleration_profiles
@@ -36,19 +65,57 @@ class AppState:
     """The number of iterations since the last priming update."""
     stepper_target_position = 0
     """The target position of the stepper motor in steps relative to start position as 0."""
-    pressure_sensor_update_queue = queue.Queue(maxsize=10)
-    """The queue of pressure sensor updates to send to the client."""
+    pressure_sample_rate_hz = 100.0
+    """The rate at which the pressure sensor is sampled."""
+    sampler = None
+    """The background pressure sampler."""
+    pressure_reader = None
+    """The main loop's cursor into the pressure sample ring buffer."""
+    pressure_stats = None
+    """Rolling statistics over the pressure samples, updated by the sampler."""
+    pressure_framer = None
+    """How pressure samples are batched into frames, or None to send a P: line per sample."""
     last_priming_update = 0
 
     home_offset = 0
     """The offset from the stepper lib's home position in steps based on csv provided."""
     data_time_step_ms = 10
     """The time in milliseconds between movement data points."""
+    interpolation = trajectory.INTERPOLATION_STEP
+    """How playback moves between data points, one of trajectory.INTERPOLATION_MODES."""
+    subdivisions = 1
+    """Playback ticks per data point when interpolating."""
+    pressure_update_interval_ms = 10
+    """The time in milliseconds between pressure sensor updates sent to the client."""
 
     stepper = None
     i2c = None
     mpr = None
     comm = None
+    loop = None
+    """The event loop the main loop sleeps in between events."""
+    reply = None
+    """Lines sent while carrying out a protocol v2 request, which go back to the client with its reply."""
+    sender = None
+    """The client (Subscriber) whose command is being carried out, None if it didn't come from a client."""
+    last_upload = {}
+    """Statistics about the last positional data upload."""
+    upload = None
+    """The upload being received (trajectory_upload.TrajectoryUpload), if any."""
+    upload_items_per_cycle = 256
+    """Most received lines/frames fed to an upload per pass of the main loop, so playback keeps its timing."""
+    pending_trajectory = None
+    """A complete, compiled upload waiting to be swapped in."""
+    pending_swap_at = trajectory_upload.SWAP_NOW
+    """When pending_trajectory is swapped in, see stage_trajectory()."""
+    upload_worker = None
+    """The thread complete uploads are compiled and stored on (concurrent.futures.ThreadPoolExecutor)."""
+    preparing = None
+    """(future, trajectory, swap_at) of the upload the worker is preparing, if any."""
+    recompiling = None
+    """(future, trajectory, recompiled) while the worker recompiles the trajectory with new settings."""
+    library = None
+    """Uploaded trajectories by content hash (trajectory_library), or None if it couldn't be opened."""
 
     def __init__(self):
         self.version = "1.1.0"
@@ -56,13 +123,19 @@ class AppState:
         """The last time the stepper motor performed a step (ms since epoch)."""
         self.scale_multiplier = 1.0
         self.positional_data = []
+        self.trajectory = Trajectory()
+        """The positional data compiled into stepper targets and speeds."""
+        self.pressure_control = PressureControl()
+        """Closed-loop control of the stroke from the pressure, when enabled."""
         self.data_time_step_ms = 10
         """The time in milliseconds between data points."""
         self.last_priming_update = 0
-        self.last_pressure_sensor_update = 0
-        self.app_start_time_ms = time.time() * 1000
-        self.last_update = -1
-        """The last time the stepper motor target position was updated (ms since epoch)."""
+        self.last_pressure_sensor_flush = 0
+        """The last time queued pressure sensor updates were sent to the client."""
+        self.app_start_time_ns = clock.monotonic_ns()
+        """When the app started, on the shared monotonic clock."""
+        self.tick_schedule = TickSchedule()
+        """When each trajectory tick is due, on the current_time_in_ms() time base."""
         self.home_offset = 0
         # self.stepper = stepper.MyStepperController(
         #     step_pin=23,
@@ -100,116 +173,202 @@ class AppState:
         self.send_pressure_sensor_update = True
 
 
-class Communications:
-    read_queue = []
-    connection = None
-    socket = None
-    read_buffer = ""
-
-    def __init__(self):
-        self.connection = None
-        self.read_queue = []
-        self.write_queue = []
-        self.read_handle = None
-        self.write_handle = None
+class Subscriber:
+    """One connected client, with its own framer and outbound queue so a slow reader only holds up itself."""
+
+    def __init__(self, comm, connection, address):
+        self.comm = comm
+        self.connection = connection
+        self.address = address
+        self.received = deque()
+        self.framer = LineFramer(frames=self.received, on_error=self.report_framing_error)
+        """Splits what the client sends into lines and frames, which are moved on to the shared read queue."""
+        self.write_queue = outbound.OutboundQueue()
+        """Outgoing messages for this client, by priority."""
+        # Set to non-blocking for the recv/send calls hereafter.
+        self.connection.setblocking(False)
+        # Let the event loop wake us when the client sends something.
+        self.registered_events = selectors.EVENT_READ
+        app.loop.register(self.connection, self.registered_events, self.on_ready)
+
+    def close(self):
+        app.loop.unregister(self.connection)
+        self.connection.close()
 
-        self.connect()
+    def update_interest(self):
+        """Only ask the event loop for write readiness while there is something to write."""
+        events = selectors.EVENT_READ
+        if len(self.write_queue) > 0:
+            events |= selectors.EVENT_WRITE
+        if events != self.registered_events:
+            self.registered_events = events
+            app.loop.modify(self.connection, events, self.on_ready)
+
+    def on_ready(self, connection, mask):
+        """Event loop callback for the client connection."""
+        if mask & selectors.EVENT_READ:
+            # Fetch incoming data from stream and queue it.
+            self.process_incoming()
+        if mask & selectors.EVENT_WRITE and self in self.comm.subscribers:
+            # Send outgoing data from queue to stream.
+            self.process_outgoing()
 
-    def __del__(self):
-        self.disconnect()
+    def send_data(self, data: bytes, priority):
+        if not self.write_queue.push(data, priority):
+            # Its replies and errors would be lost, so rather than carrying on without them, let it reconnect.
+            print("Client " + str(self.address) + " isn't reading its replies.")
+            self.comm.overflowed += 1
+            self.comm.remove_subscriber(self)
+            return
+        self.update_interest()
 
-    def disconnect(self):
-        self.connection.close()
-        self.socket.close()
+    def report_framing_error(self, message):
+        # Only this client sent the bad data.
+        self.send_data(("E:" + message + "\n").encode(), outbound.PRIORITY_ERROR)
 
-    def connect(self):
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # Allow for quick reuse of the socket.
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(('0.0.0.0', 9999))
-        self.socket.listen(1)
+    def process_outgoing(self):
+        # Send as much as the connection will take without blocking.
+        try:
+            self.write_queue.flush(self.connection)
+        except (BrokenPipeError, ConnectionResetError):
+            self.comm.remove_subscriber(self)
+            return
+        self.update_interest()
 
-        print("Waiting for a connection")
-        self.connection, address = self.socket.accept()
-        # Set to non-blocking for the recv calls hereafter.
-        self.socket.setblocking(False)
-        print("Connection from " + str(address))
+    def process_incoming(self):
+        """Read whatever the client has sent. Only called once the connection is readable."""
+        # Receive data straight into the framer, note that this does not block since the connection is readable.
+        try:
+            if self.framer.recv_from(self.connection) == 0:
+                self.comm.remove_subscriber(self)
+                return
+        except BlockingIOError:
+            pass
+        except ConnectionResetError:
+            self.comm.remove_subscriber(self)
+            return
 
-    def send_data(self, data):
-        self.write_queue.insert(0, data)
+        read_queue = self.comm.read_queue
+        received = self.received
+        while received:
+            item = received.popleft()
+            # Protocol v2 requests are replied to this client alone, so remember who sent them.
+            if isinstance(item, str) and item.startswith(protocol.REQUEST_PREFIX):
+                item = protocol.Request(self, item)
+            if app.debugging:
+                print("[Input]:" + str(item))
+            read_queue.append((self, item))
 
-        if len(self.write_queue) > 200:
-            self.write_queue = ["E:Write queue overflow!"]
-            app.comm.socket.setblocking(True)
-            self.process_outgoing()
-            app.comm.socket.setblocking(False)
 
-    def process_streams(self):
-        # Fetch incoming data from stream and queue it.
-        self.process_incoming()
-        # Send outgoing data from queue to stream.
-        self.process_outgoing()
+class Communications:
+    """
+    The TCP server clients subscribe to, and the optional UDP telemetry stream.
 
-    def process_outgoing(self):
-        # Check if the sockets are ready on the connection.
-        read_handle, write_handle, exception_handle = select.select(
-            [],
-            [self.connection],
-            [], 0)
-
-        if self.connection in exception_handle:
-            print("Connection closed!")
-            self.connection.close()
-            self.connect()
-            return
+    Any number of clients (up to max_subscribers) can be connected at once.
+    Commands from all of them are handled in the order they arrive, and
+    everything the app sends goes to all of them.  While a client uploads a
+    trajectory, everything it sends is data for the upload.
+    """
+    socket = None
 
-        # If there is data to write...
-        if self.connection in write_handle:
-            # While there is data in the write queue...
-            while len(self.write_queue) > 0:
-                # Send the data.
-                self.connection.send(self.write_queue.pop().encode())
+    def __init__(self, port=9999, max_subscribers=8):
+        self.port = port
+        self.max_subscribers = max_subscribers
+        self.read_queue = deque()
+        """
+        (subscriber, item) for every complete line (str), binary frame (bytes) and protocol v2
+        request (protocol.Request) received, from any client, in the order they arrived.
+        """
+        self.subscribers = []
+        """Connected clients, oldest first."""
+        self.udp = UdpTelemetry()
+        """Telemetry datagrams for the listeners added with the U command."""
+        self.accepted = 0
+        self.rejected = 0
+        """Connections turned away because max_subscribers were already connected."""
+        self.overflowed = 0
+        """Clients disconnected because their control or error queue was full."""
+
+        self.listen()
+
+    def listen(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Allow for quick reuse of the socket.
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('0.0.0.0', self.port))
+        self.socket.listen(self.max_subscribers)
+        # Accept from the event loop rather than blocking until someone connects.
+        self.socket.setblocking(False)
+        app.loop.register(self.socket, selectors.EVENT_READ, self.on_accept)
+        print("Listening for connections on port " + str(self.port))
 
-    def process_incoming(self):
-        # Check if the sockets are ready on the connection.
-        read_handle, write_handle, exception_handle = select.select(
-            [self.connection],
-            [],
-            [], 0)
-
-        if self.connection in exception_handle:
-            print("Connection closed!")
-            self.connection.close()
-            self.connect()
-            return
+    def close(self):
+        for subscriber in list(self.subscribers):
+            self.remove_subscriber(subscriber)
+        app.loop.unregister(self.socket)
+        self.socket.close()
+        self.udp.close()
 
-        # If there is data to read...
-        if self.connection in read_handle:
-            # Receive data, note that this does not block if no data is available.
+    def on_accept(self, listening_socket, mask):
+        """Event loop callback for the listening socket."""
+        while True:
             try:
-                data = self.connection.recv(2048)
-                if not data:
-                    print("Connection closed!")
-                    self.connection.close()
-                    self.connect()
-                    return
-                self.read_buffer += data.decode('utf-8')
-            except BlockingIOError:
-                pass
-            except UnicodeDecodeError:
-                pass
-            except ConnectionResetError:
-                pass
-
-            # While there are newlines present in the read buffer...
-            while self.read_buffer.find("\n") != -1:
-                new_item = self.read_buffer[:self.read_buffer.find("\n")]
-                # Append the data to the read queue (without the newline).
-                self.read_queue.append(new_item)
-                if app.debugging:
-                    print("[Input]:" + new_item)
-                # Remove the processed data from the buffer.
-                self.read_buffer = self.read_buffer[self.read_buffer.find("\n") + 1:]
+                connection, address = listening_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            if len(self.subscribers) >= self.max_subscribers:
+                self.rejected += 1
+                connection.close()
+                print("Rejected connection from " + str(address) + ", too many clients.")
+                continue
+            self.add_subscriber(connection, address)
+
+    def add_subscriber(self, connection, address):
+        subscriber = Subscriber(self, connection, address)
+        self.subscribers.append(subscriber)
+        self.accepted += 1
+        print("Connection from " + str(address))
+        return subscriber
+
+    def remove_subscriber(self, subscriber):
+        if subscriber not in self.subscribers:
+            return
+        self.subscribers.remove(subscriber)
+        subscriber.close()
+        print("Connection closed! " + str(subscriber.address))
+        if app.upload is not None and app.upload.sender is subscriber:
+            abandon_upload()
+
+    def send_data(self, data, priority=None):
+        """
+        Queue data for every client. This never blocks; it is written once each connection is writable.
+        Telemetry also goes out over UDP.
+
+        Parameters:
+            data (str): The data to send, or bytes for a binary frame.
+            priority (int): One of the outbound.PRIORITY_* values, or None to pick one from the message prefix.
+                Required for bytes.
+        """
+        if priority is None:
+            priority = outbound.classify(data)
+        encoded = data if isinstance(data, bytes) else data.encode()
+        # A client that has stopped reading is removed as it's sent to.
+        for subscriber in list(self.subscribers):
+            subscriber.send_data(encoded, priority)
+        if priority == outbound.PRIORITY_TELEMETRY:
+            self.udp.send(encoded)
+
+    def statistics(self) -> dict:
+        stats = {"subscribers": len(self.subscribers), "accepted": self.accepted, "rejected": self.rejected,
+                 "overflowed": self.overflowed}
+        # Queue counters summed over the connected clients.
+        for subscriber in self.subscribers:
+            for key, value in subscriber.write_queue.snapshot().items():
+                stats[key] = stats.get(key, 0) + value
+        stats["decode_errors"] = sum(subscriber.framer.decode_errors for subscriber in self.subscribers)
+        stats["frame_errors"] = sum(subscriber.framer.frame_errors for subscriber in self.subscribers)
+        stats.update(self.udp.snapshot())
+        return stats
 
 
 # Create an instance of the app state.
@@ -217,65 +376,418 @@ app = AppState()
 
 
 def logger(text):
-    app.comm.send_data(text + "\n")
+    if app.reply is not None:
+        # Part of the reply to a protocol v2 request, see process_request().
+        app.reply.append(text)
+    else:
+        app.comm.send_data(text + "\n")
     print(text)
 
 
 def update_step_frequency(data: int):
+    if data <= 0:
+        logger("E:Invalid step length: " + str(data) + " ms, must be at least 1 ms.")
+        return
     app.data_time_step_ms = data
     # Convert app.data_time_step_ms (wavelength) to frequency
     frequency = (1000 / app.data_time_step_ms)
 
+    compile_trajectory()
+
     logger(
         "I:Step frequency updated to " + str(frequency) + " Hz.," +
         " step length is " + str(app.data_time_step_ms) + " ms.")
 
 
+def playback_settings(home_offset):
+    """What trajectories are compiled with: (home_offset, scale_multiplier, time_step_ms, interpolation, subdivisions)."""
+    return home_offset, app.scale_multiplier, app.data_time_step_ms, app.interpolation, app.subdivisions
+
+
+def playback_tick_ms() -> float:
+    """Time between trajectory ticks with the current time step and interpolation."""
+    if app.interpolation == trajectory.INTERPOLATION_STEP:
+        return app.data_time_step_ms
+    return app.data_time_step_ms / app.subdivisions
+
+
+def compile_trajectory():
+    """
+    Recompile the trajectory after its home offset, scale multiplier, time step or interpolation
+    changed.  A trajectory held in memory is recompiled on the upload worker, so a long one doesn't
+    hold up the loop, and keeps playing as it was until the new one is swapped in between two
+    ticks (see finish_recompiling()).
+    """
+    settings = playback_settings(app.home_offset)
+    trajectory = app.trajectory
+    if trajectory.compiled_with == settings or app.recompiling is not None:
+        # Up to date, or finish_recompiling() starts over with the latest settings.
+        pass
+    elif isinstance(trajectory, MappedTrajectory) or len(trajectory.samples) == 0 or app.upload_worker is None:
+        # Takes no time (or there is no worker to hand it to).
+        subdivisions = trajectory.subdivisions
+        trajectory.compile(*settings)
+        keep_place(subdivisions)
+    else:
+        recompiled = Trajectory(trajectory.samples)
+        future = app.upload_worker.submit(recompiled.compile, *settings)
+        future.add_done_callback(lambda _: app.loop.wake())
+        app.recompiling = (future, trajectory, recompiled)
+
+    # Keep a staged file ready to swap in.  One held in memory is recompiled once it's playing.
+    if isinstance(app.pending_trajectory, MappedTrajectory):
+        try:
+            prepare_trajectory(app.pending_trajectory, rehome=not isinstance(app.pending_swap_at, int))
+        except ValueError as e:
+            discard_pending_trajectory()
+            logger("E:Staged trajectory discarded: " + str(e))
+
+
+def finish_recompiling():
+    """Play the trajectory recompiled by compile_trajectory() from the next tick on, at the same point of the data."""
+    future, trajectory, recompiled = app.recompiling
+    app.recompiling = None
+    try:
+        future.result()
+    except ValueError as e:
+        logger("E:Couldn't recompile the trajectory: " + str(e))
+        return
+    if trajectory is not app.trajectory or recompiled.compiled_with != playback_settings(app.home_offset):
+        # Replaced, or the settings changed again while it was compiling.
+        compile_trajectory()
+        return
+    app.trajectory = recompiled
+    keep_place(trajectory.subdivisions)
+
+
+def keep_place(subdivisions):
+    """Stay at the same point of the data after the trajectory was recompiled from subdivisions ticks per data point."""
+    if app.trajectory.subdivisions != subdivisions:
+        app.positional_data_index = app.positional_data_index // subdivisions * app.trajectory.subdivisions
+    if app.positional_data_index >= len(app.trajectory):
+        app.positional_data_index = 0
+
+
 def set_new_home_position():
     """Set the current position as the new home position.
     This will reset the positional data index to 0.
     """
     # app.stepper.set_current_position(0)
     app.stepper.zero()
+    compile_trajectory()
     if app.debugging:
         logger("I:New home position set.")
 
 
-def load_positional_data(line_count: int):
-    # (Re)initialize the positional data.
-    app.positional_data = []
-    index = 0
+def load_positional_data(data: str):
+    """
+    Start receiving new positional data from the client.  The main loop feeds it to the
+    upload (see receive_upload()) while the current trajectory keeps playing, and the new
+    trajectory is swapped in once it is complete (see stage_trajectory()).
+
+    Parameters:
+        data (str): "B" for a binary trajectory frame, "F" to stream the samples into a file and
+            play them from there (see mapped_trajectory), sent as for a text upload and/or as any
+            number of binary trajectory frames, "M:<path>" to play a file that is already on the
+            device (relative to mapped_directory()), otherwise the data is sent as one ASCII sample
+            per line terminated by an empty line.
+            Optionally followed by "@<when>": "@N" to swap the new trajectory in as soon as it is
+            ready (the default), "@E" at the end of the current cycle, or "@<tick>" when playback
+            reaches that tick.
+    """
+    swap_at = trajectory_upload.SWAP_NOW
+    if "@" in data:
+        data, _, swap = data.rpartition("@")
+        try:
+            swap_at = trajectory_upload.parse_swap(swap)
+        except ValueError as e:
+            # The data follows regardless, so receive it and swap it in when it's ready.
+            logger("E:Invalid swap point " + swap + ", swapping when ready: " + str(e))
+
+    if data.startswith("M"):
+        path = data[2:].strip()
+        if not os.path.isabs(path):
+            path = os.path.join(mapped_directory(), path)
+        if not os.path.exists(path) and not path.endswith(mapped_trajectory.FILE_SUFFIX):
+            path += mapped_trajectory.FILE_SUFFIX
+        mapped = open_mapped_trajectory(path)
+        if mapped is not None:
+            logger("D:" + str(len(mapped.samples)))
+            stage_trajectory(mapped, swap_at)
+        return
 
-    # Fetch data from stream and queue it.
-    while True:
-        app.comm.process_incoming()
+    if app.upload is not None:
+        # Everything the uploading client sends goes to its upload, so this came from another one.
+        logger("E:Another client is uploading a trajectory.")
+        return
+    if data.startswith("B"):
+        mode = trajectory_upload.MODE_BINARY
+    elif data.startswith("F"):
+        mode = trajectory_upload.MODE_FILE
+    else:
+        mode = trajectory_upload.MODE_TEXT
+    path = os.path.join(mapped_directory(), "upload" + mapped_trajectory.FILE_SUFFIX)
+    try:
+        app.upload = TrajectoryUpload(mode, swap_at, path, app.sender)
+    except OSError as e:
+        logger("E:Can't receive a file upload: " + str(e))
 
-        # If we have data in the queue, process it.
-        if len(app.comm.read_queue) > 0:
-            # Get the first item in the queue.
-            line = app.comm.read_queue.pop(0).strip()
-            if len(line) > 0:
-                app.positional_data.append(float(line))
-                if app.debugging:
-                    print("[DATA]: Received " + line)
-            else:
-                # If the line is empty, we have reached the end of the data.
-                # if line_count == len(app.positional_data):
-                # Send acknowledgement to client.
-                logger("D:" + str(len(app.positional_data)))
-                # else:
-                #     logger("E:Data error, expected:" + str(line_count) + " got:" + str(len(app.positional_data)))
-                # Set the "home" to whatever the first entry in the datafile is.
-                # This will avoid the stepper logic trying to "catch up" to start.
-                app.home_offset = app.positional_data[0]
-
-                # app.stepper.set_current_position(app.positional_data[0])
-                app.stepper.zero()
-                if app.debugging:
-                    # Print the data if debugging is enabled.
-                    for line in app.positional_data:
-                        logger("I: %f" % line)
+
+def receive_upload():
+    """
+    Feed what the uploading client has sent to the upload in progress, up to upload_items_per_cycle
+    lines/frames.  Commands from other clients are carried out as they come.
+    """
+    upload = app.upload
+    fed = 0
+    while fed < app.upload_items_per_cycle:
+        if len(app.comm.read_queue) == 0:
+            return
+        sender, item = app.comm.read_queue.popleft()
+        if upload.sender is not None and sender is not upload.sender:
+            dispatch(sender, item)
+            if app.upload is not upload:
+                # Abandoned: the command dropped the uploading client.
                 return
+            continue
+        fed += 1
+        if isinstance(item, protocol.Request):
+            # Everything is data until the upload is complete.
+            item = item.line
+        if app.debugging and isinstance(item, str):
+            print("[DATA]: Received " + item.strip())
+        if upload.feed(item):
+            app.upload = None
+            finish_upload(upload)
+            return
+
+
+def abandon_upload():
+    """Throw away the upload in progress, once the client sending it has gone."""
+    upload, app.upload = app.upload, None
+    upload.abort()
+    # Whatever else it sent is the rest of the data, not commands.
+    app.comm.read_queue = deque(entry for entry in app.comm.read_queue if entry[0] is not upload.sender)
+    logger("E:Upload abandoned, the client sending it disconnected.")
+
+
+def finish_upload(upload):
+    """Acknowledge a complete upload and stage the new trajectory."""
+    app.last_upload = upload.statistics()
+    if upload.ignored:
+        logger("E:" + str(upload.ignored) + " unexpected binary frame(s) during text upload, ignored.")
+    try:
+        result = upload.result()
+    except (ValueError, OSError) as e:
+        logger("E:Upload discarded: " + str(e))
+        return
+
+    if upload.mode == trajectory_upload.MODE_FILE:
+        # Named after its samples, like the trajectory library.
+        path = os.path.join(mapped_directory(), result + mapped_trajectory.FILE_SUFFIX)
+        try:
+            os.replace(upload.writer.path, path)
+        except OSError as e:
+            logger("E:Upload discarded: " + str(e))
+            return
+        trajectory = open_mapped_trajectory(path)
+        if trajectory is None:
+            return
+    else:
+        trajectory = result
+
+    # Send acknowledgement to client.
+    logger("D:" + str(len(trajectory.samples)))
+    logger(format_statistics("UPLOAD", app.last_upload))
+
+    if isinstance(trajectory, MappedTrajectory):
+        stage_trajectory(trajectory, upload.swap_at)
+        return
+
+    if app.debugging:
+        # Print the data if debugging is enabled.
+        for line in trajectory.samples:
+            logger("I: %f" % line)
+
+    # Compiling and storing a long trajectory takes a while, so it's done off the loop.
+    home_offset = trajectory.samples[0] if len(trajectory.samples) > 0 else app.home_offset
+    if isinstance(upload.swap_at, int):
+        home_offset = app.home_offset
+    future = app.upload_worker.submit(prepare_upload, trajectory, playback_settings(home_offset))
+    future.add_done_callback(lambda _: app.loop.wake())
+    app.preparing = (future, trajectory, upload.swap_at)
+
+
+def prepare_upload(trajectory, settings):
+    """
+    Compile an uploaded trajectory and keep it in the library.  Runs on the upload worker thread.
+    Returns the trajectory's digest, or the OSError storing it raised.
+    """
+    trajectory.compile(*settings)
+    if app.library is None:
+        return None
+    try:
+        return app.library.add(trajectory)
+    except OSError as e:
+        return e
+
+
+def finish_preparing():
+    """Stage an upload once the upload worker has compiled and stored it."""
+    future, trajectory, swap_at = app.preparing
+    app.preparing = None
+    try:
+        stored = future.result()
+    except ValueError as e:
+        logger("E:Upload discarded: " + str(e))
+        return
+    if isinstance(stored, OSError):
+        logger("E:Couldn't store the trajectory: " + str(stored))
+    elif stored is not None:
+        # Kept, so it can be activated again without uploading it.
+        logger("K:S:" + stored)
+    stage_trajectory(trajectory, swap_at)
+
+
+def mapped_directory():
+    """Where streamed uploads are kept: with the trajectory library, or in the temporary directory."""
+    if app.library is not None:
+        return app.library.directory
+    return tempfile.gettempdir()
+
+
+def open_mapped_trajectory(path):
+    """Map the sample file at path for playback, or return None (with an error sent) if that isn't possible."""
+    try:
+        mapped = MappedTrajectory(path)
+    except (ValueError, OSError) as e:
+        logger("E:Couldn't map " + path + ": " + str(e))
+        return None
+    if app.interpolation not in mapped.interpolation_modes:
+        mapped.close()
+        logger("E:" + app.interpolation + " interpolation isn't available when playing from a file.")
+        return None
+    return mapped
+
+
+def prepare_trajectory(trajectory, rehome=True):
+    """
+    Compile trajectory with the current settings, homed on its first sample if rehome
+    or on the current home offset otherwise, unless it already is.
+    """
+    home_offset = trajectory.samples[0] if rehome and len(trajectory.samples) > 0 else app.home_offset
+    settings = playback_settings(home_offset)
+    if trajectory.compiled_with != settings:
+        trajectory.compile(*settings)
+
+
+def stage_trajectory(trajectory, swap_at=trajectory_upload.SWAP_NOW):
+    """
+    Compile trajectory in the back buffer, then play it from the next tick at swap_at:
+    trajectory_upload.SWAP_NOW, SWAP_BOUNDARY, or a tick of the current trajectory (carrying
+    on from the same tick of the new one, with the same home offset).  Swaps straight away
+    if nothing is playing.  Replaces any trajectory already waiting for its swap.
+    """
+    discard_pending_trajectory()
+    prepare_trajectory(trajectory, rehome=not isinstance(swap_at, int))
+    if swap_at == trajectory_upload.SWAP_NOW or not app.runMotors or len(app.trajectory) == 0:
+        use_trajectory(trajectory, rehome=not isinstance(swap_at, int))
+        return
+    app.pending_trajectory = trajectory
+    app.pending_swap_at = swap_at
+    if isinstance(swap_at, int) and swap_at < len(app.trajectory):
+        logger("I:New trajectory ready, swapping at tick " + str(swap_at) + ".")
+    else:
+        logger("I:New trajectory ready, swapping at the end of the cycle.")
+
+
+def discard_pending_trajectory():
+    pending = app.pending_trajectory
+    app.pending_trajectory = None
+    if isinstance(pending, MappedTrajectory) and pending is not app.trajectory:
+        pending.close()
+
+
+def swap_due() -> bool:
+    """Whether the trajectory waiting for its swap should be played from the current tick."""
+    if app.pending_trajectory is None:
+        return False
+    swap_at = app.pending_swap_at
+    if isinstance(swap_at, int) and swap_at < len(app.trajectory):
+        return app.positional_data_index == swap_at
+    # At the boundary, or a tick the current trajectory doesn't reach.
+    return app.positional_data_index == 0
+
+
+def swap_pending_trajectory():
+    trajectory = app.pending_trajectory
+    app.pending_trajectory = None
+    use_trajectory(trajectory, rehome=not isinstance(app.pending_swap_at, int))
+    logger("I:Swapped to the new trajectory at tick " + str(app.positional_data_index) + ".")
+
+
+def use_trajectory(trajectory, rehome=True):
+    """
+    Play trajectory from now on, homed on its first sample if rehome.  Otherwise it is
+    played relative to the current home, from the same tick as the current trajectory.
+    """
+    previous = app.trajectory
+    app.trajectory = trajectory
+    app.positional_data = trajectory.samples
+    if isinstance(previous, MappedTrajectory) and previous is not trajectory:
+        previous.close()
+
+    # Set the "home" to whatever the first entry in the datafile is.
+    # This will avoid the stepper logic trying to "catch up" to start.
+    if rehome and len(app.positional_data) > 0:
+        app.home_offset = app.positional_data[0]
+    # Staged and resident trajectories are usually compiled with the current settings already.
+    compile_trajectory()
+    if app.positional_data_index >= len(app.trajectory):
+        app.positional_data_index = 0
+
+    if rehome:
+        # app.stepper.set_current_position(app.positional_data[0])
+        app.stepper.zero()
+
+
+def update_trajectory_library(data: str):
+    """
+    Look after the on-device trajectory library.
+
+    Parameters:
+        data (str): "C:<digest>" to check whether a trajectory is stored (replies K:Y or K:N),
+            "A:<digest>" to play a stored trajectory, "D:<digest>" to delete one,
+            or "L" to list them. Digests may be shortened to a unique prefix of 8 or more characters.
+    """
+    if app.library is None:
+        logger("E:No trajectory library.")
+        return
+    command, _, prefix = data.partition(":")
+    command = command.strip().upper()
+    if command == "L":
+        logger("K:L:" + ",".join(app.library.digests()))
+        return
+    if command not in ("C", "A", "D"):
+        logger("E:Unknown trajectory library command: " + data)
+        return
+
+    name = app.library.resolve(prefix)
+    if command == "C":
+        logger(("K:Y:" + name) if name is not None else ("K:N:" + prefix.strip()))
+        return
+    if name is None:
+        logger("E:No stored trajectory " + prefix.strip())
+        return
+    try:
+        if command == "D":
+            app.library.remove(name)
+            logger("K:D:" + name)
+        else:
+            stage_trajectory(app.library.get(name))
+            logger("K:A:" + name + "," + str(len(app.trajectory.samples)))
+    except (KeyError, ValueError, OSError) as e:
+        logger("E:Trajectory " + name + " unavailable: " + str(e))
 
 
 def update_priming(data: int):
@@ -297,6 +809,37 @@ def update_priming(data: int):
         logger("I:Priming speed updated to " + str(data) + " steps per second.")
 
 
+def update_interpolation(data: str):
+    """
+    Update how playback moves between data points.
+
+    Parameters:
+        data (str): "<mode>[,<subdivisions>]", mode being step, linear, cubic or monotone,
+            e.g. "monotone,10" for ten ticks per data point along a monotone cubic.
+    """
+    mode, _, subdivisions = data.partition(",")
+    mode = mode.strip().lower()
+    try:
+        subdivisions = int(subdivisions) if subdivisions else (1 if mode == trajectory.INTERPOLATION_STEP else 10)
+        if mode not in trajectory.INTERPOLATION_MODES:
+            raise ValueError("unknown mode " + mode)
+        if not 1 <= subdivisions <= trajectory.MAX_SUBDIVISIONS:
+            raise ValueError("subdivisions must be 1-" + str(trajectory.MAX_SUBDIVISIONS))
+        if mode not in app.trajectory.interpolation_modes:
+            raise ValueError("not available for the current trajectory")
+    except ValueError as e:
+        logger("E:Invalid interpolation " + data + ": " + str(e))
+        return
+
+    app.interpolation = mode
+    app.subdivisions = subdivisions
+    compile_trajectory()
+    if mode == trajectory.INTERPOLATION_STEP:
+        subdivisions = 1
+    logger("I:Interpolation " + mode + ", " + str(app.data_time_step_ms / subdivisions) + " ms ticks, " +
+           str(subdivisions) + " per data point.")
+
+
 def update_scale_multiplier(data):
     """
     Update the scale multiplier.
@@ -306,100 +849,469 @@ def update_scale_multiplier(data):
         data (float): The scale multiplier.
     """
     app.scale_multiplier = data
+    compile_trajectory()
     if app.debugging:
         logger("I:Scale multiplier updated to " + str(data) + ".")
 
 
+def dispatch(sender, item):
+    """Carry out a command received from sender."""
+    app.sender = sender
+    try:
+        process_input(item)
+    finally:
+        app.sender = None
+
+
 def process_input(line):
+    """
+    Carry out one command from a client: an original protocol line, "<letter>:<argument>",
+    or a protocol v2 request (see protocol).
+    """
+    if isinstance(line, protocol.Request):
+        process_request(line)
+        return
     if len(line) == 0:
         return
+    if isinstance(line, bytes):
+        logger("E:Unexpected binary frame, ignored.")
+        return
 
     # Get first character of the line.
     cmd = line[0]
     # Fetch the rest of the line after : character and remove newline.
     data = line[2:].strip()
 
-    # Enable/disable (D)ebugging.
-    if cmd == 'D':
-        if data == "T":
-            app.debugging = True
-            logger("I:Debugging enabled.")
+    command = COMMANDS.get(cmd)
+    if command is None:
+        logger("E:Received unknown command/data: " + line.strip())
+        return
+    handler, argument_type = command
+    if argument_type is not None:
+        try:
+            argument = argument_type(data)
+        except ValueError:
+            logger("E:Invalid argument for " + cmd + ": " + data)
+            return
+    try:
+        if argument_type is None:
+            handler()
         else:
-            app.debugging = False
-            logger("I:Debugging disabled.")
-    # Update the step (F)requency - this is the ms between steps.
-    elif cmd == 'F':
-        update_step_frequency(int(data))
-    # Set new (H)ome position.
-    elif cmd == 'H':
-        set_new_home_position()
-    # (L)oad data
-    elif cmd == 'L':
-        load_positional_data(data)
-    # (P)rime pump
-    elif cmd == 'P':
-        app.priming = True
-        # app.stepper.enable_outputs()
-        # Convert the numeric bit to an integer.
-        update_priming(int(data))
-    # (R)un application.
-    elif cmd == 'R':
-        app.runMotors = True
-        # app.stepper.enable_outputs()
-        logger("I:Application started")
-    # (S)top application.
-    elif cmd == 'S':
-        app.runMotors = False
-        app.priming = False
-        app.stepper.stop()
-        # app.stepper.disable_outputs()
-        logger("I:Application stopped")
-    # Update (V)elocity.
-    elif cmd == 'V':
-        logger("E:Velocity update not implemented.")
-    # Update scale (X) multiplier for positional data
-    elif cmd == 'X':
-        update_scale_multiplier(float(data))
-    #
-    elif cmd == 'Z':
-        if data == "T":
-            logger("I:Suspending pressure sensor data updates")
-            app.send_pressure_sensor_update = False
+            handler(argument)
+    except Exception as e:
+        logger("E:" + command_failure(cmd, e))
+
+
+def command_failure(cmd, error) -> str:
+    """
+    Log the traceback of a command that raised and describe the failure for the client.
+    The last resort, so that one bad command doesn't take the app down.
+    """
+    traceback.print_exc()
+    return "Command " + cmd + " failed: " + type(error).__name__ + ": " + str(error)
+
+
+def process_request(request):
+    """Carry out a protocol v2 request, replying to the client that sent it alone."""
+    try:
+        request_id, cmd, data = request.parse()
+    except protocol.ProtocolError as e:
+        send_reply(request, protocol.error(request.best_id(), e.code, str(e)))
+        return
+    try:
+        command = COMMANDS.get(cmd)
+        if command is None:
+            raise protocol.ProtocolError(protocol.ERROR_COMMAND, "Unknown command " + cmd)
+        handler, argument_type = command
+        argument = protocol.convert_argument(data, argument_type)
+    except protocol.ProtocolError as e:
+        send_reply(request, protocol.error(request_id, e.code, str(e)))
+        return
+
+    # Whatever the command sends goes back to the client as part of the reply.
+    app.reply = []
+    crashed = None
+    try:
+        if argument_type is None:
+            handler()
         else:
-            logger("I:Resuming pressure sensor data updates")
-            app.send_pressure_sensor_update = True
-    elif cmd == '!':
-        from subprocess import call
-        call("sudo shutdown -h now", shell=True)
-    # (E)rror.
-    elif cmd == 'E':
-        logger("E:Received error from application: " + data)
+            handler(argument)
+    except Exception as e:
+        crashed = command_failure(cmd, e)
+    finally:
+        lines, app.reply = app.reply, None
+    failure = None
+    for line in lines:
+        if failure is None and line.startswith("E:"):
+            failure = line[2:]
+        else:
+            send_reply(request, protocol.reply_line(request_id, line))
+    if crashed is not None:
+        send_reply(request, protocol.error(request_id, protocol.ERROR_INTERNAL, crashed))
+    elif failure is None:
+        send_reply(request, protocol.ok(request_id))
     else:
-        logger("E:Received unknown command/data: " + line.strip())
+        send_reply(request, protocol.error(request_id, protocol.ERROR_FAILED, failure))
+
+
+def send_reply(request, text):
+    # The client may have gone while its requests were queued.
+    if request.sender in app.comm.subscribers:
+        request.sender.send_data(text.encode(), outbound.PRIORITY_CONTROL)
+
+
+def set_debugging(data: str):
+    """Enable/disable debugging, "T" to enable."""
+    if data == "T":
+        app.debugging = True
+        logger("I:Debugging enabled.")
+    else:
+        app.debugging = False
+        logger("I:Debugging disabled.")
+
+
+def start_priming(data: int):
+    app.priming = True
+    # app.stepper.enable_outputs()
+    update_priming(data)
+
+
+def start_application():
+    app.runMotors = True
+    # app.stepper.enable_outputs()
+    logger("I:Application started")
+
+
+def stop_application():
+    app.runMotors = False
+    app.priming = False
+    app.stepper.stop()
+    # Playback starts on a fresh schedule when it's resumed.
+    app.tick_schedule.stop()
+    # app.stepper.disable_outputs()
+    logger("I:Application stopped")
+
+
+def update_velocity(data: str):
+    logger("E:Velocity update not implemented.")
+
+
+def update_pressure_updates(data: str):
+    """
+    Suspend or resume pressure sensor updates, or change the sample rate.
+
+    Parameters:
+        data (str): "T" to suspend, "R<Hz>" to set the sample rate, anything else to resume.
+    """
+    if data.startswith("R"):
+        try:
+            rate_hz = float(data[1:])
+        except ValueError:
+            logger("E:Invalid pressure sample rate: " + data[1:])
+            return
+        update_pressure_sample_rate(rate_hz)
+    elif data == "T":
+        logger("I:Suspending pressure sensor data updates")
+        app.send_pressure_sensor_update = False
+    else:
+        logger("I:Resuming pressure sensor data updates")
+        # Don't dump everything sampled while suspended on the client.
+        app.pressure_reader.skip_to_latest()
+        app.send_pressure_sensor_update = True
+
+
+def shutdown():
+    from subprocess import call
+    call("sudo shutdown -h now", shell=True)
+
+
+def report_client_error(data: str):
+    logger("E:Received error from application: " + data)
+
+
+def update_overrun_policy(data: str):
+    """
+    Choose what playback does when a tick is played a whole tick period or more late.
+
+    Parameters:
+        data (str): "CATCHUP" to play the missed ticks back to back, "SKIP" to skip
+            them, or "STRETCH" to put the rest of the schedule back (see tick_schedule).
+    """
+    try:
+        app.tick_schedule.set_policy(data.strip().upper())
+    except ValueError as e:
+        logger("E:" + str(e))
+        return
+    logger("I:Tick overrun policy " + app.tick_schedule.policy + ".")
+
+
+def update_pressure_telemetry(data: str):
+    """
+    Choose how pressure samples are sent.
+
+    Parameters:
+        data (str): "P" (or "F") for a P: line per sample, "T" for text frames or "B" for binary frames,
+            optionally followed by comma separated settings: N=<samples per frame>,
+            I=<ms between flushes>, K=<send every Kth sample>. e.g. "B,N=64,I=50,K=2".
+    """
+    fields = data.split(",")
+    mode = fields[0].strip().upper()
+    settings = {}
+    try:
+        for field in fields[1:]:
+            key, _, value = field.partition("=")
+            settings[key.strip().upper()] = int(value)
+        if mode in (telemetry.FORMAT_LINES, "F"):
+            framer = None
+        elif mode in (telemetry.FORMAT_TEXT, telemetry.FORMAT_BINARY):
+            framer = telemetry.SampleFramer(
+                binary=mode == telemetry.FORMAT_BINARY,
+                batch_size=settings.get("N", 32),
+                decimation=settings.get("K", 1))
+        else:
+            raise ValueError("unknown format " + mode)
+        if settings.get("I", 1) <= 0:
+            raise ValueError("flush interval must be positive")
+    except ValueError as e:
+        logger("E:Invalid pressure telemetry settings " + data + ": " + str(e))
+        return
+
+    app.pressure_framer = framer
+    if "I" in settings:
+        app.pressure_update_interval_ms = settings["I"]
+    if framer is None:
+        logger("I:Pressure telemetry as P: lines every " + str(app.pressure_update_interval_ms) + " ms.")
+    else:
+        logger("I:Pressure telemetry as " + framer.format + " frames of up to " + str(framer.batch_size) +
+               " samples, decimation " + str(framer.decimation) + ", every " +
+               str(app.pressure_update_interval_ms) + " ms.")
+
+
+def update_pressure_control(data: str):
+    """
+    Configure closed-loop pressure control.
+
+    Parameters:
+        data (str): "ON" or "OFF",
+            "T=<mmHg>,<mmHg>,..." for the target curve, spread over one trajectory cycle,
+            or comma separated "P=<kp>,I=<ki>,D=<kd>,L=<most the stroke may change, e.g. 0.5>".
+    """
+    control = app.pressure_control
+    command = data.upper()
+    try:
+        if command == "ON":
+            tick_ms = playback_tick_ms()
+            min_rate_hz = control.min_sample_rate_hz(tick_ms)
+            if app.sampler.rate_hz < min_rate_hz:
+                logger("E:Pressure sampled at %g Hz is too slow for %g ms ticks; "
+                       "set the sample rate to at least %g Hz first." % (app.sampler.rate_hz, tick_ms, min_rate_hz))
+                return
+            control.set_timing(tick_ms, app.sampler.period_s * 1000.0)
+            control.start()
+            logger("I:Closed-loop pressure control enabled.")
+        elif command == "OFF":
+            control.stop()
+            logger("I:Closed-loop pressure control disabled.")
+        elif command.startswith("T="):
+            control.target = TargetCurve(data[2:].split(","))
+            logger("I:Pressure target set to " + str(len(control.target.points)) + " points.")
+        else:
+            controller = control.controller
+            for field in data.split(","):
+                key, _, value = field.partition("=")
+                key = key.strip().upper()
+                if key == "P":
+                    controller.kp = float(value)
+                elif key == "I":
+                    controller.ki = float(value)
+                elif key == "D":
+                    controller.kd = float(value)
+                elif key == "L":
+                    controller.output_min, controller.output_max = -abs(float(value)), abs(float(value))
+                else:
+                    raise ValueError("unknown setting " + key)
+            logger("I:Pressure controller kp=%g,ki=%g,kd=%g,limit=%g." % (
+                controller.kp, controller.ki, controller.kd, controller.output_max))
+    except ValueError as e:
+        logger("E:Invalid pressure control setting " + data + ": " + str(e))
+
+
+def report_pressure_statistics(data: str):
+    """
+    Send rolling statistics of the pressure samples, one M: line per window.
+
+    Parameters:
+        data (str): Empty for every window, a window length in seconds for just that one,
+            or "W=<s>,<s>,..." to replace the windows.
+    """
+    try:
+        if data.upper().startswith("W="):
+            app.pressure_stats.set_windows(float(window_s) for window_s in data[2:].split(","))
+            logger("I:Pressure statistics windows set to " + data[2:] + " s.")
+            return
+        windows_s = None if len(data) == 0 else [float(data)]
+    except ValueError as e:
+        logger("E:Invalid pressure statistics request " + data + ": " + str(e))
+        return
+
+    snapshot = app.pressure_stats.snapshot(current_time_in_ms())
+    if windows_s is not None:
+        if windows_s[0] not in snapshot:
+            logger("E:No " + data + " s pressure statistics window.")
+            return
+        snapshot = {windows_s[0]: snapshot[windows_s[0]]}
+    for window_s, stats in snapshot.items():
+        logger("M:%gs:" % window_s + ",".join(key + "=" + str(value) for key, value in stats.items()))
+
+
+def pressure_telemetry_statistics() -> dict:
+    if app.pressure_framer is None:
+        return {"format": telemetry.FORMAT_LINES}
+    return app.pressure_framer.snapshot()
+
+
+def update_udp_telemetry(data: str):
+    """
+    Add a UDP telemetry listener, or stop sending telemetry over UDP.
+
+    Parameters:
+        data (str): "<IPv4 address>:<port>" to add a listener, "F" to remove them all.
+    """
+    if data == "F":
+        app.comm.udp.clear()
+        logger("I:UDP telemetry stopped.")
+        return
+    host, _, port = data.rpartition(":")
+    try:
+        address = app.comm.udp.add_destination(host, int(port))
+    except ValueError as e:
+        logger("E:Invalid UDP telemetry address " + data + ": " + str(e))
+        return
+    logger("I:Sending UDP telemetry to " + address[0] + ":" + str(address[1]) + ".")
+
+
+def upload_statistics() -> dict:
+    stats = dict(app.last_upload)
+    if app.upload is not None:
+        stats["receiving"] = len(app.upload)
+    if app.preparing is not None:
+        stats["compiling"] = len(app.preparing[1].samples)
+    if app.pending_trajectory is not None:
+        stats["staged"] = len(app.pending_trajectory.samples)
+        stats["swap_at"] = app.pending_swap_at
+    return stats
+
+
+def resident_memory_kb():
+    """The app's resident set size, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def playback_statistics() -> dict:
+    stats = {
+        "source": "file" if isinstance(app.trajectory, MappedTrajectory) else "memory",
+        "samples": len(app.trajectory.samples),
+        "ticks": len(app.trajectory),
+        "index": app.positional_data_index,
+        "tick_ms": app.trajectory.tick_ms,
+        "recompiling": app.recompiling is not None,
+        "rss_kb": resident_memory_kb(),
+    }
+    if isinstance(app.trajectory, MappedTrajectory):
+        stats["path"] = app.trajectory.path
+    return stats
+
+
+def format_statistics(topic, stats: dict) -> str:
+    """Format a dict of statistics as a single Q: line."""
+    return "Q:" + topic + ":" + ",".join(key + "=" + str(value) for key, value in stats.items())
+
+
+def report_statistics(topic):
+    """
+    Send runtime statistics to the client.
+
+    Parameters:
+        topic (str): The statistics to report (e.g. "LOOP"), or empty for all of them.
+    """
+    providers = {
+        "LOOP": app.loop.stats.snapshot,
+        "SAMPLER": pressure_sampler_statistics,
+        "UPLOAD": upload_statistics,
+        "COMM": app.comm.statistics,
+        "TELEMETRY": pressure_telemetry_statistics,
+        "CONTROL": app.pressure_control.snapshot,
+        "LIBRARY": lambda: app.library.snapshot() if app.library is not None else {},
+        "PLAYBACK": playback_statistics,
+        "SCHEDULE": app.tick_schedule.snapshot,
+    }
+    topic = topic.upper()
+    if len(topic) == 0:
+        topics = list(providers.keys())
+    elif topic in providers:
+        topics = [topic]
+    else:
+        logger("E:Unknown statistics topic: " + topic)
+        return
+
+    for name in topics:
+        logger(format_statistics(name, providers[name]()))
 
 
 def current_time_in_ms() -> float:
-    """Get the current time in milliseconds."""
-    return (time.time() * 1000) - app.app_start_time_ms
+    """Get the time in milliseconds since the app started, from the monotonic clock."""
+    return (clock.monotonic_ns() - app.app_start_time_ns) / 1000000.0
 
 
 def update_target_position():
     """Update the target position of the stepper motor.
-    This will update the target position based on the current index of the positional data."""
+    This will update the target position based on the current index of the positional data,
+    once its tick is due on app.tick_schedule."""
 
     # Get the current time in milliseconds.
     current_time_ms = current_time_in_ms()
 
     # If we have positional data to process...
-    if len(app.positional_data) > 0:
-        # If we have waited long enough, update the target position.
-        if (current_time_ms - app.last_update) > app.data_time_step_ms:
-            # Update the target position.
-            raw_target_position = app.positional_data[app.positional_data_index] - app.home_offset
-            app.stepper_target_position = round(raw_target_position * app.scale_multiplier)
-
-            # Calculate the velocity.
-            speed = abs((app.stepper_target_position - app.stepper.current_position) / (app.data_time_step_ms / 1000))
+    if len(app.trajectory) > 0:
+        schedule = app.tick_schedule
+        if not schedule.running:
+            # The first tick is due straight away.
+            schedule.start(current_time_ms, app.trajectory.tick_ms)
+            app.pressure_control.set_timing(app.trajectory.tick_ms, app.sampler.period_s * 1000.0)
+        elif schedule.period_ms != app.trajectory.tick_ms:
+            schedule.set_period(app.trajectory.tick_ms)
+            app.pressure_control.set_timing(app.trajectory.tick_ms, app.sampler.period_s * 1000.0)
+
+        # If the next tick is due, update the target position.
+        ticks = schedule.advance(current_time_ms)
+        if ticks > 0:
+            # Overrun with the skip policy: move on to the tick that is due now.
+            for _ in range(ticks - 1):
+                if swap_due():
+                    swap_pending_trajectory()
+                next_positional_data_index(current_time_ms)
+
+            # Swap in a staged trajectory between ticks.
+            if swap_due():
+                swap_pending_trajectory()
+
+            # Look up the target position and velocity, precompiled by compile_trajectory()
+            # or, playing from a file, computed as they are reached.
+            app.stepper_target_position, speed = app.trajectory.tick(app.positional_data_index)
+
+            # In closed loop, scale the stroke by the controller's gain using the newest pressure sample.
+            if app.pressure_control.enabled:
+                gain = app.pressure_control.step(
+                    current_time_in_ms(),
+                    app.positional_data_index / len(app.trajectory),
+                    app.stepper_target_position / max(app.trajectory.peak_steps, 1),
+                    app.sampler.ring.latest())
+                app.stepper_target_position = round(app.stepper_target_position * gain)
+                speed *= gain
 
             if speed > 1:
                 # Update the stepper motor target position.
@@ -424,16 +1336,23 @@ def update_target_position():
                 logger("I:" + str(current_time_ms) + "," +
                        str(app.stepper.current_position) + "," +
                        str(app.stepper_target_position) + "," +
-                       str(app.positional_data[app.positional_data_index] * app.scale_multiplier))
+                       str(app.positional_data[app.positional_data_index // app.trajectory.subdivisions] *
+                           app.scale_multiplier))
+
+            next_positional_data_index(current_time_ms)
+    else:
+        # Start a fresh schedule once there is something to play.
+        app.tick_schedule.stop()
 
-            # Increment the index.
-            app.positional_data_index += 1
-            # If we have reached the end of the data, stop the motors.
-            if app.positional_data_index >= len(app.positional_data):
-                app.positional_data_index = 0
-                print("I:" + str(current_time_ms) + " Iteration complete. =--=-=-=-=-=-=-=-=-=-=--=")
 
-            app.last_update = current_time_ms
+def next_positional_data_index(current_time_ms):
+    """Move on to the next tick of the trajectory."""
+    # Increment the index.
+    app.positional_data_index += 1
+    # If we have reached the end of the data, start over.
+    if app.positional_data_index >= len(app.trajectory):
+        app.positional_data_index = 0
+        print("I:" + str(current_time_ms) + " Iteration complete. =--=-=-=-=-=-=-=-=-=-=--=")
 
 
 def update_stepper_movement():
@@ -474,15 +1393,50 @@ def update_priming_position():
     #             app.stepper.step(False)
 
 
-def main_loop_cycle():
-    """Main loop cycle."""
+def next_deadline_ms():
+    """
+    Work out when the main loop next has something to do.
+    Returns the deadline in ms on the current_time_in_ms() time base, or None if
+    only socket activity can create new work.
+    """
+    # Queued commands should be handled straight away.
+    if len(app.comm.read_queue) > 0:
+        return current_time_in_ms()
+
+    deadlines = []
+    if app.send_pressure_sensor_update:
+        deadlines.append(app.last_pressure_sensor_flush + app.pressure_update_interval_ms)
+    if app.runMotors and len(app.trajectory) > 0:
+        if app.tick_schedule.running:
+            deadlines.append(app.tick_schedule.next_due_ms())
+        else:
+            deadlines.append(current_time_in_ms())
 
-    # Process any incoming/outgoing data.
-    app.comm.process_streams()
+    if len(deadlines) == 0:
+        return None
+    return min(deadlines)
 
-    # If we have data in the queue, process it.
-    if len(app.comm.read_queue) > 0:
-        process_input(app.comm.read_queue.pop(0))
+
+def main_loop_cycle():
+    """Main loop cycle.
+    Sleeps until the client sends/accepts data or the next deadline is due, then does any pending work."""
+
+    # Process any incoming/outgoing data, sleeping until there is something to do.
+    app.loop.wait_until(next_deadline_ms())
+
+    # Process everything that has been received, so a burst of commands doesn't lag behind.
+    while len(app.comm.read_queue) > 0:
+        if app.upload is not None:
+            receive_upload()
+            if app.upload is not None:
+                # The upload's share of this pass is used up; the rest waits for the next one.
+                break
+        else:
+            dispatch(*app.comm.read_queue.popleft())
+    if app.preparing is not None and app.preparing[0].done():
+        finish_preparing()
+    if app.recompiling is not None and app.recompiling[0].done():
+        finish_recompiling()
 
     show_pressure_sensor_update()
 
@@ -495,22 +1449,40 @@ def main_loop_cycle():
         update_priming_position()
 
 
-def get_pressure_sensor_data():
-    while True:
-        # If we have waited long enough, update the pressure sensor queue.
-        if (current_time_in_ms() - app.last_pressure_sensor_update) > 0.1:
-            app.last_pressure_sensor_update = current_time_in_ms()
+def read_pressure_sensor() -> float:
+    """Read the pressure sensor. Called from the sampler thread."""
+    # Read the pressure from the sensor.
+    pressure_h_pa = app.mpr.pressure
 
-            # Read the pressure from the sensor.
-            pressure_h_pa = app.mpr.pressure
+    # Convert the pressure to mmHg.
+    return pressure_h_pa * 0.7500615613
 
-            # Convert the pressure to mmHg.
-            pressure_mm_hg = pressure_h_pa * 0.7500615613
 
-            try:
-                app.pressure_sensor_update_queue.put_nowait(pressure_mm_hg)
-            except queue.Full:
-                pass
+def update_pressure_sample_rate(rate_hz: float):
+    """
+    Update the pressure sensor sample rate.
+
+    Parameters:
+        rate_hz (float): Samples per second.
+    """
+    if rate_hz <= 0:
+        logger("E:Invalid pressure sample rate: " + str(rate_hz))
+        return
+    control = app.pressure_control
+    if control.enabled and rate_hz < control.min_sample_rate_hz(control.tick_ms):
+        logger("E:Pressure control needs at least %g Hz at %g ms ticks." % (
+            control.min_sample_rate_hz(control.tick_ms), control.tick_ms))
+        return
+    app.pressure_sample_rate_hz = rate_hz
+    app.sampler.set_rate(rate_hz)
+    control.set_timing(control.tick_ms, app.sampler.period_s * 1000.0)
+    logger("I:Pressure sample rate updated to " + str(rate_hz) + " Hz.")
+
+
+def pressure_sampler_statistics() -> dict:
+    stats = app.sampler.snapshot()
+    stats["dropped"] = app.pressure_reader.dropped
+    return stats
 
 
 def show_pressure_sensor_update():
@@ -520,25 +1492,100 @@ def show_pressure_sensor_update():
     if app.send_pressure_sensor_update is False:
         return
 
-    try:
-        pressure_mm_hg = app.pressure_sensor_update_queue.get_nowait()
-        # Print the pressure to the serial port.
-        logger("P:" + str(pressure_mm_hg))
-    except queue.Empty:
-        pass
+    # Only flush once per update interval.
+    current_time_ms = current_time_in_ms()
+    if (current_time_ms - app.last_pressure_sensor_flush) < app.pressure_update_interval_ms:
+        return
+    app.last_pressure_sensor_flush = current_time_ms
+
+    # Send everything sampled since the last flush.
+    timestamps, values = app.pressure_reader.read()
+    if app.pressure_framer is None:
+        for pressure_mm_hg in values:
+            # Print the pressure to the serial port.
+            logger("P:" + str(pressure_mm_hg))
+        return
 
+    # Batched into frames: no print() and one queued message per frame rather than per sample.
+    first_sample = app.pressure_reader.cursor - len(values)
+    for frame in app.pressure_framer.encode(first_sample, timestamps, values):
+        app.comm.send_data(frame, outbound.PRIORITY_TELEMETRY)
+    if app.debugging:
+        print("[Telemetry]: " + str(len(values)) + " samples")
 
-t1 = threading.Thread(target=get_pressure_sensor_data, name='t1')
-t1.start()
 
-while True:
-    # Wait for a connection
+# The commands clients can send, by letter: (handler, argument type).  The handler is called
+# with the argument converted to int, float or str, or with none if the type is None.
+COMMANDS = {
+    # Enable/disable (D)ebugging.
+    'D': (set_debugging, str),
+    # Update the step (F)requency - this is the ms between steps.
+    'F': (update_step_frequency, int),
+    # Set new (H)ome position.
+    'H': (set_new_home_position, None),
+    # (L)oad data
+    'L': (load_positional_data, str),
+    # Trajectory library, by (K)ey.
+    'K': (update_trajectory_library, str),
+    # (P)rime pump
+    'P': (start_priming, int),
+    # (R)un application.
+    'R': (start_application, None),
+    # (S)top application.
+    'S': (stop_application, None),
+    # Update (V)elocity.
+    'V': (update_velocity, str),
+    # I(N)terpolation between data points.
+    'N': (update_interpolation, str),
+    # Update scale (X) multiplier for positional data
+    'X': (update_scale_multiplier, float),
+    # Suspend/resume pressure updates, or set the sample (R)ate.
+    'Z': (update_pressure_updates, str),
+    # Pressure (T)elemetry frames.
+    'T': (update_pressure_telemetry, str),
+    # Closed-loop pressure (C)ontrol.
+    'C': (update_pressure_control, str),
+    # Rolling pressure statistics (M)easurements.
+    'M': (report_pressure_statistics, str),
+    # (U)DP telemetry listeners.
+    'U': (update_udp_telemetry, str),
+    # Tick (O)verrun policy.
+    'O': (update_overrun_policy, str),
+    # (Q)uery runtime statistics.
+    'Q': (report_statistics, str),
+    '!': (shutdown, None),
+    # (E)rror.
+    'E': (report_client_error, str),
+}
+
+
+def main():
+    print("Hardware backend: " + hardware_backend)
+    try:
+        app.library = TrajectoryLibrary()
+        print("Trajectory library: " + app.library.directory)
+    except OSError as e:
+        print("Trajectory library unavailable: " + str(e))
+    app.loop = EventLoop(current_time_in_ms)
+    app.upload_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+
+    app.pressure_stats = RollingStats()
+    app.sampler = PressureSampler(
+        read_pressure_sensor,
+        clock=current_time_in_ms,
+        rate_hz=app.pressure_sample_rate_hz,
+        rolling_stats=app.pressure_stats)
+    app.pressure_reader = app.sampler.ring.reader()
+    app.sampler.start()
+
+    # Clients connect and disconnect in the background, the loop runs regardless.
     app.comm = Communications()
+    try:
+        while True:
+            main_loop_cycle()
+    finally:
+        app.comm.close()
 
-    # If we lose connection, drop out of the loop.
-    while app.comm.connection is not None:
-        main_loop_cycle()
 
-    # Close the connection
-    app.comm.socket.close()
-    print("Connection closed")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Playback straight from a memory-mapped sample file.
+
+A Trajectory holds its samples and every compiled tick in memory, which is
+fine for a few minutes of data but not for an hour-long recording sampled
+at 1 kHz on a small Pi.  A MappedTrajectory plays the same kind of data from
+a file instead: the samples are memory-mapped and each tick's target and
+speed are computed as playback reaches it, so nothing proportional to the
+length of the trajectory is ever held in memory.
+
+Playback reads the file front to back, so the mapping asks the kernel to
+read the next window ahead of time and drops the window it just left from
+the process's page tables (the pages stay in the page cache), which keeps
+the resident set flat however long the trajectory is.
+
+Files are written by MappedTrajectoryWriter, a sample at a time or in
+chunks, without holding the samples in memory either:
+
+    magic        4s   b"PPTM"
+    version      B    MAPPED_VERSION
+    reserved     3x
+    count        Q    number of samples
+    minimum      d    smallest sample
+    maximum      d    largest sample
+    samples      count x d
+
+all little-endian.  The 32 byte header keeps the samples 8 byte aligned.
+
+Step, linear and monotone playback only need the samples either side of the
+tick, so they work from the file.  The periodic cubic spline needs the whole
+trajectory at once, so it isn't available here.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from trajectory import INTERPOLATION_STEP, INTERPOLATION_LINEAR, INTERPOLATION_MONOTONE, MAX_SUBDIVISIONS
+
+MAPPED_MAGIC = b"PPTM"
+MAPPED_VERSION = 1
+HEADER = struct.Struct("<4sB3xQdd")
+FILE_SUFFIX = ".ptm"
+
+READ_AHEAD_BYTES = 16 * mmap.ALLOCATIONGRANULARITY
+"""How much of the file is read ahead of playback, and dropped behind it, at a time."""
+WRITE_CHUNK_SAMPLES = 8192
+
+INTERPOLATION_MODES = (INTERPOLATION_STEP, INTERPOLATION_LINEAR, INTERPOLATION_MONOTONE)
+
+
+class MappedTrajectoryWriter:
+    """
+    Writes a sample file for MappedTrajectory, a chunk at a time.
+
+    Used as a context manager, the file only appears under its name once it
+    is complete; if the block raises, the partial file is removed:
+
+        with MappedTrajectoryWriter(path) as writer:
+            for sample in samples:
+                writer.append(sample)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self._digest = hashlib.sha256()
+        self._chunk = array('d')
+        self._temporary = path + ".tmp"
+        self._stream = open(self._temporary, "wb")
+        # Filled in by close().
+        self._stream.write(bytes(HEADER.size))
+
+    def __len__(self):
+        """Samples written so far."""
+        return self.count + len(self._chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def append(self, sample: float):
+        self._chunk.append(sample)
+        if len(self._chunk) >= WRITE_CHUNK_SAMPLES:
+            self._flush()
+
+    def extend(self, samples):
+        self._chunk.extend(samples)
+        if len(self._chunk) >= WRITE_CHUNK_SAMPLES:
+            self._flush()
+
+    def _flush(self):
+        chunk = self._chunk
+        if len(chunk) == 0:
+            return
+        self.count += len(chunk)
+        self.minimum = min(self.minimum, min(chunk))
+        self.maximum = max(self.maximum, max(chunk))
+        if sys.byteorder == 'big':
+            chunk.byteswap()
+        data = chunk.tobytes()
+        self._digest.update(data)
+        self._stream.write(data)
+        self._chunk = array('d')
+
+    def digest(self) -> str:
+        """Hex SHA-256 of the samples written so far, the same digest trajectory_library uses."""
+        return self._digest.hexdigest()
+
+    def close(self):
+        """Finish the file and move it into place."""
+        self._flush()
+        minimum, maximum = (self.minimum, self.maximum) if self.count else (0.0, 0.0)
+        self._stream.seek(0)
+        self._stream.write(HEADER.pack(MAPPED_MAGIC, MAPPED_VERSION, self.count, minimum, maximum))
+        self._stream.close()
+        os.replace(self._temporary, self.path)
+
+    def discard(self):
+        self._stream.close()
+        try:
+            os.remove(self._temporary)
+        except FileNotFoundError:
+            pass
+
+
+def write_file(path, samples) -> str:
+    """Write samples to a MappedTrajectory file.  Returns their digest."""
+    with MappedTrajectoryWriter(path) as writer:
+        writer.extend(samples)
+    return writer.digest()
+
+
+class MappedTrajectory:
+    """
+    A trajectory played from a memory-mapped sample file.
+
+    Has the playback interface of trajectory.Trajectory (compile(), tick(),
+    len(), samples, peak_steps, subdivisions, tick_ms, compiled_with) but
+    computes ticks on demand instead of compiling them all up front.
+    """
+
+    interpolation_modes = INTERPOLATION_MODES
+    """The interpolation modes compile() accepts."""
+
+    def __init__(self, path):
+        """
+        Map the sample file at path.
+        Raises OSError if it can't be opened and ValueError if it isn't a sample file.
+        """
+        if sys.byteorder == 'big':
+            raise ValueError("Mapped trajectories need a little-endian host")
+        self.path = path
+        with open(path, "rb") as stream:
+            self._map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, self.minimum, self.maximum = HEADER.unpack_from(self._map)
+            if magic != MAPPED_MAGIC or version != MAPPED_VERSION:
+                raise ValueError("Not a version %d mapped trajectory file" % MAPPED_VERSION)
+            if len(self._map) != HEADER.size + 8 * count:
+                raise ValueError("Expected %d samples, the file is %d bytes" % (count, len(self._map)))
+        except (ValueError, struct.error):
+            self._map.close()
+            raise
+        self.samples = memoryview(self._map)[HEADER.size:].cast('d')
+        """The positional data, straight from the file."""
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.peak_steps = 0
+        self.subdivisions = 1
+        self.tick_ms = 0.0
+        self.compiled_with = None
+        self._ticks = 0
+        self._home_offset = 0.0
+        self._scale_multiplier = 1.0
+        self._interpolation = INTERPOLATION_STEP
+        self._basis = ()
+        # The last tick computed, so sequential playback computes each target once.
+        self._last_index = None
+        self._last_target = 0
+        # The read-ahead window playback is in.
+        self._window = None
+
+    def __len__(self):
+        return self._ticks
+
+    def close(self):
+        """Unmap the file.  The trajectory can't be played afterwards."""
+        self._ticks = 0
+        self.samples.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Someone still has a view of the samples; the mapping goes when they let go of it.
+            pass
+
+    def compile(self, home_offset: float, scale_multiplier: float, time_step_ms: float,
+                interpolation=INTERPOLATION_STEP, subdivisions=1):
+        """Set up playback, as Trajectory.compile().  Takes no time, ticks are computed as they are played."""
+        if interpolation not in INTERPOLATION_MODES:
+            raise ValueError("Interpolation " + str(interpolation) + " isn't available for mapped trajectories")
+        if not 1 <= subdivisions <= MAX_SUBDIVISIONS:
+            raise ValueError("Subdivisions must be 1-" + str(MAX_SUBDIVISIONS))
+        count = len(self.samples)
+        if interpolation == INTERPOLATION_STEP or count < 2:
+            subdivisions = 1
+        self._home_offset = home_offset
+        self._scale_multiplier = scale_multiplier
+        if subdivisions == 1:
+            self._interpolation = INTERPOLATION_STEP
+        elif interpolation == INTERPOLATION_MONOTONE and count < 3:
+            self._interpolation = INTERPOLATION_LINEAR
+        else:
+            self._interpolation = interpolation
+        self.subdivisions = subdivisions
+        self.tick_ms = time_step_ms / subdivisions
+        self._ticks = count * subdivisions
+        # Hermite basis for each sub-tick, as trajectory.interpolate() uses.
+        basis = []
+        for k in range(subdivisions):
+            t = k / subdivisions
+            t2 = t * t
+            t3 = t2 * t
+            basis.append((2.0 * t3 - 3.0 * t2 + 1.0, t3 - 2.0 * t2 + t, 3.0 * t2 - 2.0 * t3, t3 - t2))
+        self._basis = basis
+        # Linear and monotone playback never go past the samples, so neither do the targets.
+        if count:
+            self.peak_steps = max(abs(round((self.maximum - home_offset) * scale_multiplier)),
+                                  abs(round((self.minimum - home_offset) * scale_multiplier)))
+        else:
+            self.peak_steps = 0
+        self._last_index = None
+        self.compiled_with = (home_offset, scale_multiplier, time_step_ms, interpolation, subdivisions)
+
+    def _slope(self, index):
+        """Monotone slope at sample index, as trajectory._slopes() computes it."""
+        samples = self.samples
+        count = len(samples)
+        before = samples[index] - samples[index - 1]
+        after = samples[(index + 1) % count] - samples[index]
+        return 2.0 * before * after / (before + after) if before * after > 0 else 0.0
+
+    def _target(self, index):
+        samples = self.samples
+        subdivisions = self.subdivisions
+        sample_index, k = divmod(index, subdivisions)
+        self._read_ahead(sample_index)
+        y0 = samples[sample_index]
+        if self._interpolation == INTERPOLATION_STEP:
+            value = y0
+        else:
+            y1 = samples[(sample_index + 1) % len(samples)]
+            if self._interpolation == INTERPOLATION_LINEAR:
+                value = y0 + (y1 - y0) / subdivisions * k
+            else:
+                h00, h10, h01, h11 = self._basis[k]
+                value = (h00 * y0 + h10 * self._slope(sample_index)
+                         + h01 * y1 + h11 * self._slope((sample_index + 1) % len(samples)))
+        return round((value - self._home_offset) * self._scale_multiplier)
+
+    def _read_ahead(self, sample_index):
+        """Keep the window after sample_index coming in and let go of the one playback left."""
+        window = (HEADER.size + 8 * sample_index) // READ_AHEAD_BYTES
+        if window == self._window:
+            return
+        size = len(self._map)
+        if self._window is not None and hasattr(mmap, "MADV_DONTNEED"):
+            if window == self._window + 1:
+                # Interpolation still reads the sample before this window, so let go of the one before that.
+                if window >= 2:
+                    self._map.madvise(mmap.MADV_DONTNEED, (window - 2) * READ_AHEAD_BYTES, READ_AHEAD_BYTES)
+            else:
+                # Wrapped around or jumped: nothing mapped so far is needed.
+                self._map.madvise(mmap.MADV_DONTNEED, 0, size)
+        self._window = window
+        if hasattr(mmap, "MADV_WILLNEED"):
+            # Playback wraps around to the start.
+            start = (window + 1) * READ_AHEAD_BYTES
+            if start >= size:
+                start = 0
+            self._map.madvise(mmap.MADV_WILLNEED, start, min(READ_AHEAD_BYTES, size - start))
+
+    def tick(self, index):
+        """The target step position and speed of tick index, computed from the file."""
+        previous = (index - 1) % self._ticks
+        if self._last_index != previous:
+            # Playback loops, so the first tick starts from the last target.
+            self._last_target = self._target(previous)
+        target = self._target(index)
+        speed = abs(target - self._last_target) / (self.tick_ms / 1000)
+        self._last_index = index
+        self._last_target = target
+        return target, speed
+
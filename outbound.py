@@ -0,0 +1,144 @@
+"""
+Prioritized, non-blocking outbound queue.
+
+Messages are queued per priority (control replies, then errors, then
+telemetry) and written to a non-blocking socket in coalesced sendmsg() batches.
+Short writes are remembered and finished before anything else goes out, and
+when a slow client can't keep up the oldest telemetry is dropped instead of
+blocking the control loop.  Control replies and errors are never dropped: the
+client's protocol depends on them, so once either queue is full push() refuses
+the message and the client should be disconnected instead.
+"""
+from collections import deque
+
+PRIORITY_CONTROL = 0
+PRIORITY_ERROR = 1
+PRIORITY_TELEMETRY = 2
+
+PRIORITY_NAMES = ("control", "error", "telemetry")
+
+
+def classify(message: str) -> int:
+    """Pick a priority for a protocol line from its prefix."""
+    if message.startswith("P:") or message.startswith("T:"):
+        return PRIORITY_TELEMETRY
+    if message.startswith("E:"):
+        return PRIORITY_ERROR
+    return PRIORITY_CONTROL
+
+
+class OutboundQueue:
+    """Outbound messages waiting to be written to one connection."""
+
+    def __init__(self, control_limit=4096, error_limit=4096, telemetry_limit=256,
+                 max_batch_messages=64, max_batch_bytes=65536):
+        """
+        Arguments:
+          control_limit, error_limit, telemetry_limit (int): Messages held per
+            priority.  Past telemetry_limit the oldest telemetry is dropped, past
+            the others push() refuses the message.
+          max_batch_messages (int): Most messages handed to a single sendmsg().
+          max_batch_bytes (int): Stop adding messages to a batch past this size.
+        """
+        self._queues = (deque(), deque(), deque())
+        self._limits = (control_limit, error_limit, telemetry_limit)
+        self._max_batch_messages = max_batch_messages
+        self._max_batch_bytes = max_batch_bytes
+        # Unsent tail of a message that was only partially written.
+        self._partial = None
+
+        self.dropped = [0, 0, 0]
+        """Messages dropped per priority because the queue was full (only ever telemetry)."""
+        self.overflowed = False
+        """Whether a control reply or error has been refused because its queue was full."""
+        self.sends = 0
+        """Number of send calls made."""
+        self.short_sends = 0
+        """Send calls that didn't write the whole batch."""
+        self.bytes_sent = 0
+
+    def __len__(self):
+        return len(self._queues[0]) + len(self._queues[1]) + len(self._queues[2]) + (self._partial is not None)
+
+    def push(self, data: bytes, priority=PRIORITY_CONTROL) -> bool:
+        """
+        Queue data to be sent.  Returns False, without queuing it, if it's a control reply or
+        an error and that queue is full: the connection can't be relied on any more.
+        """
+        queue = self._queues[priority]
+        if len(queue) >= self._limits[priority]:
+            if priority != PRIORITY_TELEMETRY:
+                self.overflowed = True
+                return False
+            # Drop the oldest; for telemetry the newest reading is the useful one.
+            queue.popleft()
+            self.dropped[priority] += 1
+        queue.append(data)
+        return True
+
+    def clear(self):
+        for queue in self._queues:
+            queue.clear()
+        self._partial = None
+
+    def _next_batch(self):
+        """Collect (queue, buffer) pairs to send, highest priority first."""
+        batch = []
+        size = 0
+        if self._partial is not None:
+            batch.append((None, self._partial))
+            size += len(self._partial)
+        for queue in self._queues:
+            for data in queue:
+                if len(batch) >= self._max_batch_messages or size >= self._max_batch_bytes:
+                    return batch
+                batch.append((queue, data))
+                size += len(data)
+        return batch
+
+    def flush(self, connection) -> bool:
+        """
+        Write as much as the socket will take without blocking.
+        Returns True once everything queued has been sent.
+        """
+        while len(self) > 0:
+            batch = self._next_batch()
+            buffers = [data for queue, data in batch]
+            try:
+                if hasattr(connection, 'sendmsg'):
+                    sent = connection.sendmsg(buffers)
+                else:
+                    sent = connection.send(b"".join(buffers))
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.sends += 1
+            self.bytes_sent += sent
+
+            # Retire everything that went out completely.
+            for queue, data in batch:
+                if sent >= len(data):
+                    sent -= len(data)
+                    if queue is None:
+                        self._partial = None
+                    else:
+                        queue.popleft()
+                    continue
+                # Socket buffer is full part way through this message.
+                self.short_sends += 1
+                if queue is None:
+                    self._partial = data[sent:]
+                else:
+                    queue.popleft()
+                    self._partial = memoryview(data)[sent:]
+                return False
+        return True
+
+    def snapshot(self) -> dict:
+        stats = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[name + "_queued"] = len(self._queues[priority])
+            stats[name + "_dropped"] = self.dropped[priority]
+        stats["sends"] = self.sends
+        stats["short_sends"] = self.short_sends
+        stats["bytes_sent"] = self.bytes_sent
+        return stats
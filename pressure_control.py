@@ -0,0 +1,209 @@
+"""
+Closed-loop pressure control.
+
+In open loop the trajectory is replayed as uploaded.  In closed loop, every
+trajectory tick compares the newest pressure sample with the target pressure
+curve and a PID controller scales the stroke (the targets relative to home
+and their speeds) to close the gap: a gain of 1.0 plays the trajectory as
+is, 1.2 moves 20% further.
+
+How much the gain moves the pressure depends on where in the stroke the
+tick is: near home it hardly matters, and on the far side of home a bigger
+stroke lowers the pressure instead of raising it.  So the controller is fed
+the error weighted by the tick's position relative to the furthest point of
+the stroke (-1 to 1).  With positive gains, pressure below the target on
+the positive side of home raises the gain; use negative gains if the pump is
+plumbed the other way round.
+
+The control step runs in the main loop right before the stepper is moved,
+on the sample the sampler thread last stored.  So the sensor-to-actuation
+latency is the age of that sample plus the few microseconds of the step
+itself; both are recorded along with the tracking error.
+"""
+import math
+
+from RaspberryPiStepperDriver import clock
+
+
+class PIDController:
+    """
+    PID with a low-pass filter on the derivative and an integral that stops
+    growing while the output is saturated.
+    """
+
+    def __init__(self, kp=0.0, ki=0.0, kd=0.0, output_min=-0.5, output_max=0.5, derivative_smoothing=0.5):
+        """
+        Arguments:
+          kp, ki, kd (float): Gains, per mmHg of error (ki per mmHg.s, kd per mmHg/s).
+          output_min, output_max (float): Limits of the output.
+          derivative_smoothing (float): 0 for a raw derivative, towards 1 for a smoother one.
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_min = output_min
+        self.output_max = output_max
+        self.derivative_smoothing = derivative_smoothing
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.output = 0.0
+        self._last_error = None
+
+    def update(self, error, dt_s):
+        """Advance the controller by dt_s and return the new output."""
+        if dt_s <= 0:
+            return self.output
+        if self._last_error is not None:
+            raw = (error - self._last_error) / dt_s
+            self.derivative = self.derivative_smoothing * self.derivative + (1.0 - self.derivative_smoothing) * raw
+        self._last_error = error
+
+        integral = self.integral + error * dt_s
+        output = self.kp * error + self.ki * integral + self.kd * self.derivative
+        if output > self.output_max:
+            output = self.output_max
+        elif output < self.output_min:
+            output = self.output_min
+        else:
+            # Only integrate while that doesn't push the output further past its limits.
+            self.integral = integral
+        self.output = output
+        return output
+
+
+class TargetCurve:
+    """Target pressures spread evenly over one trajectory cycle, interpolated linearly between them."""
+
+    def __init__(self, points):
+        self.points = [float(point) for point in points]
+        if not self.points:
+            raise ValueError("A target curve needs at least one point")
+
+    def value_at(self, phase):
+        """Target at phase (0 <= phase < 1) of the cycle.  The curve wraps around."""
+        points = self.points
+        if len(points) == 1:
+            return points[0]
+        position = (phase % 1.0) * len(points)
+        index = int(position)
+        fraction = position - index
+        return points[index] + (points[(index + 1) % len(points)] - points[index]) * fraction
+
+
+class PressureControl:
+    """The controller, its target and the latency/tracking statistics of the loop."""
+
+    def __init__(self, controller=None, target=None, tick_ms=10.0, sample_period_ms=10.0):
+        """
+        Arguments:
+          controller (PIDController): The controller, a new one (all gains 0) if not given.
+          target (TargetCurve): The target pressure curve, 760 mmHg if not given.
+          tick_ms (float): Time between trajectory ticks.
+          sample_period_ms (float): Time between pressure samples.
+        """
+        self.controller = PIDController() if controller is None else controller
+        self.target = TargetCurve([760.0]) if target is None else target
+        self.set_timing(tick_ms, sample_period_ms)
+        self.enabled = False
+        self.gain = 1.0
+        """Stroke multiplier applied at the last tick."""
+        self.reset_statistics()
+
+    def set_timing(self, tick_ms, sample_period_ms):
+        """
+        Fit the staleness limit to the trajectory tick and the sample period.
+
+        A sample is fresh if it was taken since the previous tick, give or take
+        one sample period for the sampler's jitter.  Older samples are not acted
+        on; the gain is held.
+        """
+        self.tick_ms = tick_ms
+        self.sample_period_ms = sample_period_ms
+        self.stale_after_ms = tick_ms + sample_period_ms
+
+    @staticmethod
+    def min_sample_rate_hz(tick_ms) -> float:
+        """The slowest sample rate that has a fresh sample for every tick of tick_ms."""
+        return 1000.0 / tick_ms
+
+    def start(self):
+        self.controller.reset()
+        self.gain = 1.0
+        self.reset_statistics()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        self.gain = 1.0
+
+    def reset_statistics(self):
+        self._last_tick_ms = None
+        self.ticks = 0
+        self.stale = 0
+        """Ticks where no fresh sample was available, so the gain was held."""
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.compute_total_us = 0.0
+        self.compute_max_us = 0.0
+        self.error_total = 0.0
+        self.error_square_total = 0.0
+        self.error_max = 0.0
+        self.last_error = 0.0
+
+    def step(self, now_ms, phase, stroke, sample):
+        """
+        Run one control step for a trajectory tick.
+
+        Arguments:
+          now_ms (float): The current time, on the sampler's time base.
+          phase (float): How far through the trajectory cycle the tick is, 0 to 1.
+          stroke (float): The tick's target relative to home, as a fraction of the furthest target (-1 to 1).
+          sample (tuple): The newest (timestamp_ms, mmHg), or None.
+        Returns the gain to apply to the tick's target and speed.
+        """
+        started_ns = clock.monotonic_ns()
+        dt_s = 0.0 if self._last_tick_ms is None else (now_ms - self._last_tick_ms) / 1000.0
+        self._last_tick_ms = now_ms
+
+        if sample is None or now_ms - sample[0] > self.stale_after_ms:
+            self.stale += 1
+            return self.gain
+        sample_time_ms, pressure = sample
+        error = self.target.value_at(phase) - pressure
+        self.gain = 1.0 + self.controller.update(error * stroke, dt_s)
+
+        compute_us = (clock.monotonic_ns() - started_ns) / 1000.0
+        latency_ms = now_ms - sample_time_ms + compute_us / 1000.0
+        self.ticks += 1
+        self.latency_total_ms += latency_ms
+        if latency_ms > self.latency_max_ms:
+            self.latency_max_ms = latency_ms
+        self.compute_total_us += compute_us
+        if compute_us > self.compute_max_us:
+            self.compute_max_us = compute_us
+        self.last_error = error
+        self.error_total += error
+        self.error_square_total += error * error
+        if abs(error) > self.error_max:
+            self.error_max = abs(error)
+        return self.gain
+
+    def snapshot(self) -> dict:
+        ticks = self.ticks
+        return {
+            "enabled": self.enabled,
+            "gain": round(self.gain, 4),
+            "ticks": ticks,
+            "stale": self.stale,
+            "latency_mean_ms": round(self.latency_total_ms / ticks, 3) if ticks else 0.0,
+            "latency_max_ms": round(self.latency_max_ms, 3),
+            "compute_mean_us": round(self.compute_total_us / ticks, 1) if ticks else 0.0,
+            "compute_max_us": round(self.compute_max_us, 1),
+            "error_mmhg": round(self.last_error, 3),
+            "error_mean_mmhg": round(self.error_total / ticks, 3) if ticks else 0.0,
+            "error_rms_mmhg": round(math.sqrt(self.error_square_total / ticks), 3) if ticks else 0.0,
+            "error_max_mmhg": round(self.error_max, 3),
+        }
@@ -0,0 +1,218 @@
+"""
+Rate limited pressure sampling.
+
+A background thread reads the sensor at a fixed rate, sleeping between samples,
+and stores timestamped readings in a preallocated ring buffer.  Consumers keep
+their own read cursor and pull everything new in one go.
+"""
+import threading
+import time
+from array import array
+
+
+class SampleRing:
+    """
+    Fixed size ring buffer of (timestamp_ms, value) samples.
+
+    There is a single writer.  Readers never take a lock: the writer fills the
+    slot before publishing it by bumping `written`, and a reader that was lapped
+    by the writer while copying simply discards the overwritten samples and
+    counts them as dropped.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        """The number of samples the ring can hold."""
+        self.timestamps = array('d', bytes(8 * capacity))
+        """The sample timestamps in ms."""
+        self.values = array('d', bytes(8 * capacity))
+        """The sample values."""
+        self.written = 0
+        """The total number of samples ever written."""
+
+    def append(self, timestamp_ms: float, value: float):
+        slot = self.written % self.capacity
+        self.timestamps[slot] = timestamp_ms
+        self.values[slot] = value
+        # Publish the sample only once both halves are in place.
+        self.written += 1
+
+    def latest(self):
+        """Return the most recent (timestamp_ms, value), or None if nothing was sampled yet."""
+        written = self.written
+        if written == 0:
+            return None
+        slot = (written - 1) % self.capacity
+        return self.timestamps[slot], self.values[slot]
+
+    def reader(self, from_start=False):
+        """Create a reader that sees samples written from now on (or everything still held)."""
+        return RingReader(self, 0 if from_start else self.written)
+
+    def copy(self, start: int, end: int):
+        """
+        Copy samples with sequence numbers start..end-1 into new arrays.
+        Returns (first_sequence_number, timestamps, values); samples overwritten
+        during the copy are trimmed off the front.
+        """
+        capacity = self.capacity
+        first = start % capacity
+        last = first + (end - start)
+        if last <= capacity:
+            timestamps = self.timestamps[first:last]
+            values = self.values[first:last]
+        else:
+            timestamps = self.timestamps[first:] + self.timestamps[:last - capacity]
+            values = self.values[first:] + self.values[:last - capacity]
+
+        # Anything a lap or more behind the writer may have been overwritten mid-copy, including
+        # the slot it may be filling right now: the oldest sample still held until it publishes.
+        overwritten = (self.written - capacity + 1) - start
+        if overwritten > 0:
+            del timestamps[:overwritten]
+            del values[:overwritten]
+            start += overwritten
+        return start, timestamps, values
+
+
+class RingReader:
+    """A consumer cursor into a SampleRing."""
+
+    def __init__(self, ring: SampleRing, cursor: int):
+        self.ring = ring
+        self.cursor = cursor
+        """Sequence number of the next sample to read."""
+        self.dropped = 0
+        """Samples overwritten before this reader got to them."""
+
+    @property
+    def pending(self) -> int:
+        return self.ring.written - self.cursor
+
+    def skip_to_latest(self):
+        """Discard everything written so far without counting it as dropped."""
+        self.cursor = self.ring.written
+
+    def read(self, max_count=None):
+        """
+        Return (timestamps, values) arrays of every sample written since the last read.
+
+        Arguments:
+          max_count (int): Optionally limit the number of samples returned.  The
+            rest are left for the next call.
+        """
+        end = self.ring.written
+        start = self.cursor
+        oldest = end - self.ring.capacity
+        if start < oldest:
+            self.dropped += oldest - start
+            start = oldest
+        if max_count is not None and end - start > max_count:
+            end = start + max_count
+
+        first, timestamps, values = self.ring.copy(start, end)
+        self.dropped += first - start
+        self.cursor = end
+        return timestamps, values
+
+
+class PressureSampler:
+    """Samples a sensor at a fixed rate from a background thread."""
+
+    def __init__(self, read_sensor, clock, rate_hz=100.0, capacity=4096, on_sample=None, rolling_stats=None):
+        """
+        Arguments:
+          read_sensor (callable): Returns one reading.
+          clock (callable): Returns the current time in milliseconds, used to timestamp samples.
+          rate_hz (float): Samples per second.
+          capacity (int): Number of samples the ring buffer can hold.
+          on_sample (callable): Optional callback invoked after every sample.
+          rolling_stats (RollingStats): Optionally kept up to date with every sample.
+        """
+        self._read_sensor = read_sensor
+        self._clock = clock
+        self._on_sample = on_sample
+        self.rolling_stats = rolling_stats
+        self._stop = threading.Event()
+        self._thread = None
+        self.ring = SampleRing(capacity)
+        self.period_s = 1.0 / rate_hz
+        self.reset_statistics()
+
+    @property
+    def rate_hz(self) -> float:
+        return 1.0 / self.period_s
+
+    def set_rate(self, rate_hz: float):
+        """Change the sample rate. Takes effect from the next sample."""
+        if rate_hz <= 0:
+            raise ValueError("Sample rate must be positive")
+        self.period_s = 1.0 / rate_hz
+
+    def reset_statistics(self):
+        self._stats_started_at = time.monotonic()
+        self._stats_first_sample = self.ring.written
+        self.missed_deadlines = 0
+        """Samples that started more than one period late."""
+        self.errors = 0
+        """Sensor reads that raised."""
+        self.read_latency_total_ms = 0.0
+        self.read_latency_max_ms = 0.0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pressure-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        next_sample_at = time.monotonic()
+        while not self._stop.is_set():
+            read_started_at = time.monotonic()
+            try:
+                value = self._read_sensor()
+            except (OSError, RuntimeError, ValueError):
+                # A flaky I2C read shouldn't kill the sampler.
+                self.errors += 1
+                value = None
+            read_finished_at = time.monotonic()
+
+            if value is not None:
+                timestamp_ms = self._clock()
+                self.ring.append(timestamp_ms, value)
+                if self.rolling_stats is not None:
+                    self.rolling_stats.add(timestamp_ms, value)
+                latency_ms = (read_finished_at - read_started_at) * 1000.0
+                self.read_latency_total_ms += latency_ms
+                if latency_ms > self.read_latency_max_ms:
+                    self.read_latency_max_ms = latency_ms
+                if self._on_sample is not None:
+                    self._on_sample()
+
+            # Schedule against absolute deadlines so the rate doesn't drift,
+            # but don't try to catch up on samples we're already too late for.
+            next_sample_at += self.period_s
+            now = time.monotonic()
+            if now - next_sample_at > self.period_s:
+                self.missed_deadlines += 1
+                next_sample_at = now
+            self._stop.wait(max(next_sample_at - now, 0.0))
+
+    def snapshot(self) -> dict:
+        """Return sampler statistics as a dict of plain numbers."""
+        elapsed_s = max(time.monotonic() - self._stats_started_at, 1e-9)
+        samples = self.ring.written - self._stats_first_sample
+        return {
+            "rate_hz": round(self.rate_hz, 2),
+            "achieved_hz": round(samples / elapsed_s, 2),
+            "samples": samples,
+            "missed": self.missed_deadlines,
+            "errors": self.errors,
+            "read_latency_mean_ms": round(self.read_latency_total_ms / samples, 3) if samples else 0.0,
+            "read_latency_max_ms": round(self.read_latency_max_ms, 3),
+        }
@@ -0,0 +1,109 @@
+"""
+Protocol v2: numbered requests with explicit replies.
+
+The original protocol is a line per command, "<letter>:<argument>", and
+whatever the command has to say comes back as lines for every client,
+with nothing to tie them to the command that caused them.  So a client
+has to wait for the effect of one command before sending the next.
+
+A v2 request is a single line that carries an id of the client's choosing:
+
+    @<id> <letter>[ <argument>]
+
+e.g. "@17 F 10" or "@18 Q LOOP".  The letters are those of the original
+protocol, and each command's argument is checked against its type
+(integer, number or text) before it runs.  The reply goes to the
+requesting client only: every line the command sends, prefixed with its
+id, then exactly one final line:
+
+    @<id> OK
+    @<id> ERR <code> <message>
+
+so a client can send any number of requests without waiting and match up
+the replies afterwards.  Telemetry and anything else not sent in reply to
+a request stays as it is, and original protocol lines can still be mixed
+in.  An upload ("@5 L B") is acknowledged once the upload has started;
+its completion is reported with the usual D: line.
+
+Ids are up to MAX_ID_LENGTH letters, digits, '-' or '_'.
+"""
+import re
+
+REQUEST_PREFIX = "@"
+MAX_ID_LENGTH = 16
+
+ERROR_SYNTAX = "SYNTAX"
+"""The request line is malformed."""
+ERROR_COMMAND = "COMMAND"
+"""There is no such command."""
+ERROR_ARGUMENT = "ARGUMENT"
+"""The argument is missing, unexpected, or not of the command's type."""
+ERROR_FAILED = "FAILED"
+"""The command ran and reported an error."""
+ERROR_INTERNAL = "INTERNAL"
+"""The command raised an exception; the traceback is in the device's log."""
+
+_REQUEST = re.compile(r"@([A-Za-z0-9_-]{1,%d})(?: +(\S)(?: +(.*))?)?$" % MAX_ID_LENGTH)
+
+
+class ProtocolError(ValueError):
+    """A request that can't be carried out, with the error code to reply with."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class Request:
+    """A v2 request line, and the client that sent it."""
+
+    __slots__ = ("sender", "line")
+
+    def __init__(self, sender, line):
+        self.sender = sender
+        self.line = line
+
+    def parse(self):
+        """
+        Split the line into (id, command, argument), argument being "" if there is none.
+        Raises ProtocolError if it's malformed; the id is then the best guess, or "".
+        """
+        match = _REQUEST.match(self.line.strip())
+        if match is None or match.group(2) is None:
+            raise ProtocolError(ERROR_SYNTAX, "Expected @<id> <command>[ <argument>]")
+        return match.group(1), match.group(2), (match.group(3) or "").strip()
+
+    def best_id(self):
+        """The id to reply to when the line couldn't be parsed."""
+        token = self.line.strip()[1:].split(" ", 1)[0]
+        return token if re.fullmatch(r"[A-Za-z0-9_-]{1,%d}" % MAX_ID_LENGTH, token) else "?"
+
+
+def convert_argument(argument: str, argument_type):
+    """
+    Convert a command's argument to its type: None for commands that take none,
+    or int, float or str.  Raises ProtocolError if it doesn't fit.
+    """
+    if argument_type is None:
+        if argument:
+            raise ProtocolError(ERROR_ARGUMENT, "Takes no argument")
+        return None
+    if argument_type is str:
+        return argument
+    try:
+        return argument_type(argument)
+    except ValueError:
+        raise ProtocolError(ERROR_ARGUMENT, "Expected " + ("an integer" if argument_type is int else "a number") +
+                            ", got '" + argument + "'")
+
+
+def reply_line(request_id, line: str) -> str:
+    return REQUEST_PREFIX + request_id + " " + line + "\n"
+
+
+def ok(request_id) -> str:
+    return reply_line(request_id, "OK")
+
+
+def error(request_id, code, message) -> str:
+    return reply_line(request_id, "ERR " + code + " " + message)
@@ -0,0 +1,269 @@
+"""
+Compile a trajectory into a hardware-timed pulse schedule.
+
+Instead of issuing a move_to() every tick and relying on Python to time each
+step, the whole trajectory is turned into absolute per-step timestamps and
+directions, limited by the motor's maximum speed and acceleration.  The
+schedule is then cut into waveform segments (lists of pigpio style pulses)
+that can be chained on the hardware without Python touching each pulse.
+
+Emitters:
+  PigpioWaveEmitter  plays segments through pigpio waves.
+  MemoryWaveEmitter  keeps segments in memory so they can be inspected.
+  FileWaveEmitter    writes segments to a file for offline inspection.
+"""
+import math
+import struct
+import time
+from array import array
+
+DIRECTION_FORWARD = 1
+DIRECTION_REVERSE = -1
+
+# One pulse as stored by FileWaveEmitter: gpio_on mask, gpio_off mask, delay_us.
+PULSE = struct.Struct("<III")
+
+
+class PulseSchedule:
+    """Absolute step times and directions for one pass of a trajectory."""
+
+    def __init__(self, step_times_us, directions, duration_us, start_position=0):
+        self.step_times_us = step_times_us
+        """Time of each step's rising edge in us from the start of playback."""
+        self.directions = directions
+        """Direction of each step, DIRECTION_FORWARD or DIRECTION_REVERSE."""
+        self.duration_us = duration_us
+        """Length of the pass in us."""
+        self.start_position = start_position
+        """Stepper position at the start of the pass."""
+
+    def __len__(self):
+        return len(self.step_times_us)
+
+    @property
+    def end_position(self):
+        return self.start_position + sum(self.directions)
+
+
+class WaveSegment:
+    """A chunk of a schedule small enough to be created as a single hardware wave."""
+
+    def __init__(self, pulses, start_us, steps):
+        self.pulses = pulses
+        """List of (gpio_on_mask, gpio_off_mask, delay_us)."""
+        self.start_us = start_us
+        """Time of the segment's first pulse in us from the start of playback."""
+        self.steps = steps
+        """Number of steps in the segment."""
+
+    @property
+    def duration_us(self):
+        return sum(pulse[2] for pulse in self.pulses)
+
+
+def compile_schedule(target_steps, time_step_ms, max_speed, acceleration=None, start_position=0):
+    """
+    Turn per-tick target positions into per-step timestamps.
+
+    Each tick the commanded velocity is whatever reaches the tick's target by
+    the end of the tick, clamped by the acceleration and speed limits.  Steps
+    are spread evenly across the tick, but never closer together than
+    1 / max_speed, also across tick boundaries; steps that don't fit are
+    carried into the following ticks, as is any error from the limits.
+
+    Parameters:
+        target_steps (sequence): Target position for each tick, e.g. Trajectory.target_steps.
+        time_step_ms (float): Length of a tick.
+        max_speed (float): Steps per second.
+        acceleration (float): Steps per second per second, or None for unlimited.
+        start_position (int): Stepper position at the start of playback.
+    """
+    tick_us = time_step_ms * 1000.0
+    tick_s = time_step_ms / 1000.0
+    # Whole microseconds, so truncating step times can't bring two steps closer.
+    min_interval_us = math.ceil(1000000.0 / max_speed)
+    max_speed_change = acceleration * tick_s if acceleration else math.inf
+
+    step_times_us = array('q')
+    directions = array('b')
+    position = start_position
+    # Continuous position we are aiming for and the velocity we got there with.
+    exact_position = float(start_position)
+    velocity = 0.0
+    # Earliest time the next step may be taken.
+    next_step_us = 0.0
+
+    for tick, target in enumerate(target_steps):
+        wanted = (target - exact_position) / tick_s
+        velocity = max(velocity - max_speed_change, min(velocity + max_speed_change, wanted))
+        velocity = max(-max_speed, min(max_speed, velocity))
+        exact_position += velocity * tick_s
+
+        steps = round(exact_position) - position
+        if steps == 0:
+            continue
+        first_us = max(tick * tick_us, next_step_us)
+        room_us = (tick + 1) * tick_us - first_us
+        if room_us <= 0:
+            continue
+        count = min(abs(steps), math.ceil(room_us / min_interval_us))
+        direction = DIRECTION_FORWARD if steps > 0 else DIRECTION_REVERSE
+        interval_us = max(room_us / count, min_interval_us)
+        for step in range(count):
+            step_times_us.append(int(first_us + step * interval_us))
+            directions.append(direction)
+        next_step_us = first_us + (count - 1) * interval_us + min_interval_us
+        position += direction * count
+
+    return PulseSchedule(step_times_us, directions, int(len(target_steps) * tick_us), start_position)
+
+
+def schedule_to_segments(schedule, step_pin, dir_pin, pulse_us=10, dir_setup_us=10, max_pulses=2000):
+    """
+    Convert a schedule into chunks of pigpio style pulses.
+
+    Raises ValueError if two steps in the same direction are no further apart
+    than pulse_us, as the second would rise before the first has fallen.
+
+    Parameters:
+        schedule (PulseSchedule): The schedule to convert.
+        step_pin, dir_pin (int): BCM GPIO numbers.
+        pulse_us (int): Step pulse high time, shorter than the schedule's shortest step interval.
+        dir_setup_us (int): Time the direction pin must be stable before a step.
+        max_pulses (int): Maximum pulses per segment.
+    """
+    step_mask = 1 << step_pin
+    dir_mask = 1 << dir_pin
+
+    # (time_us, on_mask, off_mask) edges in time order, starting with an idle
+    # edge so the first segment begins at the start of playback.
+    edges = [(0, 0, 0)]
+    direction = None
+    previous_fall_us = 0
+    for time_us, step_direction in zip(schedule.step_times_us, schedule.directions):
+        if step_direction != direction:
+            direction = step_direction
+            change_us = max(previous_fall_us, time_us - dir_setup_us)
+            if direction == DIRECTION_FORWARD:
+                edges.append((change_us, dir_mask, 0))
+            else:
+                edges.append((change_us, 0, dir_mask))
+            time_us = max(time_us, change_us + dir_setup_us)
+        elif time_us <= previous_fall_us:
+            raise ValueError("step at %d us rises before the previous step's %d us pulse has ended"
+                             % (time_us, pulse_us))
+        edges.append((time_us, step_mask, 0))
+        previous_fall_us = time_us + pulse_us
+        edges.append((previous_fall_us, 0, step_mask))
+
+    segments = []
+    for first in range(0, len(edges), max_pulses):
+        chunk = edges[first:first + max_pulses]
+        following = edges[first + max_pulses][0] if first + max_pulses < len(edges) else schedule.duration_us
+        pulses = []
+        for index, (time_us, on_mask, off_mask) in enumerate(chunk):
+            next_us = chunk[index + 1][0] if index + 1 < len(chunk) else following
+            pulses.append((on_mask, off_mask, max(next_us - time_us, 0)))
+        steps = sum(1 for pulse in chunk if pulse[1] == step_mask)
+        segments.append(WaveSegment(pulses, chunk[0][0], steps))
+    return segments
+
+
+def segment_edges(segments):
+    """
+    Replay segments into absolute (time_us, on_mask, off_mask) edges.
+    Used to check what the hardware would output.
+    """
+    edges = []
+    time_us = 0
+    for segment in segments:
+        for on_mask, off_mask, delay_us in segment.pulses:
+            edges.append((time_us, on_mask, off_mask))
+            time_us += delay_us
+    return edges
+
+
+def step_times_from_segments(segments, step_pin):
+    """Recover the step rising edge times from emitted segments."""
+    step_mask = 1 << step_pin
+    return array('q', (time_us for time_us, on_mask, off_mask in segment_edges(segments) if on_mask & step_mask))
+
+
+class MemoryWaveEmitter:
+    """Keeps emitted segments in memory."""
+
+    def __init__(self):
+        self.segments = []
+
+    def emit(self, segments):
+        self.segments.extend(segments)
+
+
+class FileWaveEmitter:
+    """
+    Writes segments to a file.  Each segment is a little-endian uint32 pulse
+    count followed by that many PULSE records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, segments):
+        with open(self.path, 'ab') as stream:
+            for segment in segments:
+                stream.write(struct.pack("<I", len(segment.pulses)))
+                stream.write(b"".join(PULSE.pack(*pulse) for pulse in segment.pulses))
+
+    def read(self):
+        """Read all segments back from the file."""
+        segments = []
+        start_us = 0
+        with open(self.path, 'rb') as stream:
+            while True:
+                header = stream.read(4)
+                if len(header) < 4:
+                    return segments
+                count, = struct.unpack("<I", header)
+                pulses = [PULSE.unpack(stream.read(PULSE.size)) for _ in range(count)]
+                segment = WaveSegment(pulses, start_us, 0)
+                start_us += segment.duration_us
+                segments.append(segment)
+
+
+class PigpioWaveEmitter:
+    """
+    Plays segments on the hardware through pigpio waves.
+
+    Each segment becomes a wave sent with WAVE_MODE_ONE_SHOT_SYNC so it starts
+    exactly when the previous one ends.  Only one wave is queued behind the one
+    playing, so long schedules don't exhaust pigpio's wave memory.
+    """
+
+    def __init__(self, pi, step_pin, dir_pin):
+        import pigpio
+        self._pigpio = pigpio
+        self.pi = pi
+        self.pi.set_mode(step_pin, pigpio.OUTPUT)
+        self.pi.set_mode(dir_pin, pigpio.OUTPUT)
+
+    def emit(self, segments):
+        pigpio = self._pigpio
+        queued = []
+        for segment in segments:
+            self.pi.wave_add_generic([pigpio.pulse(on_mask, off_mask, delay_us)
+                                      for on_mask, off_mask, delay_us in segment.pulses])
+            wave_id = self.pi.wave_create()
+
+            # Wait for the oldest wave to finish before queuing another.
+            while len(queued) >= 2:
+                if self.pi.wave_tx_at() != queued[0]:
+                    self.pi.wave_delete(queued.pop(0))
+                else:
+                    time.sleep(segment.duration_us / 4000000.0)
+            self.pi.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            queued.append(wave_id)
+
+        while self.pi.wave_tx_busy():
+            time.sleep(0.001)
+        for wave_id in queued:
+            self.pi.wave_delete(wave_id)
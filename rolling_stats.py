@@ -0,0 +1,199 @@
+"""
+Rolling statistics over recent pressure samples.
+
+Each window (e.g. the last 1 s, 10 s and 60 s) is split into a ring of time
+buckets.  Adding a sample updates the newest bucket and the window's running
+totals; when time moves on, the buckets that fall out of the window are
+subtracted from the totals and cleared.  So an update is O(1) whatever the
+sample rate, and a query only looks at the totals, the bucket minima and
+maxima and one histogram.
+
+Percentiles come from a fixed-range histogram and are interpolated within a
+bin, so they are accurate to about (high - low) / bins.  Variance is computed
+from sums shifted by the first sample, which keeps the cancellation small
+for readings sitting near atmospheric pressure.
+
+Samples are added from the sampler thread and read from the main loop, so
+every window is guarded by a lock held only for the update or the query.
+"""
+import math
+import threading
+from array import array
+
+DEFAULT_WINDOWS_S = (1, 10, 60)
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class RollingWindow:
+    """Count, min, max, mean, variance and percentiles of the samples in the last window_ms."""
+
+    def __init__(self, window_ms, buckets=20, low=0.0, high=1300.0, bins=512):
+        """
+        Arguments:
+          window_ms (float): Length of the window.
+          buckets (int): Time buckets the window is split into.  Samples leave
+            the window a bucket at a time, so it really covers between
+            window_ms * (buckets - 1) / buckets and window_ms.
+          low, high (float): Range of the percentile histogram.  Values outside it
+            land in the end bins.
+          bins (int): Number of histogram bins.
+        """
+        self.window_ms = window_ms
+        self.bucket_ms = window_ms / buckets
+        self.low = low
+        self.high = high
+        self._buckets = buckets
+        self._bins = bins
+        self._bin_scale = bins / (high - low)
+        self._lock = threading.Lock()
+        # Per bucket.
+        self._counts = array('q', bytes(8 * buckets))
+        self._sums = array('d', bytes(8 * buckets))
+        self._squares = array('d', bytes(8 * buckets))
+        self._minima = array('d', [math.inf] * buckets)
+        self._maxima = array('d', [-math.inf] * buckets)
+        self._histograms = [array('I', bytes(4 * bins)) for _ in range(buckets)]
+        # Whole window.
+        self._histogram = array('q', bytes(8 * bins))
+        self.count = 0
+        self._sum = 0.0
+        self._square = 0.0
+        # Values are summed relative to this, see the module docstring.
+        self._shift = None
+        # Absolute number (time // bucket_ms) of the newest bucket.
+        self._newest = None
+
+    def add(self, time_ms, value):
+        with self._lock:
+            index = int(time_ms // self.bucket_ms)
+            if self._newest is None or index > self._newest:
+                self._advance(index)
+            slot = self._newest % self._buckets
+            if self._shift is None:
+                self._shift = value
+            shifted = value - self._shift
+            squared = shifted * shifted
+            self._counts[slot] += 1
+            self._sums[slot] += shifted
+            self._squares[slot] += squared
+            if value < self._minima[slot]:
+                self._minima[slot] = value
+            if value > self._maxima[slot]:
+                self._maxima[slot] = value
+            bin_index = int((value - self.low) * self._bin_scale)
+            bin_index = 0 if bin_index < 0 else (bin_index if bin_index < self._bins else self._bins - 1)
+            self._histograms[slot][bin_index] += 1
+            self._histogram[bin_index] += 1
+            self.count += 1
+            self._sum += shifted
+            self._square += squared
+
+    def _advance(self, index):
+        """Make index the newest bucket, expiring everything that falls out of the window."""
+        if self._newest is None or index - self._newest >= self._buckets:
+            for slot in range(self._buckets):
+                self._clear(slot)
+            # Nothing left in the window, so start the running sums afresh.
+            self.count = 0
+            self._sum = self._square = 0.0
+            for bin_index in range(self._bins):
+                self._histogram[bin_index] = 0
+            self._shift = None
+        else:
+            for expired in range(self._newest + 1, index + 1):
+                slot = expired % self._buckets
+                if self._counts[slot]:
+                    self._expire(slot)
+        self._newest = index
+
+    def _expire(self, slot):
+        self.count -= self._counts[slot]
+        self._sum -= self._sums[slot]
+        self._square -= self._squares[slot]
+        histogram = self._histogram
+        for bin_index, bin_count in enumerate(self._histograms[slot]):
+            if bin_count:
+                histogram[bin_index] -= bin_count
+        self._clear(slot)
+
+    def _clear(self, slot):
+        self._counts[slot] = 0
+        self._sums[slot] = 0.0
+        self._squares[slot] = 0.0
+        self._minima[slot] = math.inf
+        self._maxima[slot] = -math.inf
+        histogram = self._histograms[slot]
+        for bin_index in range(self._bins):
+            histogram[bin_index] = 0
+
+    def _percentile(self, fraction, minimum, maximum):
+        wanted = fraction * self.count
+        seen = 0
+        bin_width = 1.0 / self._bin_scale
+        for bin_index, bin_count in enumerate(self._histogram):
+            if bin_count and seen + bin_count >= wanted:
+                # Assume the bin's samples are spread evenly across it.
+                value = self.low + (bin_index + (wanted - seen) / bin_count) * bin_width
+                return min(max(value, minimum), maximum)
+            seen += bin_count
+        return maximum
+
+    def snapshot(self, now_ms=None) -> dict:
+        """
+        Statistics of the window, ending at now_ms if given so that a stalled
+        sampler doesn't keep reporting old samples.
+        """
+        with self._lock:
+            if now_ms is not None and self._newest is not None:
+                index = int(now_ms // self.bucket_ms)
+                if index > self._newest:
+                    self._advance(index)
+            count = self.count
+            if count == 0:
+                return {"n": 0}
+            mean = self._sum / count
+            variance = max(self._square / count - mean * mean, 0.0)
+            minimum = min(self._minima)
+            maximum = max(self._maxima)
+            stats = {
+                "n": count,
+                "min": round(minimum, 3),
+                "max": round(maximum, 3),
+                "mean": round(self._shift + mean, 3),
+                "var": round(variance, 4),
+                "std": round(math.sqrt(variance), 4),
+            }
+            for fraction in PERCENTILES:
+                stats["p%d" % round(fraction * 100)] = round(self._percentile(fraction, minimum, maximum), 3)
+            return stats
+
+
+class RollingStats:
+    """A set of RollingWindows fed with the same samples."""
+
+    def __init__(self, windows_s=DEFAULT_WINDOWS_S, **window_options):
+        """
+        Arguments:
+          windows_s (iterable): Window lengths in seconds.
+          window_options: Passed on to each RollingWindow (buckets, low, high, bins).
+        """
+        self._window_options = window_options
+        self.windows = {}
+        """Window length in seconds -> RollingWindow."""
+        self.set_windows(windows_s)
+
+    def set_windows(self, windows_s):
+        """Replace the windows.  The new ones start out empty."""
+        windows_s = [float(window_s) for window_s in windows_s]
+        if not windows_s or min(windows_s) <= 0:
+            raise ValueError("Window lengths must be positive")
+        self.windows = {window_s: RollingWindow(window_s * 1000.0, **self._window_options)
+                        for window_s in sorted(set(windows_s))}
+
+    def add(self, time_ms, value):
+        for window in self.windows.values():
+            window.add(time_ms, value)
+
+    def snapshot(self, now_ms=None) -> dict:
+        """Window length in seconds -> RollingWindow.snapshot()."""
+        return {window_s: window.snapshot(now_ms) for window_s, window in self.windows.items()}
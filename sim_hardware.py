@@ -0,0 +1,359 @@
+"""
+Simulated hardware for running the app and the stepper drivers off a Pi.
+
+Stands in for RPi.GPIO, board, adafruit_mprls and advpistepper:
+  GPIO          records every output edge with a monotonic ns timestamp,
+                so step rate, pulse width and jitter can be measured.
+  MPRLS         returns pressures from a script (a function of time or a list
+                of readings).
+  AdvPiStepper  records the commands it is given and jumps to the target.
+
+The backend is picked at startup from the PUMPAPP_HARDWARE environment
+variable ("pi", the default, or "sim"), or by calling install() before the
+hardware libraries are first imported:
+
+    import sim_hardware
+    sim_hardware.select_backend()
+    import RPi.GPIO as GPIO  # the simulation if PUMPAPP_HARDWARE=sim
+
+That is up to the app's entry points (main.py, stepper.py, the benchmarks):
+the RaspberryPiStepperDriver package knows nothing about the app, so code
+that imports its GPIO drivers directly has to install the simulation first.
+"""
+import math
+import os
+import sys
+import types
+from array import array
+from collections import deque
+
+from RaspberryPiStepperDriver import clock as shared_clock
+
+BACKEND_ENVIRONMENT_VARIABLE = "PUMPAPP_HARDWARE"
+BACKEND_PI = "pi"
+BACKEND_SIM = "sim"
+
+hardware = None
+"""The installed SimulatedHardware, or None when running on the real thing."""
+
+
+class EdgeRecorder:
+    """Timestamped log of output level changes."""
+
+    def __init__(self, clock_ns=None):
+        self.clock_ns = shared_clock.monotonic_ns if clock_ns is None else clock_ns
+        self.times_ns = array('q')
+        """Time of each edge."""
+        self.pins = array('H')
+        """Pin that changed."""
+        self.levels = array('B')
+        """Level the pin changed to."""
+
+    def __len__(self):
+        return len(self.times_ns)
+
+    def record(self, pin, level):
+        self.times_ns.append(self.clock_ns())
+        self.pins.append(pin)
+        self.levels.append(level)
+
+    def clear(self):
+        del self.times_ns[:], self.pins[:], self.levels[:]
+
+    def edges(self, pin, level=None):
+        """Times of the pin's edges, only those to level if given."""
+        return array('q', (time_ns for time_ns, edge_pin, edge_level in zip(self.times_ns, self.pins, self.levels)
+                           if edge_pin == pin and (level is None or edge_level == level)))
+
+    def pulse_widths_ns(self, pin):
+        """High time of every complete pulse on the pin."""
+        widths = array('q')
+        rose_at = None
+        for time_ns, edge_pin, level in zip(self.times_ns, self.pins, self.levels):
+            if edge_pin != pin:
+                continue
+            if level:
+                rose_at = time_ns
+            elif rose_at is not None:
+                widths.append(time_ns - rose_at)
+                rose_at = None
+        return widths
+
+    def intervals_ns(self, pin):
+        """Time between consecutive rising edges on the pin."""
+        rising = self.edges(pin, 1)
+        return array('q', (later - earlier for earlier, later in zip(rising, rising[1:])))
+
+    def summary(self, pin) -> dict:
+        """Step count, rate, pulse width and interval jitter of a pin, in us."""
+        rising = self.edges(pin, 1)
+        widths = self.pulse_widths_ns(pin)
+        intervals = self.intervals_ns(pin)
+        stats = {"pulses": len(rising)}
+        if len(rising) > 1:
+            stats["rate_hz"] = round((len(rising) - 1) / ((rising[-1] - rising[0]) / 1e9), 1)
+        if widths:
+            stats["width_min_us"] = round(min(widths) / 1000.0, 3)
+            stats["width_mean_us"] = round(sum(widths) / len(widths) / 1000.0, 3)
+            stats["width_max_us"] = round(max(widths) / 1000.0, 3)
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            stats["interval_mean_us"] = round(mean / 1000.0, 3)
+            stats["jitter_us"] = round(math.sqrt(sum((i - mean) ** 2 for i in intervals) / len(intervals)) / 1000.0, 3)
+        return stats
+
+
+class SimulatedGPIO(types.ModuleType):
+    """The parts of the RPi.GPIO API the drivers use."""
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self, recorder):
+        super().__init__("RPi.GPIO")
+        self.recorder = recorder
+        self.mode = None
+        self.levels = {}
+        """Current level of every pin that has been set up."""
+        self.directions = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        for pin in self._pins(channel):
+            self.directions[pin] = direction
+            if direction == self.OUT:
+                self._set(pin, self.LOW if initial is None else initial)
+            else:
+                self.levels.setdefault(pin, self.HIGH if pull_up_down == self.PUD_UP else self.LOW)
+
+    def output(self, channel, value):
+        pins = self._pins(channel)
+        values = value if isinstance(value, (list, tuple)) else [value] * len(pins)
+        for pin, level in zip(pins, values):
+            if self.directions.get(pin) != self.OUT:
+                raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+            self._set(pin, level)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.LOW)
+
+    def cleanup(self, channel=None):
+        pins = list(self.directions) if channel is None else self._pins(channel)
+        for pin in pins:
+            self.directions.pop(pin, None)
+            self.levels.pop(pin, None)
+
+    def _set(self, pin, level):
+        level = 1 if level else 0
+        if self.levels.get(pin) != level:
+            self.levels[pin] = level
+            self.recorder.record(pin, level)
+
+    @staticmethod
+    def _pins(channel):
+        return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+class SimulatedI2C:
+    """What board.I2C() returns. Only there to be handed to the sensor."""
+
+    def __init__(self):
+        self.locked = False
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+
+def sine_script(mean_hpa=1013.25, amplitude_hpa=20.0, period_s=4.0):
+    """A pressure script that rises and falls like a pump stroke."""
+    return lambda elapsed_s: mean_hpa + amplitude_hpa * math.sin(2.0 * math.pi * elapsed_s / period_s)
+
+
+class ScriptedMPRLS:
+    """
+    Drop-in for adafruit_mprls.MPRLS.
+
+    The script is either a function of the seconds since the sensor was
+    created returning hPa, or a sequence of hPa readings returned in turn
+    (and repeated).
+    """
+
+    def __init__(self, i2c_bus=None, *, reset_pin=None, eoc_pin=None, psi_min=0, psi_max=25,
+                 script=None, read_time_s=0.0):
+        self._clock = clock = shared_clock
+        self.psi_min = psi_min
+        self.psi_max = psi_max
+        self.script = sine_script() if script is None else script
+        self.read_time_s = read_time_s
+        """How long a read blocks, like waiting for the real sensor's conversion."""
+        self.started_at_ns = clock.monotonic_ns()
+        self.reads = 0
+
+    @property
+    def pressure(self):
+        if self.read_time_s > 0:
+            self._clock.sleep_ns(int(self.read_time_s * 1e9))
+        self.reads += 1
+        if callable(self.script):
+            return self.script((self._clock.monotonic_ns() - self.started_at_ns) / 1e9)
+        return self.script[(self.reads - 1) % len(self.script)]
+
+
+class SimulatedDriverStepDirGeneric:
+    def __init__(self, step_pin, dir_pin, parameters=None):
+        self.step_pin = step_pin
+        self.dir_pin = dir_pin
+        self.parameters = dict(parameters or {})
+
+
+class SimulatedAdvPiStepper:
+    """
+    Drop-in for advpistepper.AdvPiStepper.  Records commands with a
+    monotonic ns timestamp; moves complete instantly.
+    """
+
+    def __init__(self, driver=None, parameters=None, history=10000):
+        self.parameters = dict(driver.parameters if driver is not None else {})
+        self.parameters.update(parameters or {})
+        self.current_position = 0
+        self.commands = deque(maxlen=history)
+        """(time_ns, command, arguments) of the latest commands."""
+        self._clock = shared_clock
+
+    def _record(self, command, *arguments):
+        self.commands.append((self._clock.monotonic_ns(), command, arguments))
+
+    def zero(self):
+        self._record("zero")
+        self.current_position = 0
+
+    def move_to(self, position, speed=None, block=False):
+        self._record("move_to", position, speed)
+        self.current_position = position
+
+    def move(self, steps, speed=None, block=False):
+        self.move_to(self.current_position + steps, speed, block)
+
+    def run(self, direction, speed=None):
+        self._record("run", direction, speed)
+
+    def stop(self, block=False):
+        self._record("stop")
+
+    def hard_stop(self, block=False):
+        self._record("hard_stop")
+
+    def close(self):
+        pass
+
+
+class SimulatedHardware:
+    """The simulated devices and the modules they are installed as."""
+
+    def __init__(self, pressure_script=None, read_time_s=0.0):
+        self.recorder = EdgeRecorder()
+        self.gpio = SimulatedGPIO(self.recorder)
+        self.sensors = []
+        """Every ScriptedMPRLS created, most recent last."""
+        self.steppers = []
+        """Every SimulatedAdvPiStepper created, most recent last."""
+        self.pressure_script = pressure_script
+        self.read_time_s = read_time_s
+
+    @property
+    def sensor(self):
+        return self.sensors[-1] if self.sensors else None
+
+    @property
+    def stepper(self):
+        return self.steppers[-1] if self.steppers else None
+
+    def modules(self):
+        """name -> module for everything the simulation replaces."""
+        def make_sensor(*arguments, **keywords):
+            keywords.setdefault("script", self.pressure_script)
+            keywords.setdefault("read_time_s", self.read_time_s)
+            sensor = ScriptedMPRLS(*arguments, **keywords)
+            self.sensors.append(sensor)
+            return sensor
+
+        def make_stepper(*arguments, **keywords):
+            stepper = SimulatedAdvPiStepper(*arguments, **keywords)
+            self.steppers.append(stepper)
+            return stepper
+
+        rpi = types.ModuleType("RPi")
+        rpi.GPIO = self.gpio
+        board = types.ModuleType("board")
+        board.I2C = SimulatedI2C
+        mprls = types.ModuleType("adafruit_mprls")
+        mprls.MPRLS = make_sensor
+        advpistepper = types.ModuleType("advpistepper")
+        advpistepper.__dict__.update(
+            MAX_SPEED="max_speed",
+            MAX_TORQUE_SPEED="max_torque_speed",
+            ACCELERATION_RATE="acceleration_rate",
+            DECELERATION_RATE="deceleration_rate",
+            FULL_STEPS_PER_REV="full_steps_per_rev",
+            MICROSTEP_OPTIONS="microstep_options",
+            MICROSTEP_DEFAULT="microstep_default",
+            STEP_PULSE_LENGTH="step_pulse_length",
+            STEP_PULSE_DELAY="step_pulse_delay",
+            DriverStepDirGeneric=SimulatedDriverStepDirGeneric,
+            AdvPiStepper=make_stepper,
+        )
+        return {
+            "RPi": rpi,
+            "RPi.GPIO": self.gpio,
+            "board": board,
+            "adafruit_mprls": mprls,
+            "advpistepper": advpistepper,
+        }
+
+
+def install(pressure_script=None, read_time_s=0.0):
+    """
+    Install the simulation in place of the hardware libraries.  Must run
+    before they are first imported.  Returns the SimulatedHardware.
+    """
+    global hardware
+    if hardware is None:
+        hardware = SimulatedHardware(pressure_script, read_time_s)
+        sys.modules.update(hardware.modules())
+    return hardware
+
+
+def select_backend(backend=None):
+    """
+    Install the backend named by the argument or PUMPAPP_HARDWARE.
+    Returns the name of the backend in use.
+    """
+    if backend is None:
+        backend = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, BACKEND_PI)
+    backend = backend.lower()
+    if backend == BACKEND_SIM:
+        install()
+    elif backend != BACKEND_PI:
+        raise ValueError("Unknown hardware backend %r, expected %r or %r" % (backend, BACKEND_PI, BACKEND_SIM))
+    return backend
@@ -1,5 +1,10 @@
 import time
+
+import sim_hardware
+sim_hardware.select_backend()
+
 import RPi.GPIO as GPIO
+from RaspberryPiStepperDriver import clock
 # import pigpio
 
 
@@ -60,7 +65,7 @@ class MyStepperController:
     def enable_outputs(self):
         GPIO.output(self.enable_pin, GPIO.LOW)
         # This is probably redundant, but it's cheap.
-        time.sleep(self.init_delay_microseconds / 1000000.0)
+        clock.sleep_us(self.init_delay_microseconds)
 
     def disable_outputs(self):
         GPIO.output(self.enable_pin, GPIO.HIGH)
@@ -89,19 +94,20 @@ class MyStepperController:
             GPIO.output(self.direction_pin, GPIO.HIGH if direction else GPIO.LOW)
             self.last_direction = direction
             # Delay long enough to allow the motor to react to the direction change.
-            time.sleep(self.pulse_delay_microseconds / 1000000.0)
+            clock.sleep_us(self.pulse_delay_microseconds)
 
         GPIO.output(self.step_pin, GPIO.HIGH)
         # Stay active for the pulse width.
-        time.sleep(self.pulse_delay_microseconds / 1000000.0)
+        clock.sleep_us(self.pulse_delay_microseconds)
         # End the pulse.
         GPIO.output(self.step_pin, GPIO.LOW)
 
         # Delay long enough to allow the motor to react to the pulse.
-        time.sleep(self.pulse_delay_microseconds / 1000000.0)
+        clock.sleep_us(self.pulse_delay_microseconds)
 
         # Update the current position.
         if direction:
             self._current_position += 1
         else:
             self._current_position -= 1
+        self.last_step_timestamp_ms = clock.monotonic_ms()
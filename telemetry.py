@@ -0,0 +1,221 @@
+"""
+Pressure telemetry: batched sample frames and the UDP stream.
+
+Pressure samples can be sent one "P:<mmHg>" line each, or packed into frames
+of up to batch_size timestamped samples, optionally keeping only every
+decimation'th sample.  Samples are numbered as they come out of the
+sampler's ring buffer, so a client can tell a decimated sample from a lost
+one.  Text frames are a single line:
+
+    T:<first sample number>,<decimation>,<t0 ms>;<offset us>,<mmHg>;<offset us>,<mmHg>;...
+
+with each offset relative to t0 (the first sample's is 0).  Binary frames
+start with a header like the trajectory frames the client uploads:
+
+    magic          4s   b"PPTS"
+    version        B    SAMPLE_FRAME_VERSION
+    decimation     B
+    count          H    number of samples
+    first_sample   Q    number of the first sample
+    t0_ms          d    time of the first sample
+    offsets_us     count x I, relative to t0
+    values         count x f, mmHg
+
+all little-endian.
+
+The UDP stream is for consumers that want every reading at a high rate and can live with
+losing some: a dashboard, or a recorder on the same LAN.  Each datagram
+starts with a sequence number on a line of its own, followed by the usual
+protocol lines (e.g. "P:<mmHg>\\n"):
+
+    1234\\n
+    P:752.61\\n
+
+so a listener can tell how many datagrams it missed.  Sends never block; a
+datagram the socket won't take is counted and dropped.
+"""
+import socket
+import struct
+import sys
+from array import array
+
+FORMAT_LINES = "P"
+FORMAT_TEXT = "T"
+FORMAT_BINARY = "B"
+
+SAMPLE_FRAME_MAGIC = b"PPTS"
+SAMPLE_FRAME_VERSION = 1
+SAMPLE_FRAME_HEADER = struct.Struct("<4sBBHQd")
+
+
+def _little_endian_bytes(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode_sample_frame(frame):
+    """
+    Decode a binary sample frame.
+    Returns (first_sample, decimation, timestamps_ms, values) with the samples as array('d').
+    """
+    magic, version, decimation, count, first_sample, t0_ms = SAMPLE_FRAME_HEADER.unpack_from(frame)
+    if magic != SAMPLE_FRAME_MAGIC or version != SAMPLE_FRAME_VERSION:
+        raise ValueError("Not a version %d sample frame" % SAMPLE_FRAME_VERSION)
+    if len(frame) != SAMPLE_FRAME_HEADER.size + 8 * count:
+        raise ValueError("Sample frame length mismatch")
+    offsets_us = array('I')
+    offsets_us.frombytes(frame[SAMPLE_FRAME_HEADER.size:SAMPLE_FRAME_HEADER.size + 4 * count])
+    values = array('f')
+    values.frombytes(frame[SAMPLE_FRAME_HEADER.size + 4 * count:])
+    if sys.byteorder == 'big':
+        offsets_us.byteswap()
+        values.byteswap()
+    return first_sample, decimation, array('d', (t0_ms + offset / 1000.0 for offset in offsets_us)), array('d', values)
+
+
+class SampleFramer:
+    """Packs pressure samples into text or binary frames."""
+
+    def __init__(self, binary=False, batch_size=32, decimation=1):
+        """
+        Arguments:
+          binary (bool): Binary frames rather than T: lines.
+          batch_size (int): Most samples per frame.
+          decimation (int): Only send samples whose number is a multiple of this.
+        """
+        if not 0 < batch_size < 65536:
+            raise ValueError("batch size must be 1-65535")
+        if not 0 < decimation < 256:
+            raise ValueError("decimation must be 1-255")
+        self.binary = binary
+        self.batch_size = batch_size
+        self.decimation = decimation
+        self.frames_sent = 0
+        self.samples_sent = 0
+        self.bytes_sent = 0
+
+    @property
+    def format(self):
+        return FORMAT_BINARY if self.binary else FORMAT_TEXT
+
+    def encode(self, first_sample, timestamps, values) -> list:
+        """
+        Frame a run of consecutive samples as read from the sampler's ring.
+
+        Arguments:
+          first_sample (int): Number of the first sample in the run.
+          timestamps, values (array): The samples.
+        Returns the frames, as bytes if binary and str otherwise.
+        """
+        # Keep samples numbered a multiple of the decimation, wherever the run starts.
+        skip = -first_sample % self.decimation
+        if self.decimation > 1:
+            timestamps = timestamps[skip::self.decimation]
+            values = values[skip::self.decimation]
+            first_sample += skip
+
+        frames = []
+        for start in range(0, len(values), self.batch_size):
+            end = min(start + self.batch_size, len(values))
+            if self.binary:
+                frame = self._encode_binary(first_sample + start * self.decimation, timestamps, values, start, end)
+            else:
+                frame = self._encode_text(first_sample + start * self.decimation, timestamps, values, start, end)
+            frames.append(frame)
+            self.bytes_sent += len(frame)
+        self.frames_sent += len(frames)
+        self.samples_sent += len(values)
+        return frames
+
+    def _encode_text(self, first_sample, timestamps, values, start, end):
+        t0_ms = timestamps[start]
+        return "T:%d,%d,%.3f;" % (first_sample, self.decimation, t0_ms) + ";".join(
+            "%.0f,%.3f" % ((timestamps[index] - t0_ms) * 1000.0, values[index]) for index in range(start, end)) + "\n"
+
+    def _encode_binary(self, first_sample, timestamps, values, start, end):
+        t0_ms = timestamps[start]
+        offsets_us = array('I', (int(round((timestamps[index] - t0_ms) * 1000.0)) for index in range(start, end)))
+        header = SAMPLE_FRAME_HEADER.pack(SAMPLE_FRAME_MAGIC, SAMPLE_FRAME_VERSION, self.decimation,
+                                          end - start, first_sample, t0_ms)
+        return header + _little_endian_bytes(offsets_us) + _little_endian_bytes(array('f', values[start:end]))
+
+    def snapshot(self) -> dict:
+        return {
+            "format": self.format,
+            "batch": self.batch_size,
+            "decimation": self.decimation,
+            "frames": self.frames_sent,
+            "samples": self.samples_sent,
+            "bytes": self.bytes_sent,
+        }
+
+
+class UdpTelemetry:
+    """Fire-and-forget telemetry datagrams to any number of listeners."""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+        self.destinations = []
+        """(host, port) of every listener."""
+        self.sequence = 0
+        """Sequence number of the next datagram."""
+        self.datagrams = 0
+        """Datagrams sent, counted once per listener."""
+        self.bytes_sent = 0
+        self.dropped = 0
+        """Datagrams the socket wouldn't take."""
+
+    def __len__(self):
+        return len(self.destinations)
+
+    def add_destination(self, host, port):
+        """
+        Add a listener by its dotted-quad IPv4 address.
+
+        Host names aren't looked up: this runs on the event loop, and a DNS
+        query can block it for seconds.
+        """
+        port = int(port)
+        if not 0 < port < 65536:
+            raise ValueError("port out of range")
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+        except OSError:
+            raise ValueError("not a numeric IPv4 address") from None
+        address = (host, port)
+        if address not in self.destinations:
+            self.destinations.append(address)
+        return address
+
+    def clear(self):
+        self.destinations.clear()
+
+    def close(self):
+        self.clear()
+        self.socket.close()
+
+    def send(self, payload: bytes):
+        """Send payload to every listener, as one sequence numbered datagram."""
+        if not self.destinations:
+            return
+        datagram = b"%d\n" % self.sequence + payload
+        self.sequence += 1
+        for address in self.destinations:
+            try:
+                self.bytes_sent += self.socket.sendto(datagram, address)
+                self.datagrams += 1
+            except OSError:
+                # Full send buffer (BlockingIOError), or an ICMP error from an earlier datagram.
+                self.dropped += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "udp_listeners": len(self.destinations),
+            "udp_sequence": self.sequence,
+            "udp_datagrams": self.datagrams,
+            "udp_bytes_sent": self.bytes_sent,
+            "udp_dropped": self.dropped,
+        }
@@ -0,0 +1,145 @@
+import contextlib
+import io
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def hardware():
+    """The simulated hardware, installed before anything imports RPi.GPIO."""
+    import sim_hardware
+    return sim_hardware.install()
+
+
+@pytest.fixture
+def drive():
+    """Run a driver coroutine that never really awaits anything, without an event loop."""
+    def drive(coroutine):
+        try:
+            coroutine.send(None)
+        except StopIteration as stop:
+            return stop.value
+        raise RuntimeError("coroutine suspended")
+    return drive
+
+
+@pytest.fixture(scope="session")
+def main(hardware):
+    """The app, on the simulated hardware."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    from event_loop import EventLoop
+    main.app.loop = EventLoop(main.current_time_in_ms)
+    main.app.upload_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+    yield main
+    main.app.upload_worker.shutdown()
+
+
+class Client:
+    """A client on a socket pair, instead of a TCP connection."""
+
+    def __init__(self, main, app):
+        self.main = main
+        self.app = app
+        server, self.socket = socket.socketpair()
+        self.socket.settimeout(2.0)
+        self.subscriber = app.comm.add_subscriber(server, "client")
+        self._received = b""
+
+    def send(self, text):
+        self.socket.sendall(text.encode() if isinstance(text, str) else text)
+
+    def lines(self):
+        """Everything received so far, as lines."""
+        self.socket.setblocking(False)
+        try:
+            while True:
+                data = self.socket.recv(65536)
+                if not data:
+                    break
+                self._received += data
+        except BlockingIOError:
+            pass
+        finally:
+            self.socket.settimeout(2.0)
+        lines = self._received.decode().split("\n")
+        self._received = lines.pop().encode()
+        return lines
+
+    def close(self):
+        self.socket.close()
+
+
+@pytest.fixture
+def app(main):
+    """The app's state, reset, with nothing playing and no clients."""
+    from pressure_sampler import PressureSampler, SampleRing
+    from trajectory import Trajectory
+    import trajectory
+
+    class LocalCommunications(main.Communications):
+        def listen(self):
+            self.socket, self.listener = socket.socketpair()
+
+    app = main.app
+    app.comm = LocalCommunications()
+    app.trajectory = Trajectory()
+    app.positional_data = app.trajectory.samples
+    app.positional_data_index = 0
+    app.home_offset = 0
+    app.scale_multiplier = 1.0
+    app.data_time_step_ms = 10
+    app.interpolation = trajectory.INTERPOLATION_STEP
+    app.subdivisions = 1
+    app.runMotors = False
+    app.debugging = False
+    app.upload = None
+    app.preparing = None
+    app.recompiling = None
+    app.pending_trajectory = None
+    app.library = None
+    app.tick_schedule.stop()
+    # No samples, but the loop wakes up every pressure update interval rather than sleeping for good.
+    app.send_pressure_sensor_update = True
+    app.pressure_framer = None
+    app.pressure_reader = SampleRing(16).reader()
+    # Not started: tests store the samples they want in its ring.
+    app.sampler = PressureSampler(lambda: 760.0, clock=main.current_time_in_ms)
+    app.pressure_control.stop()
+    yield app
+    app.comm.close()
+    app.comm.listener.close()
+
+
+@pytest.fixture
+def connect(main, app):
+    """Connect a client."""
+    clients = []
+
+    def connect():
+        client = Client(main, app)
+        clients.append(client)
+        return client
+    yield connect
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def run_until(main, app):
+    """Run main loop cycles until condition() is true."""
+
+    def run_until(condition, timeout_s=5.0):
+        deadline = time.monotonic() + timeout_s
+        with contextlib.redirect_stdout(io.StringIO()):
+            while not condition():
+                assert time.monotonic() < deadline, "timed out"
+                main.main_loop_cycle()
+    return run_until
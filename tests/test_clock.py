@@ -0,0 +1,67 @@
+from RaspberryPiStepperDriver import clock
+from RaspberryPiStepperDriver.clock import VirtualClock
+
+STEP_PIN = 23
+DIR_PIN = 24
+
+
+def test_virtual_clock_only_moves_when_told():
+    virtual = VirtualClock(start_ns=5000)
+    with clock.using_clock(virtual):
+        assert clock.monotonic_us() == 5
+        clock.sleep_us(20)
+        assert clock.monotonic_ns() == 25000
+        virtual.advance_ms(1)
+        assert clock.monotonic_ms() == 1
+    assert clock.current_clock() is clock.system_clock
+
+
+def test_run_at_speed_steps_on_the_shared_clock(hardware, drive):
+    from RaspberryPiStepperDriver.accelstepper import AccelStepper
+    from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+    profile = RectangleProfile()
+    profile.set_target_speed(1000.0)
+    stepper = AccelStepper(profile, DIR_PIN, STEP_PIN)
+    stepper.set_pulse_width(2)
+    stepper._activator.start()
+    hardware.recorder.clear()
+    virtual = VirtualClock(start_ns=1000000000)
+    with clock.using_clock(virtual):
+        stepper.move(5)
+        stepped_at_us = []
+        while stepper.is_moving:
+            if drive(stepper.run_at_speed()):
+                stepped_at_us.append(stepper._last_step_time_us)
+            else:
+                # Sleep until the step is due, as run_forever() would.
+                virtual.set_ns(int(stepper._last_step_time_us + profile._step_interval_us) * 1000)
+    # A step every 1000 us after the first, which is due straight away.
+    assert stepped_at_us == [1000000 + 1000 * index for index in range(5)]
+    assert list(hardware.recorder.edges(STEP_PIN, 1)) == [time_us * 1000 for time_us in stepped_at_us]
+    # The pulse width was slept on the virtual clock too.
+    assert set(hardware.recorder.pulse_widths_ns(STEP_PIN)) == {2000}
+    timing = stepper.step_timing_statistics()
+    assert (timing["steps"], timing["max_us"]) == (4, 0)
+
+
+def test_app_time_follows_the_shared_clock(main):
+    virtual = VirtualClock(start_ns=main.app.app_start_time_ns)
+    with clock.using_clock(virtual):
+        assert main.current_time_in_ms() == 0.0
+        virtual.advance_us(1500)
+        assert main.current_time_in_ms() == 1.5
+
+
+def test_step_dir_driver_sleeps_on_the_shared_clock(hardware):
+    import asyncio
+    from RaspberryPiStepperDriver.stepdir import StepperDriver
+
+    driver = StepperDriver(200, DIR_PIN, STEP_PIN, rpm=60)
+    hardware.recorder.clear()
+    with clock.using_clock(VirtualClock(start_ns=0)):
+        asyncio.run(driver.move(3))
+        assert driver.last_step_ns == 10000000
+    # 5 ms per step at 60 rpm, half of it high, without waiting for any of it.
+    assert list(hardware.recorder.edges(STEP_PIN, 1)) == [0, 5000000, 10000000]
+    assert driver.step_counter == 3
@@ -0,0 +1,129 @@
+import selectors
+import socket
+import threading
+import time
+
+import pytest
+
+from event_loop import EventLoop
+
+
+def clock_ms():
+    return time.monotonic() * 1000.0
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoop(clock_ms)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def pairs():
+    """Connected socket pairs, closed after the test."""
+    made = []
+
+    def make():
+        pair = socket.socketpair()
+        made.append(pair)
+        return pair
+    yield make
+    for pair in made:
+        for end in pair:
+            end.close()
+
+
+def test_deadlines_wake_in_order(loop):
+    started_ms = clock_ms()
+    deadlines_ms = [started_ms + offset_ms for offset_ms in (5.0, 15.0, 30.0)]
+    woke_ms = []
+    for deadline_ms in deadlines_ms:
+        assert loop.wait_until(deadline_ms) == 0
+        woke_ms.append(clock_ms())
+    assert all(woke >= deadline for woke, deadline in zip(woke_ms, deadlines_ms))
+    assert woke_ms == sorted(woke_ms)
+    assert loop.stats.timer_wakeups == 3
+    assert loop.stats.latency_max_ms >= 0.0
+
+
+def test_passed_deadline_returns_straight_away(loop):
+    started_ms = clock_ms()
+    assert loop.wait_until(started_ms - 100.0) == 0
+    assert clock_ms() - started_ms < 100.0
+
+
+def test_socket_ready_before_the_deadline(loop, pairs):
+    reader, writer = pairs()
+    ready = []
+    loop.register(reader, selectors.EVENT_READ, lambda fileobj, mask: ready.append(fileobj.recv(16)))
+    writer.send(b"go")
+    started_ms = clock_ms()
+    assert loop.wait_until(started_ms + 10000.0) == 1
+    assert ready == [b"go"]
+    assert clock_ms() - started_ms < 5000.0
+    assert loop.stats.io_wakeups == 1
+
+
+def test_wake_from_another_thread(loop):
+    waker = threading.Timer(0.05, loop.wake)
+    started_ms = clock_ms()
+    waker.start()
+    try:
+        # No deadline: only the wake-up can end this.
+        assert loop.wait_until(None) == 1
+    finally:
+        waker.cancel()
+    assert 0.0 < clock_ms() - started_ms < 5000.0
+    # The wake-up was drained, so the next wait sleeps until its deadline.
+    assert loop.wait_until(clock_ms() + 10.0) == 0
+
+
+def test_repeated_wakes_collapse(loop):
+    for _ in range(100000):
+        loop.wake()
+    assert loop.wait_until(None) == 1
+    assert loop.wait_until(clock_ms()) == 0
+
+
+def test_unregister_while_dispatching(loop, pairs):
+    first_reader, first_writer = pairs()
+    second_reader, second_writer = pairs()
+    dispatched = []
+
+    def on_ready(fileobj, mask):
+        dispatched.append(fileobj)
+        # Whichever is dispatched first closes the other, as dropping a client would.
+        other = second_reader if fileobj is first_reader else first_reader
+        loop.unregister(other)
+        other.close()
+
+    loop.register(first_reader, selectors.EVENT_READ, on_ready)
+    loop.register(second_reader, selectors.EVENT_READ, on_ready)
+    first_writer.send(b"x")
+    second_writer.send(b"x")
+    assert loop.wait_until(clock_ms() + 1000.0) == 1
+    assert len(dispatched) == 1
+    assert loop.is_registered(dispatched[0])
+
+
+def test_modify_while_dispatching(loop, pairs):
+    first_reader, first_writer = pairs()
+    second_reader, second_writer = pairs()
+    dispatched = []
+
+    def replacement(fileobj, mask):
+        dispatched.append(("replacement", fileobj))
+
+    def on_ready(fileobj, mask):
+        dispatched.append(("original", fileobj))
+        other = second_reader if fileobj is first_reader else first_reader
+        loop.modify(other, selectors.EVENT_READ, replacement)
+
+    loop.register(first_reader, selectors.EVENT_READ, on_ready)
+    loop.register(second_reader, selectors.EVENT_READ, on_ready)
+    first_writer.send(b"x")
+    second_writer.send(b"x")
+    assert loop.wait_until(clock_ms() + 1000.0) == 2
+    # The second socket goes to the callback it was given by the first.
+    assert [name for name, _ in dispatched] == ["original", "replacement"]
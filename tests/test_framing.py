@@ -0,0 +1,63 @@
+import trajectory_codec
+from framing import LineFramer
+
+
+def oversized_header():
+    return trajectory_codec.HEADER.pack(trajectory_codec.FRAME_MAGIC, trajectory_codec.FRAME_VERSION,
+                                        trajectory_codec.SAMPLE_FLOAT32, 0, 1, 0xFFFFFFF0, 0)
+
+
+def test_lines_and_frames():
+    framer = LineFramer(capacity=64, min_free=16)
+    frame = trajectory_codec.encode_frame([1.0, 2.0, 3.0])
+    assert framer.feed(b"R:\nL:B\n" + frame + b"Q:LOOP\n") == 4
+    assert list(framer.frames) == ["R:", "L:B", frame, "Q:LOOP"]
+    assert framer.buffered == 0
+
+
+def test_partial_line_and_split_utf8():
+    framer = LineFramer()
+    data = "E:caf\u00e9\n".encode()
+    assert framer.feed(data[:5]) == 0
+    assert framer.feed(data[5:]) == 1
+    assert framer.frames.popleft() == "E:caf\u00e9"
+    assert framer.decode_errors == 0
+
+
+def test_invalid_utf8_is_replaced_and_counted():
+    framer = LineFramer()
+    framer.feed(b"E:\xff\n")
+    assert framer.frames.popleft() == "E:\ufffd"
+    assert framer.decode_errors == 1
+
+
+def test_frame_larger_than_the_buffer_is_received_in_pieces():
+    framer = LineFramer(capacity=32, min_free=8)
+    frame = trajectory_codec.encode_frame(range(1000))
+    for offset in range(0, len(frame), 100):
+        framer.feed(frame[offset:offset + 100])
+    assert list(framer.frames) == [frame]
+
+
+def test_oversized_frame_header_is_dropped_up_to_the_next_newline():
+    errors = []
+    framer = LineFramer(capacity=64, min_free=16, on_error=errors.append)
+    framer.feed(oversized_header() + b"garbage")
+    # Nothing is held back waiting for the announced frame.
+    assert framer.buffered == 0
+    assert len(framer.frames) == 0
+    framer.feed(b" more garbage\nQ:LOOP\n")
+    assert list(framer.frames) == ["Q:LOOP"]
+    assert framer.frame_errors == 1
+    assert len(errors) == 1
+    assert str(trajectory_codec.MAX_FRAME_BYTES) in errors[0]
+
+
+def test_oversized_frame_header_never_grows_the_buffer():
+    framer = LineFramer(capacity=64, min_free=16)
+    framer.feed(oversized_header())
+    for _ in range(100):
+        framer.feed(bytes(1000))
+    framer.feed(b"\nR:\n")
+    assert list(framer.frames) == ["R:"]
+    assert len(framer._buffer) < 4096
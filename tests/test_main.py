@@ -0,0 +1,155 @@
+"""The main loop and command handlers, on the simulated hardware."""
+from trajectory import Trajectory
+
+
+def play(main, app, samples):
+    app.trajectory = Trajectory(samples)
+    app.positional_data = app.trajectory.samples
+    app.home_offset = samples[0]
+    app.trajectory.compile(*main.playback_settings(app.home_offset))
+
+
+def test_scale_change_is_compiled_off_the_loop(main, app, run_until):
+    play(main, app, [float(i % 50) for i in range(20000)])
+    playing = app.trajectory
+    app.positional_data_index = 1234
+    main.process_input("X:2.0")
+    # The current trajectory keeps playing until the recompiled one is ready.
+    assert app.trajectory is playing
+    assert app.recompiling is not None
+    run_until(lambda: app.recompiling is None)
+    assert app.trajectory is not playing
+    assert app.trajectory.samples is playing.samples
+    assert app.trajectory.compiled_with == main.playback_settings(app.home_offset)
+    assert app.trajectory.target_steps[1234] == 2 * playing.target_steps[1234]
+    assert app.positional_data_index == 1234
+
+
+def test_settings_changed_while_compiling_are_compiled_once_it_finishes(main, app, run_until):
+    play(main, app, [float(i % 50) for i in range(20000)])
+    for scale in (2.0, 3.0, 4.0, 5.0):
+        main.process_input("X:" + str(scale))
+    main.process_input("F:20")
+    run_until(lambda: app.recompiling is None)
+    assert app.trajectory.compiled_with == (0.0, 5.0, 20, "step", 1)
+    assert app.trajectory.tick_ms == 20
+
+
+def test_interpolation_change_stays_at_the_same_data_point(main, app, run_until):
+    play(main, app, [float(i % 50) for i in range(1000)])
+    app.positional_data_index = 321
+    main.process_input("N:linear,10")
+    run_until(lambda: app.recompiling is None)
+    assert len(app.trajectory) == 10000
+    assert app.positional_data_index == 3210
+    main.process_input("N:step")
+    run_until(lambda: app.recompiling is None)
+    assert app.positional_data_index == 321
+
+
+def test_new_home_position_doesnt_recompile(main, app):
+    play(main, app, [float(i % 50) for i in range(1000)])
+    playing = app.trajectory
+    main.process_input("H:")
+    assert app.recompiling is None
+    assert app.trajectory is playing
+
+
+def replies(client, run_until, count=1):
+    """The next count lines the client is sent."""
+    lines = []
+
+    def received():
+        lines.extend(line for line in client.lines() if not line.startswith("P:"))
+        return len(lines) >= count
+    run_until(received)
+    return lines
+
+
+def test_pressure_control_refuses_to_start_with_too_few_samples(main, app, connect, run_until):
+    client = connect()
+    app.sampler.set_rate(50.0)
+    main.process_input("C:ON")
+    assert replies(client, run_until)[0].startswith("E:Pressure sampled at 50 Hz is too slow for 10 ms ticks")
+    assert not app.pressure_control.enabled
+
+    app.sampler.set_rate(100.0)
+    main.process_input("C:ON")
+    assert replies(client, run_until) == ["I:Closed-loop pressure control enabled."]
+    assert app.pressure_control.stale_after_ms == 20.0
+
+
+def test_sample_rate_cant_drop_below_what_pressure_control_needs(main, app, connect, run_until):
+    client = connect()
+    main.process_input("N:linear,10")
+    main.process_input("Z:R1000")
+    main.process_input("C:ON")
+    replies(client, run_until, 3)
+    assert app.pressure_control.enabled
+    assert app.pressure_control.stale_after_ms == 2.0
+
+    main.process_input("Z:R100")
+    assert replies(client, run_until) == ["E:Pressure control needs at least 1000 Hz at 1 ms ticks."]
+    assert app.sampler.rate_hz == 1000.0
+
+
+def test_library_commands_refuse_paths(main, app, connect, run_until, tmp_path):
+    from trajectory_library import TrajectoryLibrary
+    app.library = TrajectoryLibrary(str(tmp_path / "library"))
+    victim = tmp_path / "victim.traj"
+    victim.write_bytes(b"keep")
+    client = connect()
+    main.process_input("K:D:../victim")
+    assert replies(client, run_until) == ["E:No stored trajectory ../victim"]
+    assert victim.exists()
+
+
+def test_other_clients_commands_are_carried_out_during_an_upload(main, app, connect, run_until):
+    uploader, other = connect(), connect()
+    uploader.send("L:\n1\n2\n")
+    run_until(lambda: app.upload is not None and len(app.upload) == 2)
+    other.send("X:2.0\n3\nL:\n")
+    uploader.send("4\n")
+    run_until(lambda: app.upload is not None and len(app.upload) == 3)
+    assert app.scale_multiplier == 2.0
+    assert replies(other, run_until, 2) == ["E:Received unknown command/data: 3",
+                                            "E:Another client is uploading a trajectory."]
+
+    uploader.send("\n")
+    run_until(lambda: app.upload is None and app.preparing is None and app.recompiling is None)
+    assert list(app.trajectory.samples) == [1.0, 2.0, 4.0]
+
+
+def test_upload_is_abandoned_when_its_client_goes(main, app, connect, run_until):
+    uploader, other = connect(), connect()
+    uploader.send("L:\n1\n2\n")
+    run_until(lambda: app.upload is not None and len(app.upload) == 2)
+    uploader.close()
+    run_until(lambda: app.upload is None)
+    assert "E:Upload abandoned, the client sending it disconnected." in replies(other, run_until)
+    other.send("X:3.0\n")
+    run_until(lambda: app.scale_multiplier == 3.0)
+
+
+def test_step_length_must_be_positive(main, app, connect, run_until):
+    client = connect()
+    play(main, app, [0.0, 1.0, 2.0])
+    main.process_input("F:0")
+    client.send("@1 F -5\n@2 H\n")
+    assert replies(client, run_until, 3) == ["E:Invalid step length: 0 ms, must be at least 1 ms.",
+                                            "@1 ERR FAILED Invalid step length: -5 ms, must be at least 1 ms.",
+                                            "@2 OK"]
+    assert app.data_time_step_ms == 10
+
+
+def test_command_that_raises_is_reported(main, app, connect, run_until, monkeypatch):
+    def broken(data):
+        raise ZeroDivisionError("division by zero")
+    monkeypatch.setitem(main.COMMANDS, "F", (broken, int))
+    client = connect()
+    main.process_input("F:1")
+    client.send("@1 F 1\nQ:\n")
+    lines = replies(client, run_until, 3)
+    assert lines[:2] == ["E:Command F failed: ZeroDivisionError: division by zero",
+                         "@1 ERR INTERNAL Command F failed: ZeroDivisionError: division by zero"]
+    assert lines[2].startswith("Q:")
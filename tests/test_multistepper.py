@@ -0,0 +1,68 @@
+import bisect
+import math
+
+import pytest
+
+from RaspberryPiStepperDriver import clock
+from RaspberryPiStepperDriver.clock import VirtualClock
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+# (step pin, dir pin) of each axis.
+PINS = ((23, 24), (17, 27), (5, 6))
+START_NS = 1000000000
+
+
+def make_multistepper(make_profile):
+    from RaspberryPiStepperDriver.accelstepper import AccelStepper
+    from RaspberryPiStepperDriver.multistepper import MultiStepper
+
+    multistepper = MultiStepper()
+    for step_pin, dir_pin in PINS:
+        profile = make_profile()
+        profile.set_acceleration(1600.0)
+        profile.set_target_speed(800.0)
+        stepper = AccelStepper(profile, dir_pin, step_pin)
+        stepper._activator.start()
+        multistepper.add_stepper(stepper)
+    return multistepper
+
+
+def run_move(multistepper, targets, drive):
+    """Run a coordinated move on a virtual clock, sleeping until each step is due as run_forever() would."""
+    virtual = VirtualClock(start_ns=START_NS)
+    with clock.using_clock(virtual):
+        multistepper.move_to(targets)
+        while drive(multistepper.run()):
+            deadline_us = multistepper.next_step_time_us()
+            if deadline_us is not None and deadline_us > clock.monotonic_us():
+                virtual.set_ns(math.ceil(deadline_us) * 1000)
+
+
+@pytest.mark.parametrize("make_profile", [AccelProfile, RectangleProfile])
+def test_axes_arrive_together(hardware, drive, make_profile):
+    multistepper = make_multistepper(make_profile)
+    hardware.recorder.clear()
+    run_move(multistepper, [800, -400, 250], drive)
+    assert multistepper.positions == [800, -400, 250]
+    assert not multistepper.is_moving
+
+    steps_ns = [list(hardware.recorder.edges(step_pin, 1)) for step_pin, _ in PINS]
+    assert [len(times) for times in steps_ns] == [800, 400, 250]
+    ends_ns = [times[-1] for times in steps_ns]
+    duration_ns = max(ends_ns) - START_NS
+    assert max(ends_ns) - min(ends_ns) <= duration_ns * 0.02
+
+    # The axes cover the same fraction of their distance all along, not just at the end.
+    for fraction in (0.1, 0.25, 0.5, 0.75, 0.9):
+        at_ns = START_NS + duration_ns * fraction
+        done = [bisect.bisect_right(times, at_ns) / len(times) for times in steps_ns]
+        assert max(done) - min(done) <= 0.02
+
+
+def test_axis_without_distance_stays_put(hardware, drive):
+    multistepper = make_multistepper(AccelProfile)
+    hardware.recorder.clear()
+    run_move(multistepper, [300, 0, -150], drive)
+    assert multistepper.positions == [300, 0, -150]
+    assert list(hardware.recorder.edges(PINS[1][0], 1)) == []
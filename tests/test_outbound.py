@@ -0,0 +1,89 @@
+import pytest
+
+import outbound
+from outbound import OutboundQueue, PRIORITY_CONTROL, PRIORITY_ERROR, PRIORITY_TELEMETRY
+
+
+class Connection:
+    """Takes at most `capacity` bytes per send, then would block."""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.received = bytearray()
+        self.blocked = False
+
+    def sendmsg(self, buffers):
+        if self.blocked:
+            raise BlockingIOError()
+        data = b"".join(bytes(buffer) for buffer in buffers)
+        if self.capacity is not None and len(data) > self.capacity:
+            data = data[:self.capacity]
+            self.blocked = True
+        self.received += data
+        return len(data)
+
+
+def test_classify():
+    assert outbound.classify("P:12.5") == PRIORITY_TELEMETRY
+    assert outbound.classify("T:0,1,2") == PRIORITY_TELEMETRY
+    assert outbound.classify("E:Oops") == PRIORITY_ERROR
+    assert outbound.classify("D:100") == PRIORITY_CONTROL
+    assert outbound.classify("@1 OK") == PRIORITY_CONTROL
+
+
+def test_telemetry_overflow_drops_the_oldest():
+    queue = OutboundQueue(telemetry_limit=3)
+    for index in range(5):
+        assert queue.push(b"P:%d\n" % index, PRIORITY_TELEMETRY)
+    connection = Connection()
+    assert queue.flush(connection)
+    assert bytes(connection.received) == b"P:2\nP:3\nP:4\n"
+    assert queue.dropped == [0, 0, 2]
+    assert not queue.overflowed
+
+
+@pytest.mark.parametrize("priority", [PRIORITY_CONTROL, PRIORITY_ERROR])
+def test_control_and_error_overflow_is_refused_not_dropped(priority):
+    queue = OutboundQueue(control_limit=3, error_limit=3)
+    for index in range(3):
+        assert queue.push(b"%d\n" % index, priority)
+    assert not queue.push(b"3\n", priority)
+    assert queue.overflowed
+    assert queue.dropped == [0, 0, 0]
+    connection = Connection()
+    queue.flush(connection)
+    # Everything that was accepted still goes out, in order.
+    assert bytes(connection.received) == b"0\n1\n2\n"
+
+
+def test_full_telemetry_queue_doesnt_refuse_replies():
+    queue = OutboundQueue(control_limit=2, telemetry_limit=1)
+    queue.push(b"P:1\n", PRIORITY_TELEMETRY)
+    queue.push(b"P:2\n", PRIORITY_TELEMETRY)
+    assert queue.push(b"D:1\n", PRIORITY_CONTROL)
+    assert not queue.overflowed
+
+
+def test_higher_priorities_go_first():
+    queue = OutboundQueue()
+    queue.push(b"P:1\n", PRIORITY_TELEMETRY)
+    queue.push(b"E:x\n", PRIORITY_ERROR)
+    queue.push(b"D:1\n", PRIORITY_CONTROL)
+    connection = Connection()
+    assert queue.flush(connection)
+    assert bytes(connection.received) == b"D:1\nE:x\nP:1\n"
+    assert len(queue) == 0
+
+
+def test_short_write_is_finished_before_anything_else():
+    queue = OutboundQueue()
+    queue.push(b"I:first message\n", PRIORITY_CONTROL)
+    connection = Connection(capacity=5)
+    assert not queue.flush(connection)
+    assert queue.short_sends == 1
+    # A more urgent message arrives, but the half-sent one is completed first.
+    queue.push(b"D:1\n", PRIORITY_CONTROL)
+    connection.blocked = False
+    connection.capacity = None
+    assert queue.flush(connection)
+    assert bytes(connection.received) == b"I:first message\nD:1\n"
@@ -0,0 +1,52 @@
+import pytest
+
+from pressure_control import PIDController, PressureControl, TargetCurve
+
+
+def test_target_curve_interpolates_and_wraps():
+    curve = TargetCurve([0.0, 10.0])
+    assert curve.value_at(0.25) == 5.0
+    assert curve.value_at(0.75) == 5.0
+    assert curve.value_at(1.0) == 0.0
+    with pytest.raises(ValueError):
+        TargetCurve([])
+
+
+def test_pid_holds_the_integral_while_saturated():
+    controller = PIDController(ki=1.0, output_min=-0.5, output_max=0.5)
+    for _ in range(10):
+        assert controller.update(1.0, 0.1) <= 0.5
+    assert controller.output == 0.5
+    assert controller.integral == pytest.approx(0.5)
+    # So it comes off the limit as soon as the error changes sign.
+    assert controller.update(-1.0, 0.1) < 0.5
+
+
+@pytest.mark.parametrize("tick_ms, sample_period_ms", [(10.0, 10.0), (1.0, 0.5), (100.0, 1.0)])
+def test_staleness_limit_follows_the_tick_and_sample_period(tick_ms, sample_period_ms):
+    control = PressureControl(PIDController(kp=0.01), tick_ms=tick_ms, sample_period_ms=sample_period_ms)
+    control.start()
+    limit_ms = tick_ms + sample_period_ms
+    assert control.stale_after_ms == limit_ms
+    control.step(1000.0, 0.0, 1.0, (1000.0 - limit_ms, 750.0))
+    assert control.stale == 0
+    control.step(1000.0 + tick_ms, 0.0, 1.0, (1000.0 - limit_ms, 750.0))
+    assert control.stale == 1
+
+
+def test_set_timing_moves_the_limit():
+    control = PressureControl()
+    control.set_timing(2.0, 1.0)
+    assert control.stale_after_ms == 3.0
+    assert control.min_sample_rate_hz(2.0) == 500.0
+
+
+def test_stale_sample_holds_the_gain():
+    control = PressureControl(PIDController(kp=0.01))
+    control.start()
+    control.step(0.0, 0.0, 1.0, (0.0, 750.0))
+    gain = control.step(10.0, 0.0, 1.0, (10.0, 750.0))
+    assert gain == pytest.approx(1.1)
+    assert control.step(20.0, 0.0, 1.0, None) == gain
+    assert control.step(100.0, 0.0, 1.0, (10.0, 700.0)) == gain
+    assert control.snapshot()["stale"] == 2
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+from pressure_sampler import SampleRing
+
+
+def filled_ring(capacity, count):
+    ring = SampleRing(capacity)
+    for sequence in range(count):
+        ring.append(float(sequence), float(sequence))
+    return ring
+
+
+def test_copy_wraps_around():
+    ring = filled_ring(8, 13)
+    first, timestamps, values = ring.copy(7, 13)
+    assert first == 7
+    assert list(timestamps) == [7.0, 8.0, 9.0, 10.0, 11.0, 12.0]
+    assert list(values) == list(timestamps)
+
+
+def test_copy_keeps_a_slot_of_margin_behind_the_writer():
+    ring = filled_ring(8, 20)
+    # Sample 12 shares its slot with the sample the writer fills next.
+    first, timestamps, values = ring.copy(12, 20)
+    assert first == 13
+    assert list(timestamps) == [13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0]
+
+
+def test_reader_counts_dropped_samples():
+    ring = SampleRing(8)
+    reader = ring.reader()
+    for sequence in range(20):
+        ring.append(float(sequence), float(sequence))
+    timestamps, values = reader.read()
+    assert reader.dropped == 13
+    assert list(values) == [13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0]
+    assert reader.pending == 0
+
+
+def test_reader_max_count_leaves_the_rest():
+    ring = filled_ring(16, 10)
+    reader = ring.reader(from_start=True)
+    assert list(reader.read(max_count=4)[1]) == [0.0, 1.0, 2.0, 3.0]
+    assert list(reader.read()[1]) == [4.0, 5.0, 6.0, 7.0, 8.0, 9.0]
+    assert reader.dropped == 0
+
+
+class PausedWrite:
+    """Stands in for SampleRing.values, stopping the writer between the two halves of a sample."""
+
+    def __init__(self, values):
+        self.values = values
+        self.paused = threading.Event()
+        self.resume = threading.Event()
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __setitem__(self, index, value):
+        self.paused.set()
+        self.resume.wait()
+        self.values[index] = value
+
+
+@pytest.mark.parametrize("written", [4, 5, 7, 8, 11])
+def test_copy_a_lap_behind_a_writer_mid_sample_is_never_torn(written):
+    capacity = 4
+    ring = filled_ring(capacity, written)
+    ring.values = PausedWrite(ring.values)
+    writer = threading.Thread(target=ring.append, args=(float(written), float(written)))
+    writer.start()
+    try:
+        assert ring.values.paused.wait(5.0)
+        # The new timestamp is in its slot, the value and the sequence number aren't yet.
+        assert ring.written == written
+        first, timestamps, values = ring.copy(written - capacity, written)
+    finally:
+        ring.values.resume.set()
+        writer.join()
+    assert first == written - capacity + 1
+    assert list(timestamps) == list(values) == [float(sequence) for sequence in range(first, written)]
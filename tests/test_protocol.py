@@ -0,0 +1,52 @@
+import pytest
+
+import protocol
+from protocol import ProtocolError, Request
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("@17 F 10", ("17", "F", "10")),
+    ("@q-1 Q LOOP\n", ("q-1", "Q", "LOOP")),
+    ("@a_b H", ("a_b", "H", "")),
+    ("@x K   A:abcdef01 ", ("x", "K", "A:abcdef01")),
+])
+def test_parse(line, expected):
+    assert Request(None, line).parse() == expected
+
+
+@pytest.mark.parametrize("line, best_id", [
+    ("@17", "17"),
+    ("@17FQ", "17FQ"),
+    ("@ F 10", "?"),
+    ("@" + "a" * 17 + " F 10", "?"),
+    ("@ok! F 10", "?"),
+])
+def test_malformed_requests(line, best_id):
+    request = Request(None, line)
+    with pytest.raises(ProtocolError) as raised:
+        request.parse()
+    assert raised.value.code == protocol.ERROR_SYNTAX
+    assert request.best_id() == best_id
+
+
+@pytest.mark.parametrize("argument, argument_type, expected", [
+    ("", None, None),
+    ("10", int, 10),
+    ("2.5", float, 2.5),
+    ("any thing", str, "any thing"),
+])
+def test_convert_argument(argument, argument_type, expected):
+    assert protocol.convert_argument(argument, argument_type) == expected
+
+
+@pytest.mark.parametrize("argument, argument_type", [("1", None), ("1.5", int), ("", float), ("x", int)])
+def test_convert_argument_refuses(argument, argument_type):
+    with pytest.raises(ProtocolError) as raised:
+        protocol.convert_argument(argument, argument_type)
+    assert raised.value.code == protocol.ERROR_ARGUMENT
+
+
+def test_replies():
+    assert protocol.ok("7") == "@7 OK\n"
+    assert protocol.reply_line("7", "I:x") == "@7 I:x\n"
+    assert protocol.error("7", protocol.ERROR_FAILED, "no") == "@7 ERR FAILED no\n"
@@ -0,0 +1,107 @@
+import math
+
+import pytest
+
+import pulse_schedule
+from pulse_schedule import DIRECTION_FORWARD, DIRECTION_REVERSE
+
+STEP_PIN = 23
+DIR_PIN = 24
+STEP_MASK = 1 << STEP_PIN
+DIR_MASK = 1 << DIR_PIN
+
+
+def wavy_schedule(ticks=400):
+    """A trajectory with plenty of direction changes, within the limits."""
+    targets = [round(100.0 * math.sin(i / 20.0) + 20.0 * math.sin(i / 3.0)) for i in range(ticks)]
+    return pulse_schedule.compile_schedule(targets, 10.0, 8000.0, 5000.0)
+
+
+def intervals_us(schedule):
+    times = schedule.step_times_us
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_step_edges_round_trip_through_the_emitters(tmp_path):
+    schedule = wavy_schedule()
+    segments = pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, max_pulses=64)
+    assert len(segments) > 1
+    assert sum(segment.steps for segment in segments) == len(schedule)
+
+    memory = pulse_schedule.MemoryWaveEmitter()
+    memory.emit(segments)
+    assert list(pulse_schedule.step_times_from_segments(memory.segments, STEP_PIN)) == list(schedule.step_times_us)
+
+    emitter = pulse_schedule.FileWaveEmitter(str(tmp_path / "waves.bin"))
+    emitter.emit(segments)
+    read = emitter.read()
+    assert [segment.pulses for segment in read] == [segment.pulses for segment in segments]
+    assert [segment.start_us for segment in read] == [segment.start_us for segment in segments]
+    assert list(pulse_schedule.step_times_from_segments(read, STEP_PIN)) == list(schedule.step_times_us)
+
+
+def test_end_position_is_the_final_target():
+    targets = [min(i * 6, 500) for i in range(300)]
+    schedule = pulse_schedule.compile_schedule(targets, 10.0, 8000.0, 5000.0, start_position=-20)
+    assert schedule.end_position == 500
+    assert schedule.end_position == schedule.start_position + sum(schedule.directions)
+    assert schedule.duration_us == 300 * 10000
+
+
+@pytest.mark.parametrize("max_speed", [8000.0, 3000.0, 250.0, 50.0])
+def test_steps_never_exceed_max_speed(max_speed):
+    # Targets far out of reach in both directions, so the speed limit always binds.
+    targets = [10000 if (i // 50) % 2 == 0 else -10000 for i in range(200)]
+    schedule = pulse_schedule.compile_schedule(targets, 10.0, max_speed)
+    assert len(schedule) > 0
+    assert min(intervals_us(schedule)) >= 1000000.0 / max_speed
+    # As fast as allowed while chasing the target, give or take a step per tick.
+    ticks_ahead = 50
+    steps_ahead = sum(1 for time_us in schedule.step_times_us if time_us < ticks_ahead * 10000)
+    assert steps_ahead >= max_speed * ticks_ahead / 100.0 - ticks_ahead
+
+
+def test_direction_change_setup_time_is_respected():
+    schedule = wavy_schedule()
+    assert len(set(schedule.directions)) == 2
+    segments = pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, pulse_us=10, dir_setup_us=25)
+
+    direction = None
+    direction_changed_us = None
+    step_fell_us = 0
+    changes = 0
+    for time_us, on_mask, off_mask in pulse_schedule.segment_edges(segments):
+        if (on_mask | off_mask) & DIR_MASK:
+            assert time_us >= step_fell_us
+            direction = DIRECTION_FORWARD if on_mask & DIR_MASK else DIRECTION_REVERSE
+            direction_changed_us = time_us
+            changes += 1
+        if on_mask & STEP_MASK:
+            assert time_us >= direction_changed_us + 25
+        if off_mask & STEP_MASK:
+            step_fell_us = time_us
+    assert direction == schedule.directions[-1]
+    assert changes == 1 + sum(1 for earlier, later in zip(schedule.directions, schedule.directions[1:])
+                              if earlier != later)
+
+
+@pytest.mark.parametrize("max_pulses", [1, 2, 7, 64, 100000])
+def test_segmenting_keeps_absolute_timing(max_pulses):
+    schedule = wavy_schedule(ticks=100)
+    whole = pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, max_pulses=100000)
+    segments = pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, max_pulses=max_pulses)
+    assert all(len(segment.pulses) <= max_pulses for segment in segments)
+    assert pulse_schedule.segment_edges(segments) == pulse_schedule.segment_edges(whole)
+
+    start_us = 0
+    for segment in segments:
+        assert segment.start_us == start_us
+        start_us += segment.duration_us
+    assert start_us == schedule.duration_us
+
+
+def test_pulse_longer_than_step_interval_is_refused():
+    schedule = pulse_schedule.PulseSchedule([0, 100, 150], [DIRECTION_FORWARD] * 3, 1000)
+    assert len(pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, pulse_us=40)) == 1
+    with pytest.raises(ValueError):
+        pulse_schedule.schedule_to_segments(schedule, STEP_PIN, DIR_PIN, pulse_us=50)
@@ -0,0 +1,80 @@
+import pytest
+
+from RaspberryPiStepperDriver.profiles import DIRECTION_CW
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.ramp_cache import RampTableCache, build_ramp_table
+
+
+def run_move(ramp_cache, acceleration, target_speed, target):
+    """Step a profile to target as AccelStepper would, returning (ramp step number, interval) for each step."""
+    profile = AccelProfile(ramp_cache=ramp_cache)
+    profile.set_acceleration(acceleration)
+    profile.set_target_speed(target_speed)
+    profile._target_steps = target
+    profile.compute_new_speed()
+    steps = []
+    while profile.distance_to_go != 0:
+        profile._current_steps += 1 if profile._direction == DIRECTION_CW else -1
+        profile.compute_new_speed()
+        steps.append((profile._ramp_step_number, profile._step_interval_us))
+    return steps
+
+
+@pytest.mark.parametrize("acceleration, target_speed, target", [
+    (5000.0, 8000.0, 20000),
+    (5000.0, 8000.0, 3000),
+    (1000.0, 2000.0, -5000),
+    (20000.0, 1000.0, 700),
+    (5000.0, 8000.0, 50),
+])
+def test_cached_ramp_matches_equation_13(acceleration, target_speed, target):
+    computed = run_move(None, acceleration, target_speed, target)
+    cached = run_move(RampTableCache(), acceleration, target_speed, target)
+    assert len(cached) == len(computed) == abs(target)
+    # The same decisions to accelerate, cruise and decelerate on every step.
+    assert [n for n, _ in cached] == [n for n, _ in computed]
+
+    accelerating = [(c, e) for (n, c), (_, e) in zip(cached, computed) if n > 0]
+    assert accelerating
+    assert all(c == e for c, e in accelerating)
+
+    decelerating = [(c, e) for (n, c), (_, e) in zip(cached, computed) if n <= 0 and e]
+    assert decelerating
+    # Walking Equation 13 back down drifts from the ramp it went up by, most in
+    # the last steps to standstill; only short ramps drift by more than 1e-4.
+    tolerance = 1e-2 if len(build_ramp_table(acceleration, target_speed, 1 << 20)) < 100 else 1e-4
+    assert all(abs(c - e) <= e * tolerance for c, e in decelerating)
+
+
+def test_deceleration_from_cruise():
+    computed = run_move(None, 1000.0, 2000.0, 5000)
+    cached = run_move(RampTableCache(), 1000.0, 2000.0, 5000)
+    index = next(index for index, (n, _) in enumerate(cached) if n < 0)
+    assert computed[index][1] == pytest.approx(500.1250, abs=1e-4)
+    assert cached[index][1] == pytest.approx(500.0786, abs=1e-4)
+
+
+def test_least_recently_used_table_is_evicted():
+    # Ramps of 101, 401 and 901 delays.
+    lengths = {speed: len(build_ramp_table(5000.0, speed, 1 << 20)) for speed in (1000.0, 2000.0, 3000.0)}
+    cache = RampTableCache(max_entries=sum(lengths.values()) - 1)
+    first = cache.get(5000.0, 1000.0)
+    cache.get(5000.0, 2000.0)
+    assert cache.get(5000.0, 1000.0) is first
+    assert cache.snapshot() == {"tables": 2, "entries": 502, "hits": 1, "misses": 2, "evictions": 0}
+
+    # 2000 steps/s was used least recently, so it goes to make room.
+    cache.get(5000.0, 3000.0)
+    assert cache.snapshot() == {"tables": 2, "entries": 1002, "hits": 1, "misses": 3, "evictions": 1}
+    assert cache.get(5000.0, 1000.0) is first
+    cache.get(5000.0, 2000.0)
+    assert cache.misses == 4
+    assert cache.entries <= cache.max_entries
+
+
+def test_ramps_too_long_are_not_cached():
+    cache = RampTableCache(max_table_length=1000)
+    assert cache.get(5000.0, 8000.0) is None
+    assert len(cache) == 0
+    # The profile falls back to Equation 13 for them.
+    assert run_move(cache, 5000.0, 8000.0, 200) == run_move(None, 5000.0, 8000.0, 200)
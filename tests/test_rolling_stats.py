@@ -0,0 +1,68 @@
+import random
+import statistics
+
+import pytest
+
+from rolling_stats import RollingStats, RollingWindow
+
+
+def test_empty_window():
+    assert RollingWindow(1000.0).snapshot() == {"n": 0}
+
+
+def test_matches_a_direct_computation():
+    generator = random.Random(3)
+    window = RollingWindow(1000.0, buckets=10)
+    values = [760.0 + generator.gauss(0.0, 2.0) for _ in range(900)]
+    for index, value in enumerate(values):
+        window.add(index, value)
+    stats = window.snapshot()
+    assert stats["n"] == 900
+    assert stats["min"] == round(min(values), 3)
+    assert stats["max"] == round(max(values), 3)
+    assert stats["mean"] == pytest.approx(statistics.fmean(values), abs=1e-3)
+    assert stats["std"] == pytest.approx(statistics.pstdev(values), abs=1e-3)
+    bin_width = 1300.0 / 512
+    assert stats["p50"] == pytest.approx(statistics.median(values), abs=bin_width)
+
+
+def test_old_buckets_leave_the_window():
+    window = RollingWindow(1000.0, buckets=10)
+    for time_ms in range(0, 1000):
+        window.add(time_ms, 1.0)
+    for time_ms in range(1000, 1500):
+        window.add(time_ms, 3.0)
+    stats = window.snapshot()
+    assert stats["n"] == 1000
+    assert stats["mean"] == 2.0
+    assert stats["min"] == 1.0
+
+
+def test_snapshot_ends_at_now():
+    window = RollingWindow(1000.0, buckets=10)
+    window.add(0.0, 5.0)
+    assert window.snapshot(500.0)["n"] == 1
+    assert window.snapshot(1000.0) == {"n": 0}
+    # Starting afresh after a gap longer than the window.
+    window.add(5000.0, 7.0)
+    assert window.snapshot()["mean"] == 7.0
+
+
+def test_values_outside_the_histogram_land_in_the_end_bins():
+    window = RollingWindow(1000.0, low=700.0, high=800.0, bins=10)
+    for value in (600.0, 900.0, 900.0):
+        window.add(0.0, value)
+    stats = window.snapshot()
+    assert (stats["min"], stats["max"]) == (600.0, 900.0)
+    assert 790.0 <= stats["p50"] <= stats["p99"] <= 800.0
+
+
+def test_windows():
+    stats = RollingStats((10, 1, 1))
+    assert list(stats.windows) == [1.0, 10.0]
+    stats.add(0.0, 760.0)
+    assert stats.snapshot()[10.0]["n"] == 1
+    with pytest.raises(ValueError):
+        stats.set_windows([0])
+    with pytest.raises(ValueError):
+        stats.set_windows([])
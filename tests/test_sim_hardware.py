@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code):
+    environment = dict(os.environ, PUMPAPP_HARDWARE="sim")
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=environment,
+                          capture_output=True, text=True)
+
+
+def test_driver_package_doesnt_import_the_app():
+    result = run("import sys, RaspberryPiStepperDriver; print('sim_hardware' in sys.modules)")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "False"
+
+
+def test_entry_point_installs_the_simulation_before_the_drivers():
+    result = run("import sim_hardware; print(sim_hardware.select_backend()); "
+                 "from RaspberryPiStepperDriver.accelstepper import AccelStepper; "
+                 "import RPi.GPIO as GPIO; print(GPIO is sim_hardware.hardware.gpio)")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ["sim", "True"]
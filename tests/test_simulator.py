@@ -0,0 +1,85 @@
+import math
+import random
+
+import pytest
+
+from RaspberryPiStepperDriver import simulator
+from RaspberryPiStepperDriver.profiles.accel import AccelProfile
+from RaspberryPiStepperDriver.profiles.max import MaxProfile
+from RaspberryPiStepperDriver.profiles.ramp_cache import RampTableCache
+from RaspberryPiStepperDriver.profiles.rectangle import RectangleProfile
+
+
+def accel_profile():
+    # A cache of its own, so that no test depends on what another left in the default one.
+    profile = AccelProfile(ramp_cache=RampTableCache())
+    profile.set_acceleration(5000.0)
+    profile.set_target_speed(8000.0)
+    return profile
+
+
+def rectangle_profile():
+    profile = RectangleProfile()
+    profile.set_target_speed(3000.0)
+    return profile
+
+
+def max_profile():
+    profile = MaxProfile(acceleration_steps=200, max_start_speed=500.0)
+    profile.set_target_speed(8000.0)
+    return profile
+
+
+PROFILES = [accel_profile, rectangle_profile, max_profile]
+
+
+def traces(trace):
+    return (list(trace.times_us), list(trace.positions), list(trace.intervals_us), list(trace.speeds))
+
+
+def profile_state(profile):
+    return (profile._current_steps, profile._target_steps, profile._step_interval_us, profile._current_speed,
+            getattr(profile, "_ramp_step_number", None))
+
+
+@pytest.mark.parametrize("make_profile", PROFILES)
+@pytest.mark.parametrize("target", [1, 2, 150, 20000, -7000])
+def test_batched_move_matches_stepped(make_profile, target):
+    batched_profile, stepped_profile = make_profile(), make_profile()
+    batched = simulator.simulate_move(batched_profile, target, batch=True)
+    stepped = simulator.simulate_move(stepped_profile, target, batch=False)
+    assert len(stepped) == abs(target)
+    assert traces(batched) == traces(stepped)
+    assert profile_state(batched_profile) == profile_state(stepped_profile)
+
+
+@pytest.mark.parametrize("make_profile", PROFILES)
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_batched_trajectory_matches_stepped(make_profile, seed):
+    rng = random.Random(seed)
+    phase = rng.uniform(0.0, math.pi)
+    targets = [round(rng.uniform(500.0, 3000.0) * math.sin(i / 60.0 + phase) + rng.uniform(-200.0, 200.0))
+               for i in range(400)]
+    batched_profile, stepped_profile = make_profile(), make_profile()
+    batched = simulator.simulate_trajectory(batched_profile, targets, 10, batch=True)
+    stepped = simulator.simulate_trajectory(stepped_profile, targets, 10, batch=False)
+    assert len(stepped) > 0
+    assert traces(batched) == traces(stepped)
+    assert profile_state(batched_profile) == profile_state(stepped_profile)
+
+
+@pytest.mark.parametrize("make_profile", PROFILES)
+@pytest.mark.parametrize("seed", [4, 5])
+def test_batched_matches_stepped_for_any_run_until(make_profile, seed):
+    runs = []
+    for batch in (True, False):
+        simulation = simulator.MotionSimulator(make_profile(), batch)
+        moves = random.Random(seed)
+        end_us = 0.0
+        for _ in range(30):
+            simulation.move_to(moves.randint(-5000, 5000))
+            end_us += moves.uniform(1.0, 200000.0)
+            simulation.run_until(end_us)
+        runs.append(traces(simulation.run_to_completion()))
+    assert len(runs[0][0]) > 0
+    assert runs[0] == runs[1]
@@ -0,0 +1,59 @@
+from RaspberryPiStepperDriver import clock
+from RaspberryPiStepperDriver.clock import VirtualClock
+from RaspberryPiStepperDriver.spin_window import SpinWindow
+
+
+def calibrated(oversleeps_us, **options):
+    window = SpinWindow(**options)
+    for oversleep_us in oversleeps_us:
+        window.record(oversleep_us)
+    return window
+
+
+def test_window_covers_the_usual_oversleep():
+    window = calibrated([200] * 32)
+    assert window.window_us == 300
+
+
+def test_one_late_wake_doesnt_widen_it():
+    window = calibrated([200] * 31 + [15000])
+    assert window.window_us == 300
+    assert window.oversleep_max_us == 15000
+
+
+def test_a_run_of_late_wakes_does():
+    window = calibrated([200] * 24 + [2000] * 8)
+    assert window.window_us == 3000
+
+
+def test_it_narrows_again_once_they_are_forgotten():
+    window = calibrated([2000] * 32)
+    assert window.window_us == 3000
+    for _ in range(32):
+        window.record(100)
+    assert window.window_us == 150
+
+
+def test_limits():
+    assert calibrated([0] * 32).window_us == 50
+    assert calibrated([100000] * 32).window_us == 20000
+
+
+def test_capped_at_a_fraction_of_the_step_interval():
+    window = calibrated([2000] * 32)
+    assert window.window_for(2000) == 500
+    assert window.window_for(100000) == 3000
+    assert window.window_for(None) == 3000
+
+
+def test_sleeps_whole_quanta_on_the_shared_clock():
+    window = calibrated([200] * 32)
+    with clock.using_clock(VirtualClock(start_ns=0)):
+        # 10 ms away less the 300 us window is 9.7 ms, rounded down to 9 ms.
+        assert window.sleep_time_us(10000, 10000) == 9000
+        # 1.2 ms away: less than a millisecond to sleep, so spin.
+        assert window.sleep_time_us(1200, 2000) == 0
+        assert window.sleep_time_us(-5, 2000) == 0
+    fine = calibrated([200] * 32, sleep_quantum_us=1)
+    with clock.using_clock(VirtualClock(start_ns=0)):
+        assert fine.sleep_time_us(10000, 10000) == 9700
@@ -0,0 +1,56 @@
+from RaspberryPiStepperDriver.step_timing import HISTOGRAM_BUCKETS, StepTimingStats
+
+
+def test_known_lateness():
+    timing = StepTimingStats()
+    lateness_us = [3] * 98 + [100, 5000]
+    for step, late_us in enumerate(lateness_us):
+        timing.record(step * 125, late_us, 125.0)
+
+    # 3 us falls in [2, 4), 100 us in [64, 128).
+    assert timing.histogram[2] == 98
+    assert timing.histogram[7] == 1
+    assert timing.histogram[13] == 1
+    assert timing.snapshot() == {
+        "steps": 100,
+        "mean_us": 53.9,
+        "p50_us": 4,
+        "p99_us": 128,
+        "max_us": 5000,
+        "late_steps": 1,
+    }
+    assert timing.percentile_us(0.98) == 4
+    assert timing.percentile_us(1.0) == 5000
+
+
+def test_percentiles_never_exceed_max():
+    timing = StepTimingStats()
+    for late_us in (0, 0, 0, 5):
+        timing.record(0, late_us, 1000.0)
+    assert timing.percentile_us(0.5) == 1
+    assert timing.percentile_us(0.99) == 5
+    assert timing.late_steps == 0
+
+
+def test_off_the_scale_lateness_goes_in_the_last_bucket():
+    timing = StepTimingStats()
+    timing.record(0, 10 ** 9, 1000.0)
+    assert timing.histogram[HISTOGRAM_BUCKETS - 1] == 1
+    assert timing.percentile_us(0.5) == 10 ** 9
+
+
+def test_recent_ring_buffer_wraps():
+    timing = StepTimingStats(recent_capacity=5)
+    for step in range(20):
+        timing.record(step * 100, step, 100.0)
+    # Rounded up to 8 slots.
+    assert timing.recent() == [(step * 100, step) for step in range(12, 20)]
+    assert timing.recent(3) == [(1700, 17), (1800, 18), (1900, 19)]
+
+
+def test_reset():
+    timing = StepTimingStats()
+    timing.record(0, 300, 100.0)
+    timing.reset()
+    assert timing.snapshot() == {"steps": 0, "mean_us": 0.0, "p50_us": 0, "p99_us": 0, "max_us": 0, "late_steps": 0}
+    assert sum(timing.histogram) == 0
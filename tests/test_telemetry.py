@@ -0,0 +1,68 @@
+import socket
+from array import array
+
+import pytest
+
+import telemetry
+
+
+@pytest.fixture
+def udp():
+    udp = telemetry.UdpTelemetry()
+    yield udp
+    udp.close()
+
+
+def test_add_destination_takes_numeric_addresses(udp):
+    assert udp.add_destination("127.0.0.1", "9000") == ("127.0.0.1", 9000)
+    udp.add_destination("127.0.0.1", 9000)
+    assert udp.destinations == [("127.0.0.1", 9000)]
+
+
+@pytest.mark.parametrize("host", ["localhost", "example.invalid", "127.1", "", "::1"])
+def test_add_destination_refuses_names_without_looking_them_up(udp, monkeypatch, host):
+    def lookup(*args):
+        raise AssertionError("looked up " + repr(args))
+    monkeypatch.setattr(socket, "gethostbyname", lookup)
+    monkeypatch.setattr(socket, "getaddrinfo", lookup)
+    with pytest.raises(ValueError):
+        udp.add_destination(host, 9000)
+    assert len(udp) == 0
+
+
+@pytest.mark.parametrize("port", [0, 65536, -1])
+def test_add_destination_checks_the_port(udp, port):
+    with pytest.raises(ValueError):
+        udp.add_destination("127.0.0.1", port)
+
+
+def test_send_numbers_datagrams(udp):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.settimeout(1)
+    try:
+        udp.add_destination("127.0.0.1", listener.getsockname()[1])
+        udp.send(b"P:1\n")
+        udp.send(b"P:2\n")
+        assert listener.recv(100) == b"0\nP:1\n"
+        assert listener.recv(100) == b"1\nP:2\n"
+    finally:
+        listener.close()
+    assert udp.snapshot()["udp_datagrams"] == 2
+
+
+def test_binary_sample_frames_round_trip():
+    framer = telemetry.SampleFramer(binary=True, batch_size=2)
+    frames = framer.encode(10, array('d', [1.0, 1.5, 2.0]), array('d', [750.0, 751.0, 752.0]))
+    assert len(frames) == 2
+    first_sample, decimation, timestamps, values = telemetry.decode_sample_frame(frames[0])
+    assert (first_sample, decimation) == (10, 1)
+    assert list(timestamps) == [1.0, 1.5]
+    assert list(values) == [750.0, 751.0]
+    assert telemetry.decode_sample_frame(frames[1])[0] == 12
+
+
+def test_decimation_keeps_sample_numbers_aligned():
+    framer = telemetry.SampleFramer(decimation=4)
+    frames = framer.encode(3, array('d', range(8)), array('d', range(8)))
+    assert frames == ["T:4,4,1.000;0,1.000;4000,5.000\n"]
@@ -0,0 +1,65 @@
+import pytest
+
+import tick_schedule
+from tick_schedule import TickSchedule
+
+
+def play(schedule, times):
+    """How far advance() moved on at each time."""
+    return [schedule.advance(now_ms) for now_ms in times]
+
+
+def test_lateness_doesnt_add_up():
+    schedule = TickSchedule()
+    schedule.start(0.0, 10.0)
+    assert play(schedule, [0.0, 9.9, 13.0, 20.5, 30.0]) == [1, 0, 1, 1, 1]
+    assert schedule.next_due_ms() == 40.0
+    assert schedule.snapshot()["late_max_ms"] == 3.0
+
+
+def test_catch_up_plays_missed_ticks_back_to_back():
+    schedule = TickSchedule(tick_schedule.OVERRUN_CATCH_UP)
+    schedule.start(0.0, 10.0)
+    assert play(schedule, [0.0, 35.0, 35.0, 35.0, 35.0]) == [1, 1, 1, 1, 0]
+    assert schedule.overruns == 2
+    assert schedule.next_due_ms() == 40.0
+
+
+def test_skip_moves_on_to_the_tick_due_now():
+    schedule = TickSchedule(tick_schedule.OVERRUN_SKIP)
+    schedule.start(0.0, 10.0)
+    assert play(schedule, [0.0, 35.0, 35.0, 40.0]) == [1, 3, 0, 1]
+    assert schedule.skipped == 2
+    assert schedule.phase_error_ms == 0.0
+    assert schedule.phase_error_max_ms == 5.0
+
+
+def test_stretch_moves_the_schedule_back():
+    schedule = TickSchedule(tick_schedule.OVERRUN_STRETCH)
+    schedule.start(0.0, 10.0)
+    assert play(schedule, [0.0, 35.0, 44.0, 45.0]) == [1, 1, 0, 1]
+    assert schedule.stretched_ms == 25.0
+    assert schedule.phase_error_ms == 25.0
+
+
+def test_set_period_keeps_the_next_tick_where_it_was():
+    schedule = TickSchedule()
+    schedule.start(0.0, 10.0)
+    play(schedule, [0.0, 10.0])
+    schedule.set_period(2.5)
+    assert schedule.next_due_ms() == 20.0
+    assert play(schedule, [20.0, 22.4, 22.5]) == [1, 0, 1]
+
+
+def test_long_run_doesnt_drift():
+    schedule = TickSchedule()
+    schedule.start(1000.0, 0.1)
+    for index in range(100000):
+        assert schedule.advance(1000.0 + index * 0.1) == 1
+    assert schedule.next_due_ms() == pytest.approx(1000.0 + 100000 * 0.1, abs=1e-9)
+    assert schedule.overruns == 0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        TickSchedule("LATER")
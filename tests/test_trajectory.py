@@ -0,0 +1,86 @@
+import math
+from array import array
+
+import pytest
+
+import trajectory
+from trajectory import Trajectory
+
+
+def test_compile_targets_and_speeds():
+    playing = Trajectory([10.0, 11.0, 13.5, 10.0])
+    playing.compile(10.0, 4.0, 20.0)
+    assert list(playing.target_steps) == [0, 4, 14, 0]
+    # The first segment runs from the last target, playback loops.
+    assert list(playing.speeds) == [0.0, 200.0, 500.0, 700.0]
+    assert playing.tick(2) == (14, 500.0)
+    assert playing.peak_steps == 14
+    assert playing.tick_ms == 20.0
+    assert playing.compiled_with == (10.0, 4.0, 20.0, trajectory.INTERPOLATION_STEP, 1)
+
+
+def test_empty_trajectory():
+    playing = Trajectory()
+    playing.compile(0.0, 1.0, 10.0)
+    assert len(playing) == 0
+    assert playing.peak_steps == 0
+
+
+def test_step_ignores_subdivisions():
+    playing = Trajectory([0.0, 1.0, 2.0])
+    playing.compile(0.0, 1.0, 10.0, trajectory.INTERPOLATION_STEP, 10)
+    assert len(playing) == 3
+    assert playing.tick_ms == 10.0
+
+
+@pytest.mark.parametrize("subdivisions", [0, trajectory.MAX_SUBDIVISIONS + 1])
+def test_subdivisions_are_checked(subdivisions):
+    with pytest.raises(ValueError):
+        Trajectory([0.0, 1.0]).compile(0.0, 1.0, 10.0, trajectory.INTERPOLATION_LINEAR, subdivisions)
+
+
+def test_linear_interpolation_wraps_around():
+    dense = trajectory.interpolate(array('d', [0.0, 4.0]), trajectory.INTERPOLATION_LINEAR, 4)
+    assert list(dense) == [0.0, 1.0, 2.0, 3.0, 4.0, 3.0, 2.0, 1.0]
+
+
+@pytest.mark.parametrize("mode", [trajectory.INTERPOLATION_CUBIC, trajectory.INTERPOLATION_MONOTONE])
+def test_curves_pass_through_the_samples(mode):
+    samples = array('d', [math.sin(i / 3.0) * 50.0 for i in range(20)])
+    dense = trajectory.interpolate(samples, mode, 5)
+    assert len(dense) == 100
+    assert list(dense[::5]) == pytest.approx(list(samples))
+
+
+def test_monotone_never_overshoots():
+    samples = array('d', [0.0, 0.0, 10.0, 10.0, 5.0])
+    dense = trajectory.interpolate(samples, trajectory.INTERPOLATION_MONOTONE, 10)
+    assert min(dense) >= -1e-9
+    assert max(dense) <= 10.0 + 1e-9
+
+
+def test_interpolated_compile_divides_the_tick():
+    playing = Trajectory([0.0, 10.0, 0.0])
+    playing.compile(0.0, 1.0, 30.0, trajectory.INTERPOLATION_LINEAR, 3)
+    assert len(playing) == 9
+    assert playing.subdivisions == 3
+    assert playing.tick_ms == 10.0
+    assert list(playing.target_steps[:4]) == [0, 3, 7, 10]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        trajectory.interpolate(array('d', [0.0, 1.0]), "spline", 2)
+
+
+@pytest.mark.skipif(trajectory.numpy is None, reason="numpy isn't installed")
+@pytest.mark.parametrize("mode", trajectory.INTERPOLATION_MODES)
+def test_numpy_and_python_agree(monkeypatch, mode):
+    samples = [round(math.sin(i / 7.0) * 40.0, 3) for i in range(200)]
+    with_numpy = Trajectory(samples)
+    with_numpy.compile(1.5, 3.0, 10.0, mode, 4)
+    monkeypatch.setattr(trajectory, "numpy", None)
+    without = Trajectory(samples)
+    without.compile(1.5, 3.0, 10.0, mode, 4)
+    assert list(with_numpy.target_steps) == list(without.target_steps)
+    assert list(with_numpy.speeds) == pytest.approx(list(without.speeds))
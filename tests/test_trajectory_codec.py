@@ -0,0 +1,79 @@
+import struct
+import zlib
+
+import pytest
+
+import trajectory_codec
+from trajectory_codec import FrameError
+
+
+def header(count, length, flags=0, crc=0, magic=trajectory_codec.FRAME_MAGIC):
+    return trajectory_codec.HEADER.pack(magic, trajectory_codec.FRAME_VERSION, trajectory_codec.SAMPLE_FLOAT32,
+                                        flags, count, length, crc)
+
+
+@pytest.mark.parametrize("sample_type", [trajectory_codec.SAMPLE_FLOAT32, trajectory_codec.SAMPLE_INT32])
+@pytest.mark.parametrize("delta", [False, True])
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(sample_type, delta, compress):
+    samples = [0.0, 1.0, -3.0, 1000.0, 1000.0, -2.0e6, 7.0]
+    frame = trajectory_codec.encode_frame(samples, sample_type, delta=delta, compress=compress)
+    assert trajectory_codec.frame_length(frame) == len(frame)
+    assert list(trajectory_codec.decode_frame(frame)) == samples
+
+
+def test_empty_frame():
+    frame = trajectory_codec.encode_frame([], delta=True, compress=True)
+    assert len(trajectory_codec.decode_frame(frame)) == 0
+
+
+def test_frame_length_waits_for_the_header():
+    frame = trajectory_codec.encode_frame([1.0, 2.0])
+    assert trajectory_codec.frame_length(frame[:trajectory_codec.HEADER.size - 1]) is None
+
+
+def test_frame_length_rejects_bad_magic():
+    with pytest.raises(FrameError):
+        trajectory_codec.frame_length(header(1, 4, magic=b"XXXX"))
+
+
+def test_frame_length_rejects_oversized_frames():
+    largest = trajectory_codec.MAX_FRAME_BYTES - trajectory_codec.HEADER.size
+    assert trajectory_codec.frame_length(header(0, largest)) == trajectory_codec.MAX_FRAME_BYTES
+    with pytest.raises(FrameError):
+        trajectory_codec.frame_length(header(0, largest + 1))
+    with pytest.raises(FrameError):
+        trajectory_codec.frame_length(header(0, 0xFFFFFFFF))
+
+
+def test_encode_rejects_too_many_samples():
+    with pytest.raises(FrameError):
+        trajectory_codec.encode_frame(bytes(trajectory_codec.MAX_FRAME_SAMPLES + 1), trajectory_codec.SAMPLE_INT32)
+
+
+def test_decode_rejects_a_compressed_payload_larger_than_its_count():
+    payload = zlib.compress(bytes(4 * 1000))
+    frame = header(10, len(payload), trajectory_codec.FLAG_ZLIB, zlib.crc32(payload)) + payload
+    with pytest.raises(FrameError):
+        trajectory_codec.decode_frame(frame)
+
+
+def test_decode_rejects_too_many_samples():
+    payload = zlib.compress(bytes(16))
+    frame = header(trajectory_codec.MAX_FRAME_SAMPLES + 1, len(payload), trajectory_codec.FLAG_ZLIB,
+                   zlib.crc32(payload)) + payload
+    with pytest.raises(FrameError):
+        trajectory_codec.decode_frame(frame)
+
+
+def test_decode_rejects_corruption():
+    frame = bytearray(trajectory_codec.encode_frame([1.0, 2.0, 3.0]))
+    frame[-1] ^= 0xFF
+    with pytest.raises(FrameError):
+        trajectory_codec.decode_frame(bytes(frame))
+    with pytest.raises(FrameError):
+        trajectory_codec.decode_frame(bytes(frame[:-1]))
+    frame = bytearray(trajectory_codec.encode_frame([1.0]))
+    struct.pack_into("<B", frame, 4, trajectory_codec.FRAME_VERSION + 1)
+    with pytest.raises(FrameError):
+        trajectory_codec.decode_frame(bytes(frame))
@@ -0,0 +1,73 @@
+import os
+from array import array
+
+import pytest
+
+import trajectory_library
+from trajectory import Trajectory
+from trajectory_library import TrajectoryLibrary
+
+
+@pytest.fixture
+def library(tmp_path):
+    return TrajectoryLibrary(str(tmp_path / "library"), resident=2)
+
+
+def test_encode_round_trip():
+    samples = array('d', [0.0, 1.5, -2.25, 1e300, float("inf")])
+    assert trajectory_library.decode(trajectory_library.encode(samples)) == samples
+
+
+def test_add_get_and_resolve(library):
+    name = library.add(Trajectory([1.0, 2.0, 3.0]))
+    assert name == trajectory_library.digest([1.0, 2.0, 3.0])
+    assert library.digests() == [name]
+    assert library.resolve(name[:8].upper()) == name
+    assert library.resolve(name) == name
+    assert list(library.get(name).samples) == [1.0, 2.0, 3.0]
+
+
+def test_get_reads_the_file_once_evicted(library):
+    names = [library.add(Trajectory([float(i)])) for i in range(3)]
+    assert list(library.get(names[0]).samples) == [0.0]
+    assert library.snapshot()["misses"] == 1
+    library.get(names[0])
+    assert library.snapshot()["hits"] == 1
+
+
+def test_short_and_unknown_digests_dont_resolve(library):
+    name = library.add(Trajectory([1.0]))
+    assert library.resolve(name[:7]) is None
+    assert library.resolve("0" * 64) is None
+
+
+def test_corrupt_file_is_refused(library):
+    name = library.add(Trajectory([1.0, 2.0]))
+    other = trajectory_library.encode(array('d', [3.0]))
+    library = TrajectoryLibrary(library.directory)
+    with open(os.path.join(library.directory, name + ".traj"), "wb") as stream:
+        stream.write(other)
+    with pytest.raises(ValueError):
+        library.get(name)
+
+
+MALFORMED = ["../victim", "../../etc/passwd", "abcdef01/../../x", "/abcdef0123", "abcdefgh",
+             "abcdef01\x00", "abcdef01 23", "a" * 65, "", "abc"]
+
+
+@pytest.mark.parametrize("name", MALFORMED)
+def test_malformed_names_never_touch_the_filesystem(library, tmp_path, name):
+    victim = tmp_path / "victim.traj"
+    victim.write_bytes(b"keep")
+    assert library.resolve(name) is None
+    with pytest.raises(KeyError):
+        library.get(name)
+    with pytest.raises(KeyError):
+        library.remove(name)
+    assert victim.read_bytes() == b"keep"
+
+
+def test_stray_files_arent_listed(library):
+    name = library.add(Trajectory([1.0]))
+    open(os.path.join(library.directory, "notes.traj"), "w").close()
+    assert library.digests() == [name]
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import trajectory_codec
+import trajectory_upload
+from mapped_trajectory import MappedTrajectory
+from trajectory_library import digest
+from trajectory_upload import TrajectoryUpload
+
+
+@pytest.mark.parametrize("text, expected", [("", "N"), ("n", "N"), (" E ", "E"), ("120", 120)])
+def test_parse_swap(text, expected):
+    assert trajectory_upload.parse_swap(text) == expected
+
+
+@pytest.mark.parametrize("text", ["-1", "soon"])
+def test_parse_swap_refuses(text):
+    with pytest.raises(ValueError):
+        trajectory_upload.parse_swap(text)
+
+
+def test_text_upload_ends_at_an_empty_line():
+    upload = TrajectoryUpload(trajectory_upload.MODE_TEXT)
+    assert not upload.feed("1.5")
+    assert not upload.feed(trajectory_codec.encode_frame([9.0]))
+    assert not upload.feed(" 2 ")
+    assert upload.feed("")
+    assert list(upload.result().samples) == [1.5, 2.0]
+    assert upload.ignored == 1
+    assert upload.statistics()["samples"] == 2
+
+
+def test_bad_line_fails_the_upload_once_complete():
+    upload = TrajectoryUpload(trajectory_upload.MODE_TEXT)
+    assert not upload.feed("1")
+    assert not upload.feed("one")
+    assert upload.feed("")
+    with pytest.raises(ValueError):
+        upload.result()
+
+
+def test_binary_upload_is_one_frame():
+    upload = TrajectoryUpload(trajectory_upload.MODE_BINARY)
+    assert upload.feed(trajectory_codec.encode_frame([1.0, 2.0, 3.0]))
+    assert list(upload.result().samples) == [1.0, 2.0, 3.0]
+
+
+def test_binary_upload_refuses_a_line():
+    upload = TrajectoryUpload(trajectory_upload.MODE_BINARY)
+    assert upload.feed("1.0")
+    with pytest.raises(ValueError):
+        upload.result()
+
+
+def test_file_upload_mixes_lines_and_frames(tmp_path):
+    path = str(tmp_path / "upload.map")
+    upload = TrajectoryUpload(trajectory_upload.MODE_FILE, path=path)
+    upload.feed("1")
+    upload.feed(trajectory_codec.encode_frame([2.0, 3.0]))
+    upload.feed("4")
+    assert upload.feed("")
+    assert upload.result() == digest([1.0, 2.0, 3.0, 4.0])
+    mapped = MappedTrajectory(path)
+    try:
+        assert len(mapped.samples) == 4
+    finally:
+        mapped.close()
+
+
+def test_abort_removes_the_partial_file(tmp_path):
+    path = str(tmp_path / "upload.map")
+    upload = TrajectoryUpload(trajectory_upload.MODE_FILE, path=path)
+    upload.feed("1")
+    upload.abort()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_sender_is_kept():
+    sender = object()
+    assert TrajectoryUpload(trajectory_upload.MODE_TEXT, sender=sender).sender is sender
+    assert TrajectoryUpload(trajectory_upload.MODE_TEXT).sender is None
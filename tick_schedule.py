@@ -0,0 +1,134 @@
+"""
+Drift-free scheduling of trajectory ticks.
+
+Ticks used to be played whenever tick_ms had passed since the previous one
+was played, so each tick's lateness pushed every later tick back and a
+10 ms trajectory played measurably slow.  A TickSchedule instead puts tick n
+at anchor + n * period_ms, whenever the previous one happened to be played,
+so lateness no longer adds up.
+
+A tick that is a whole period or more late is an overrun, handled by the
+policy:
+
+    OVERRUN_CATCH_UP  play the missed ticks back to back until back on time
+    OVERRUN_SKIP      skip the missed ticks and play the one due now
+    OVERRUN_STRETCH   move the rest of the schedule back by the overrun,
+                      as the old relative timing did
+
+The phase error of a tick is how far from its place on the schedule as
+started it was played, so it includes any stretching.  With catch-up and
+skip, it is back within a tick of zero as soon as an overrun is over,
+however long playback runs.
+"""
+
+OVERRUN_CATCH_UP = "CATCHUP"
+OVERRUN_SKIP = "SKIP"
+OVERRUN_STRETCH = "STRETCH"
+OVERRUN_POLICIES = (OVERRUN_CATCH_UP, OVERRUN_SKIP, OVERRUN_STRETCH)
+
+
+class TickSchedule:
+    """When each trajectory tick is due, and how close to that they were played."""
+
+    def __init__(self, policy=OVERRUN_CATCH_UP):
+        """
+        Arguments:
+          policy (str): One of OVERRUN_POLICIES.
+        """
+        self.set_policy(policy)
+        self.period_ms = 0.0
+        self.running = False
+        self.reset_statistics()
+
+    def set_policy(self, policy):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy: " + str(policy))
+        self.policy = policy
+
+    def reset_statistics(self):
+        self.ticks = 0
+        """Ticks played."""
+        self.skipped = 0
+        """Ticks skipped by OVERRUN_SKIP."""
+        self.overruns = 0
+        self.stretched_ms = 0.0
+        """How far OVERRUN_STRETCH has moved the schedule back."""
+        self.late_total_ms = 0.0
+        self.late_max_ms = 0.0
+        self.phase_error_ms = 0.0
+        """Phase error of the last tick played."""
+        self.phase_error_max_ms = 0.0
+
+    def start(self, now_ms, period_ms):
+        """Start a new schedule with its first tick due at now_ms."""
+        self.period_ms = period_ms
+        self._anchor_ms = now_ms
+        self._index = 0
+        # Where the next tick belongs on the schedule as started, stretching aside.
+        self._ideal_ms = now_ms
+        self.running = True
+        self.reset_statistics()
+
+    def stop(self):
+        self.running = False
+
+    def set_period(self, period_ms):
+        """Change the period from the next tick on, which stays due when it was."""
+        self._anchor_ms = self.next_due_ms()
+        self._index = 0
+        self.period_ms = period_ms
+
+    def next_due_ms(self):
+        return self._anchor_ms + self._index * self.period_ms
+
+    def advance(self, now_ms) -> int:
+        """
+        Work out whether a tick is due at now_ms.
+        Returns 0 if not, otherwise how many ticks to move on by: 1, or more when
+        OVERRUN_SKIP skips some, the last of them being the tick to play.
+        """
+        period_ms = self.period_ms
+        # Multiplied out every time rather than accumulated, so rounding can't drift either.
+        late_ms = now_ms - (self._anchor_ms + self._index * period_ms)
+        if late_ms < 0:
+            return 0
+
+        advance = 1
+        if late_ms >= period_ms > 0:
+            self.overruns += 1
+            if self.policy == OVERRUN_SKIP:
+                # The tick whose slot now_ms falls in.
+                advance = int(late_ms // period_ms) + 1
+                self.skipped += advance - 1
+                self._ideal_ms += (advance - 1) * period_ms
+                late_ms -= (advance - 1) * period_ms
+            elif self.policy == OVERRUN_STRETCH:
+                self._anchor_ms += late_ms
+                self.stretched_ms += late_ms
+        self._index += advance
+
+        self.ticks += 1
+        self.late_total_ms += late_ms
+        if late_ms > self.late_max_ms:
+            self.late_max_ms = late_ms
+        phase_error_ms = now_ms - self._ideal_ms
+        self.phase_error_ms = phase_error_ms
+        if phase_error_ms > self.phase_error_max_ms or -phase_error_ms > self.phase_error_max_ms:
+            self.phase_error_max_ms = abs(phase_error_ms)
+        self._ideal_ms += period_ms
+        return advance
+
+    def snapshot(self) -> dict:
+        ticks = self.ticks
+        return {
+            "policy": self.policy,
+            "period_ms": self.period_ms,
+            "ticks": ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "stretched_ms": round(self.stretched_ms, 3),
+            "late_mean_ms": round(self.late_total_ms / ticks, 3) if ticks else 0.0,
+            "late_max_ms": round(self.late_max_ms, 3),
+            "phase_error_ms": round(self.phase_error_ms, 3),
+            "phase_error_max_ms": round(self.phase_error_max_ms, 3),
+        }
@@ -0,0 +1,210 @@
+"""
+Positional data compiled for playback.
+
+The raw samples uploaded by the client are turned into per-tick stepper
+targets and segment speeds in a single pass whenever one of their inputs
+(the data, home offset, scale multiplier or time step) changes, so playback
+only has to index into contiguous arrays.
+
+Playback can also be smoothed: with an interpolation mode and a number of
+subdivisions, each segment between two samples is split into that many
+ticks of time_step_ms / subdivisions, following a line, a cubic spline
+through the samples, or a monotone cubic (which never overshoots a sample).
+The curves wrap around from the last sample to the first, like playback.
+"""
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INTERPOLATION_STEP = "step"
+"""No interpolation, one tick per sample."""
+INTERPOLATION_LINEAR = "linear"
+INTERPOLATION_CUBIC = "cubic"
+"""Periodic cubic spline, smoothest but may overshoot between samples."""
+INTERPOLATION_MONOTONE = "monotone"
+"""Monotone cubic (Fritsch-Carlson), flat at every peak and trough of the samples."""
+INTERPOLATION_MODES = (INTERPOLATION_STEP, INTERPOLATION_LINEAR, INTERPOLATION_CUBIC, INTERPOLATION_MONOTONE)
+
+MAX_SUBDIVISIONS = 100
+
+
+def _solve_cyclic(right):
+    """
+    Solve m[i-1] + 4 m[i] + m[i+1] = right[i] with the indices wrapping around
+    (the periodic cubic spline system) by Sherman-Morrison and the Thomas algorithm.
+    """
+    count = len(right)
+    gamma = -4.0
+    # Tridiagonal part, with the corners folded into the first and last diagonal entries.
+    diagonal = [4.0] * count
+    diagonal[0] -= gamma
+    diagonal[-1] -= 1.0 / gamma
+
+    def thomas(values):
+        upper = [0.0] * count
+        result = [0.0] * count
+        upper[0] = 1.0 / diagonal[0]
+        result[0] = values[0] / diagonal[0]
+        for i in range(1, count):
+            denominator = diagonal[i] - upper[i - 1]
+            upper[i] = 1.0 / denominator
+            result[i] = (values[i] - result[i - 1]) / denominator
+        for i in range(count - 2, -1, -1):
+            result[i] -= upper[i] * result[i + 1]
+        return result
+
+    x = thomas(right)
+    correction = [0.0] * count
+    correction[0] = gamma
+    correction[-1] = 1.0
+    z = thomas(correction)
+    factor = (x[0] + x[-1] / gamma) / (1.0 + z[0] + z[-1] / gamma)
+    return [xi - factor * zi for xi, zi in zip(x, z)]
+
+
+def _slopes(samples, mode):
+    """Slope at every sample, per sample interval."""
+    count = len(samples)
+    if mode == INTERPOLATION_CUBIC:
+        return _solve_cyclic([3.0 * (samples[(i + 1) % count] - samples[i - 1]) for i in range(count)])
+    # Monotone: harmonic mean of the neighbouring secants, zero at extrema.
+    slopes = []
+    for i in range(count):
+        before = samples[i] - samples[i - 1]
+        after = samples[(i + 1) % count] - samples[i]
+        slopes.append(2.0 * before * after / (before + after) if before * after > 0 else 0.0)
+    return slopes
+
+
+def interpolate(samples, mode, subdivisions):
+    """
+    Densify samples by subdivisions.  The result starts with samples[0] and
+    has subdivisions points per segment, the last segment running back to
+    samples[0].  Returns an array('d').
+    """
+    if mode not in INTERPOLATION_MODES:
+        raise ValueError("Unknown interpolation mode: " + str(mode))
+    if mode == INTERPOLATION_STEP or subdivisions <= 1 or len(samples) < 2:
+        return samples
+    if mode != INTERPOLATION_LINEAR and len(samples) < 3:
+        mode = INTERPOLATION_LINEAR
+
+    count = len(samples)
+    if mode == INTERPOLATION_LINEAR:
+        slopes = None
+    else:
+        slopes = _slopes(samples, mode)
+
+    if numpy is not None:
+        y0 = numpy.frombuffer(samples, dtype=numpy.float64)[:, None]
+        y1 = numpy.roll(y0, -1, axis=0)
+        t = (numpy.arange(subdivisions, dtype=numpy.float64) / subdivisions)[None, :]
+        if slopes is None:
+            dense = y0 + (y1 - y0) * t
+        else:
+            m0 = numpy.asarray(slopes, dtype=numpy.float64)[:, None]
+            m1 = numpy.roll(m0, -1, axis=0)
+            t2 = t * t
+            t3 = t2 * t
+            dense = ((2.0 * t3 - 3.0 * t2 + 1.0) * y0 + (t3 - 2.0 * t2 + t) * m0
+                     + (3.0 * t2 - 2.0 * t3) * y1 + (t3 - t2) * m1)
+        return array('d', numpy.ascontiguousarray(dense).tobytes())
+
+    # Hermite basis for each sub-tick, shared by every segment.
+    basis = []
+    for k in range(subdivisions):
+        t = k / subdivisions
+        t2 = t * t
+        t3 = t2 * t
+        basis.append((2.0 * t3 - 3.0 * t2 + 1.0, t3 - 2.0 * t2 + t, 3.0 * t2 - 2.0 * t3, t3 - t2))
+    dense = array('d')
+    for i in range(count):
+        y0 = samples[i]
+        y1 = samples[(i + 1) % count]
+        if slopes is None:
+            step = (y1 - y0) / subdivisions
+            dense.extend(y0 + step * k for k in range(subdivisions))
+        else:
+            m0 = slopes[i]
+            m1 = slopes[(i + 1) % count]
+            dense.extend(h00 * y0 + h10 * m0 + h01 * y1 + h11 * m1 for h00, h10, h01, h11 in basis)
+    return dense
+
+
+class Trajectory:
+    """Raw samples plus the stepper targets/speeds compiled from them."""
+
+    interpolation_modes = INTERPOLATION_MODES
+    """The interpolation modes compile() accepts."""
+
+    def __init__(self, samples=()):
+        self.samples = samples if isinstance(samples, array) and samples.typecode == 'd' else array('d', samples)
+        """The positional data as uploaded."""
+        self.target_steps = array('q')
+        """The stepper target position for each tick."""
+        self.speeds = array('d')
+        """The speed (steps per second) needed to reach each target from the previous one within one tick."""
+        self.peak_steps = 0
+        """The furthest target from home, in either direction."""
+        self.subdivisions = 1
+        """Ticks per sample."""
+        self.tick_ms = 0.0
+        """The time between ticks."""
+        self.compiled_with = None
+        """The (home_offset, scale_multiplier, time_step_ms, interpolation, subdivisions) the targets were compiled with."""
+
+    def __len__(self):
+        return len(self.target_steps)
+
+    def tick(self, index):
+        """The target step position and speed of tick index."""
+        return self.target_steps[index], self.speeds[index]
+
+    def compile(self, home_offset: float, scale_multiplier: float, time_step_ms: float,
+                interpolation=INTERPOLATION_STEP, subdivisions=1):
+        """
+        Compute target steps and segment speeds for every tick.
+
+        Parameters:
+            home_offset (float): Subtracted from every sample.
+            scale_multiplier (float): Steps per unit of positional data.
+            time_step_ms (float): The time between samples.
+            interpolation (str): One of INTERPOLATION_MODES.
+            subdivisions (int): Ticks per sample when interpolating.
+        """
+        if not 1 <= subdivisions <= MAX_SUBDIVISIONS:
+            raise ValueError("Subdivisions must be 1-" + str(MAX_SUBDIVISIONS))
+        if interpolation == INTERPOLATION_STEP:
+            subdivisions = 1
+        samples = interpolate(self.samples, interpolation, subdivisions)
+        self.subdivisions = subdivisions if len(samples) != len(self.samples) else 1
+        self.tick_ms = time_step_ms / self.subdivisions
+        if len(samples) == 0:
+            self.target_steps = array('q')
+            self.speeds = array('d')
+        elif numpy is not None:
+            self._compile_numpy(samples, home_offset, scale_multiplier, self.tick_ms)
+        else:
+            self._compile_python(samples, home_offset, scale_multiplier, self.tick_ms)
+        self.peak_steps = max(max(self.target_steps), -min(self.target_steps)) if len(self.target_steps) else 0
+        self.compiled_with = (home_offset, scale_multiplier, time_step_ms, interpolation, subdivisions)
+
+    def _compile_numpy(self, samples, home_offset, scale_multiplier, time_step_ms):
+        samples = numpy.frombuffer(samples, dtype=numpy.float64)
+        # numpy.rint rounds half to even, same as round().
+        targets = numpy.rint((samples - home_offset) * scale_multiplier).astype(numpy.int64)
+        # Playback loops, so the first segment starts from the last target.
+        speeds = numpy.abs(targets - numpy.roll(targets, 1)) / (time_step_ms / 1000)
+
+        self.target_steps = array('q', targets.tobytes())
+        self.speeds = array('d', speeds.tobytes())
+
+    def _compile_python(self, samples, home_offset, scale_multiplier, time_step_ms):
+        targets = array('q', [round((sample - home_offset) * scale_multiplier) for sample in samples])
+        time_step_s = time_step_ms / 1000
+        previous = targets[-1:] + targets[:-1]
+        self.target_steps = targets
+        self.speeds = array('d', [abs(target - prior) / time_step_s for target, prior in zip(targets, previous)])
@@ -0,0 +1,170 @@
+"""
+Binary trajectory frames for bulk uploads.
+
+A frame is a fixed header followed by the sample payload:
+
+    magic        4s   b"PPTJ"
+    version      B    FRAME_VERSION
+    sample_type  B    ord('f') for float32, ord('i') for int32
+    flags        H    FLAG_DELTA | FLAG_ZLIB
+    count        I    number of samples
+    length       I    payload length in bytes (after compression)
+    crc32        I    zlib.crc32 of the payload as sent
+
+All fields and samples are little-endian.  With FLAG_DELTA, int32 samples are
+sent as differences from the previous sample and float32 samples as the XOR of
+consecutive bit patterns, both of which are lossless and compress well with
+FLAG_ZLIB.
+
+A frame is at most MAX_FRAME_BYTES long and holds at most MAX_FRAME_SAMPLES,
+compressed or not, so a bad header can't make the receiver buffer or inflate
+gigabytes.  Longer trajectories are sent as several frames (L:F).
+"""
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate
+from operator import xor
+
+FRAME_MAGIC = b"PPTJ"
+FRAME_VERSION = 1
+
+FLAG_DELTA = 0x01
+FLAG_ZLIB = 0x02
+
+SAMPLE_FLOAT32 = ord('f')
+SAMPLE_INT32 = ord('i')
+
+HEADER = struct.Struct("<4sBBHIII")
+
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+"""The longest frame accepted, header included."""
+MAX_FRAME_SAMPLES = (MAX_FRAME_BYTES - HEADER.size) // 4
+
+_INT32_MIN = -(1 << 31)
+_INT32_MAX = (1 << 31) - 1
+
+
+class FrameError(ValueError):
+    """Raised when a trajectory frame is malformed or fails its checksum."""
+
+
+def _to_little_endian(samples: array) -> bytes:
+    if sys.byteorder == 'big':
+        samples = array(samples.typecode, samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def _from_little_endian(typecode: str, payload: bytes) -> array:
+    samples = array(typecode)
+    samples.frombytes(payload)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def frame_length(buffer) -> int:
+    """
+    Return the total length of the frame at the start of buffer, or None if the
+    header hasn't been fully received yet.
+    Raises FrameError if it isn't a frame header or the frame would be longer than MAX_FRAME_BYTES.
+    """
+    if len(buffer) < HEADER.size:
+        return None
+    magic, version, sample_type, flags, count, length, crc = HEADER.unpack_from(buffer)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Bad frame magic")
+    if HEADER.size + length > MAX_FRAME_BYTES:
+        raise FrameError("Frame of " + str(HEADER.size + length) + " bytes is longer than the " +
+                         str(MAX_FRAME_BYTES) + " allowed")
+    return HEADER.size + length
+
+
+def encode_frame(samples, sample_type=SAMPLE_FLOAT32, delta=False, compress=False, level=6) -> bytes:
+    """
+    Encode a sequence of numbers as a trajectory frame.
+
+    Arguments:
+      samples (iterable): The samples to send.
+      sample_type (int): SAMPLE_FLOAT32 or SAMPLE_INT32.
+      delta (bool): Delta encode the samples.
+      compress (bool): zlib compress the payload.
+      level (int): zlib compression level.
+    """
+    if sample_type == SAMPLE_FLOAT32:
+        values = array('f', samples)
+    elif sample_type == SAMPLE_INT32:
+        values = array('i', (int(round(sample)) for sample in samples))
+    else:
+        raise FrameError("Unknown sample type: " + str(sample_type))
+    if len(values) > MAX_FRAME_SAMPLES:
+        raise FrameError("More than " + str(MAX_FRAME_SAMPLES) + " samples, send them as several frames")
+
+    flags = 0
+    if delta and len(values) > 0:
+        flags |= FLAG_DELTA
+        if sample_type == SAMPLE_INT32:
+            deltas = [values[0]]
+            deltas.extend(value - prior for value, prior in zip(values[1:], values))
+            if min(deltas) < _INT32_MIN or max(deltas) > _INT32_MAX:
+                raise FrameError("Sample deltas don't fit in int32")
+            values = array('i', deltas)
+        else:
+            bits = array('I', values.tobytes())
+            values = array('I', bits[:1])
+            values.extend(value ^ prior for value, prior in zip(bits[1:], bits))
+
+    payload = _to_little_endian(values)
+    if compress:
+        flags |= FLAG_ZLIB
+        payload = zlib.compress(payload, level)
+
+    header = HEADER.pack(FRAME_MAGIC, FRAME_VERSION, sample_type, flags,
+                         len(values), len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def decode_frame(frame) -> array:
+    """
+    Decode a trajectory frame into an array('d') of samples.
+    Raises FrameError if the frame is truncated, corrupt or of an unknown kind.
+    """
+    if len(frame) < HEADER.size:
+        raise FrameError("Truncated frame header")
+    magic, version, sample_type, flags, count, length, crc = HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Bad frame magic")
+    if version != FRAME_VERSION:
+        raise FrameError("Unsupported frame version: " + str(version))
+    if len(frame) != HEADER.size + length:
+        raise FrameError("Frame length mismatch")
+    if len(frame) > MAX_FRAME_BYTES or count > MAX_FRAME_SAMPLES:
+        raise FrameError("Frame too large")
+
+    payload = bytes(frame[HEADER.size:])
+    if zlib.crc32(payload) != crc:
+        raise FrameError("Frame checksum mismatch")
+    if flags & FLAG_ZLIB:
+        try:
+            # No more than the samples it claims to hold, however well they compress.
+            decompressor = zlib.decompressobj()
+            payload = decompressor.decompress(payload, count * 4 + 1)
+        except zlib.error as e:
+            raise FrameError("Bad compressed payload: " + str(e))
+    if len(payload) != count * 4:
+        raise FrameError("Expected " + str(count) + " samples")
+
+    if sample_type == SAMPLE_INT32:
+        values = _from_little_endian('i', payload)
+        if flags & FLAG_DELTA:
+            values = accumulate(values)
+        return array('d', values)
+    elif sample_type == SAMPLE_FLOAT32:
+        if flags & FLAG_DELTA:
+            bits = array('I', accumulate(_from_little_endian('I', payload), xor))
+            payload = bits.tobytes()
+            return array('d', array('f', payload))
+        return array('d', _from_little_endian('f', payload))
+    raise FrameError("Unknown sample type: " + str(sample_type))
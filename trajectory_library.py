@@ -0,0 +1,197 @@
+"""
+Content-addressed store of uploaded trajectories.
+
+Every upload is saved on disk under the SHA-256 of its samples, so a client
+can ask whether the device already has a trajectory and activate it instead
+of uploading it again.  The digest is taken over the samples as
+little-endian float64, exactly as parsed from the upload, so a client can
+compute it before sending anything.
+
+Files hold the float64 bit patterns XORed with the previous sample's and
+zlib compressed (lossless, and smooth data compresses well), behind a small
+header:
+
+    magic        4s   b"PPTL"
+    version      B    LIBRARY_VERSION
+    reserved     3x
+    count        I    number of samples
+
+The most recently used trajectories are also kept in memory, compiled, so
+switching between them takes no time at all.
+
+Uploads are stored from the upload worker thread while the main loop may be
+activating another trajectory, so the resident trajectories are guarded by
+a lock, held only to look them up or update them.
+"""
+import hashlib
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from operator import xor
+
+from trajectory import Trajectory
+
+LIBRARY_MAGIC = b"PPTL"
+LIBRARY_VERSION = 1
+HEADER = struct.Struct("<4sB3xI")
+FILE_SUFFIX = ".traj"
+MIN_PREFIX_LENGTH = 8
+DIGEST_LENGTH = 64
+
+_DIGEST = re.compile("[0-9a-f]{%d}" % DIGEST_LENGTH)
+_PREFIX = re.compile("[0-9a-f]{%d,%d}" % (MIN_PREFIX_LENGTH, DIGEST_LENGTH))
+
+DIRECTORY_ENVIRONMENT_VARIABLE = "PUMPAPP_LIBRARY"
+
+
+def default_directory():
+    return os.environ.get(DIRECTORY_ENVIRONMENT_VARIABLE,
+                          os.path.join(os.path.expanduser("~"), ".pumpapp", "trajectories"))
+
+
+def _little_endian(samples: array) -> bytes:
+    if sys.byteorder == 'big':
+        samples = array(samples.typecode, samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def digest(samples) -> str:
+    """Hex SHA-256 of the samples as little-endian float64."""
+    if not (isinstance(samples, array) and samples.typecode == 'd'):
+        samples = array('d', samples)
+    return hashlib.sha256(_little_endian(samples)).hexdigest()
+
+
+def encode(samples: array) -> bytes:
+    bits = array('Q', samples.tobytes())
+    deltas = array('Q', bits[:1])
+    deltas.extend(value ^ prior for value, prior in zip(bits[1:], bits))
+    return HEADER.pack(LIBRARY_MAGIC, LIBRARY_VERSION, len(samples)) + zlib.compress(_little_endian(deltas))
+
+
+def decode(data: bytes) -> array:
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != LIBRARY_MAGIC or version != LIBRARY_VERSION:
+        raise ValueError("Not a version %d library file" % LIBRARY_VERSION)
+    deltas = array('Q')
+    deltas.frombytes(zlib.decompress(data[HEADER.size:]))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    if len(deltas) != count:
+        raise ValueError("Expected %d samples, found %d" % (count, len(deltas)))
+    return array('d', array('Q', accumulate(deltas, xor)).tobytes())
+
+
+class TrajectoryLibrary:
+    """Trajectories on disk by digest, plus the most recently used ones in memory."""
+
+    def __init__(self, directory=None, resident=4):
+        """
+        Arguments:
+          directory (str): Where to keep the files, see default_directory().
+          resident (int): Trajectories to keep loaded and compiled.
+        """
+        self.directory = default_directory() if directory is None else directory
+        self.resident = resident
+        self._loaded = OrderedDict()
+        """digest -> Trajectory, least recently used first."""
+        self.hits = 0
+        """Activations served from memory."""
+        self.misses = 0
+        """Activations that had to read the file."""
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        # Names come from clients: only ever make a path out of a digest.
+        if not isinstance(name, str) or not _DIGEST.fullmatch(name):
+            raise KeyError(name)
+        return os.path.join(self.directory, name + FILE_SUFFIX)
+
+    def _remember(self, name, trajectory):
+        with self._lock:
+            self._loaded[name] = trajectory
+            self._loaded.move_to_end(name)
+            while len(self._loaded) > self.resident:
+                self._loaded.popitem(last=False)
+
+    def digests(self):
+        """Every stored digest, sorted."""
+        names = (entry[:-len(FILE_SUFFIX)] for entry in os.listdir(self.directory) if entry.endswith(FILE_SUFFIX))
+        return sorted(name for name in names if _DIGEST.fullmatch(name))
+
+    def resolve(self, prefix):
+        """
+        The full digest starting with prefix, or None if there isn't exactly one.
+        Prefixes must be MIN_PREFIX_LENGTH to DIGEST_LENGTH hex digits.
+        """
+        prefix = prefix.strip().lower()
+        if not _PREFIX.fullmatch(prefix):
+            return None
+        if len(prefix) == DIGEST_LENGTH:
+            return prefix if prefix in self._loaded or os.path.exists(self._path(prefix)) else None
+        matches = [name for name in self.digests() if name.startswith(prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def add(self, trajectory: Trajectory) -> str:
+        """Store an uploaded trajectory (if it isn't already) and keep it resident.  Returns its digest."""
+        name = digest(trajectory.samples)
+        path = self._path(name)
+        if not os.path.exists(path):
+            # Write then rename, so a power cut never leaves a truncated file under a valid digest.
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as stream:
+                stream.write(encode(trajectory.samples))
+            os.replace(temporary, path)
+        self._remember(name, trajectory)
+        return name
+
+    def get(self, name) -> Trajectory:
+        """
+        The trajectory with the given digest, from memory if it is resident.
+        Raises KeyError if it isn't stored (or isn't a digest), ValueError if the file is corrupt.
+        """
+        path = self._path(name)
+        with self._lock:
+            trajectory = self._loaded.get(name)
+            if trajectory is not None:
+                self.hits += 1
+                self._loaded.move_to_end(name)
+                return trajectory
+
+        try:
+            with open(path, "rb") as stream:
+                samples = decode(stream.read())
+        except FileNotFoundError:
+            raise KeyError(name)
+        if digest(samples) != name:
+            raise ValueError("Stored trajectory " + name + " doesn't match its digest")
+        self.misses += 1
+        trajectory = Trajectory(samples)
+        self._remember(name, trajectory)
+        return trajectory
+
+    def remove(self, name):
+        """Delete the trajectory with the given digest.  Raises KeyError if it isn't stored (or isn't a digest)."""
+        path = self._path(name)
+        with self._lock:
+            self._loaded.pop(name, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def snapshot(self) -> dict:
+        return {
+            "stored": len(self.digests()),
+            "resident": len(self._loaded),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
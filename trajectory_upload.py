@@ -0,0 +1,161 @@
+"""
+Trajectory uploads, received a line or frame at a time.
+
+An upload used to be read in a loop of its own until it was complete, so
+playback, telemetry and outgoing writes all stopped until the client had
+sent the last sample.  A TrajectoryUpload is instead fed whatever the main
+loop has received on each pass, up to a budget, and builds the new
+trajectory in a back buffer while the current one keeps playing.  Once it
+is complete the new trajectory is compiled and waits for its swap:
+
+    SWAP_NOW       as soon as it is ready (the default, as before)
+    SWAP_BOUNDARY  when playback next wraps around to the first tick
+    an int         when playback reaches that tick of the current trajectory,
+                   carrying on from the same tick of the new one
+
+A swap only replaces the trajectory being played between two ticks, so
+playback never sees half of an upload.
+"""
+import time
+from array import array
+
+import trajectory_codec
+from mapped_trajectory import MappedTrajectoryWriter
+from trajectory import Trajectory
+
+MODE_TEXT = "text"
+"""One ASCII sample per line, until an empty line."""
+MODE_BINARY = "binary"
+"""A single binary trajectory frame."""
+MODE_FILE = "file"
+"""ASCII samples and/or binary trajectory frames until an empty line, streamed to a MappedTrajectory file."""
+
+SWAP_NOW = "N"
+SWAP_BOUNDARY = "E"
+
+
+def parse_swap(text):
+    """
+    Parse when an upload should be swapped in: "N" (now), "E" (at the end of the
+    current cycle) or a tick index.  Raises ValueError for anything else.
+    """
+    text = text.strip().upper()
+    if text in ("", SWAP_NOW):
+        return SWAP_NOW
+    if text == SWAP_BOUNDARY:
+        return SWAP_BOUNDARY
+    index = int(text)
+    if index < 0:
+        raise ValueError("swap index must not be negative")
+    return index
+
+
+class TrajectoryUpload:
+    """An upload in progress."""
+
+    def __init__(self, mode, swap_at=SWAP_NOW, path=None, sender=None):
+        """
+        Arguments:
+          mode (str): MODE_TEXT, MODE_BINARY or MODE_FILE.
+          swap_at: SWAP_NOW, SWAP_BOUNDARY or a tick index, see the module docstring.
+          path (str): The file to stream a MODE_FILE upload to.
+          sender: The client sending the upload, or None.
+        """
+        self.mode = mode
+        self.swap_at = swap_at
+        self.sender = sender
+        """Only what this client sends is fed to the upload; anything from the others is a command."""
+        self.samples = array('d')
+        """The back buffer, for MODE_TEXT and MODE_BINARY."""
+        self.writer = MappedTrajectoryWriter(path) if mode == MODE_FILE else None
+        self.byte_count = 0
+        self.items = 0
+        """Lines and frames received."""
+        self.ignored = 0
+        """Binary frames received during a text upload, which are skipped."""
+        self.error = None
+        """The first bad line or frame; the upload is discarded once it is complete."""
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def __len__(self):
+        return len(self.writer) if self.writer is not None else len(self.samples)
+
+    def feed(self, item) -> bool:
+        """Take the next received line (str) or frame (bytes).  Returns True once the upload is complete."""
+        self.items += 1
+        if isinstance(item, bytes):
+            self.byte_count += len(item)
+            if self.mode == MODE_TEXT:
+                self.ignored += 1
+                return False
+            try:
+                samples = trajectory_codec.decode_frame(item)
+            except trajectory_codec.FrameError as e:
+                self._fail(ValueError("Bad trajectory frame: " + str(e)))
+                # A file upload carries on to the empty line.
+                return self._finish() if self.mode == MODE_BINARY else False
+            if self.writer is not None:
+                self.writer.extend(samples)
+                return False
+            self.samples = samples
+            return self._finish()
+
+        self.byte_count += len(item) + 1
+        if self.mode == MODE_BINARY:
+            self._fail(ValueError("Expected a binary trajectory frame, got: " + item.strip()))
+            return self._finish()
+        line = item.strip()
+        if len(line) == 0:
+            # The end of the data.
+            return self._finish()
+        try:
+            sample = float(line)
+        except ValueError as e:
+            self._fail(e)
+            return False
+        if self.writer is not None:
+            self.writer.append(sample)
+        else:
+            self.samples.append(sample)
+        return False
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+
+    def _finish(self):
+        self.finished_at = time.perf_counter()
+        return True
+
+    def result(self):
+        """
+        The uploaded trajectory, uncompiled: a Trajectory, or for MODE_FILE the
+        digest of the samples in the finished file.
+        Raises the first error met while receiving (ValueError) or OSError.
+        """
+        if self.error is not None:
+            self.abort()
+            raise self.error
+        if self.writer is not None:
+            self.writer.close()
+            return self.writer.digest()
+        return Trajectory(self.samples)
+
+    def abort(self):
+        """Throw away what has been received."""
+        if self.writer is not None:
+            self.writer.discard()
+        self.samples = array('d')
+
+    def statistics(self) -> dict:
+        elapsed_s = max((self.finished_at or time.perf_counter()) - self.started_at, 1e-9)
+        sample_count = len(self)
+        return {
+            "mode": self.mode,
+            "samples": sample_count,
+            "bytes": self.byte_count,
+            "ms": round(elapsed_s * 1000.0, 3),
+            "samples_per_s": round(sample_count / elapsed_s, 1),
+            "kb_per_s": round(self.byte_count / elapsed_s / 1024.0, 1),
+        }